@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2021 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of AirWatcher.
+#
+# AirWatcher is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# AirWatcher is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import struct
+from datetime import datetime, timedelta
+
+"""
+Packs long series of readings into small blobs, the same tricks the Gorilla paper from Facebook uses for their time
+series database. Timestamps are stored as the difference of the difference to the one before, for readings every 10
+seconds that is almost always zero or a few milliseconds of jitter and takes one to two dozen bits instead of a 26
+character string. Values are XORed with their predecessor, slow signals share sign, exponent and the first bits of the
+mantissa with the value before and only the bits in the middle that actually changed get written.
+
+Both are lossless, a decoded value is bit for bit the float that went in. The catch is that the sensors deliver floats
+with a lot more digits than they can actually resolve, and noise in the last bits of the mantissa does not compress.
+So values can optionally be rounded to a number of decimals, then they are stored as integers and only the difference
+to the one before gets written, a temperature that moves by a hundredth of a degree costs a handful of bits.
+
+Pure python, a day of 10 second readings takes a few hundredths of a second per column either way.
+"""
+
+_double = struct.Struct(">d")
+_unsigned = struct.Struct(">Q")
+_epoch = datetime(1970, 1, 1)
+
+# prefix, prefix length and payload bits for the delta of delta of two timestamps (zigzag encoded microseconds),
+# zero is a single '0' bit
+_dod_buckets = ((0b10, 2, 12), (0b110, 3, 20), (0b1110, 4, 32), (0b1111, 4, 64))
+# same for the difference of two rounded values
+_delta_buckets = ((0b10, 2, 6), (0b110, 3, 13), (0b1110, 4, 24), (0b1111, 4, 64))
+# flags in the first byte of a value chunk
+_with_nulls = 1
+_scaled = 2
+
+
+class BitWriter:
+    def __init__(self):
+        self.buffer = bytearray()
+        self._current = 0
+        self._bits = 0
+
+    def write(self, value: int, bits: int):
+        """
+        Appends the lowest `bits` bits of value, most significant first
+        """
+        self._current = (self._current << bits) | (value & ((1 << bits) - 1))
+        self._bits += bits
+        while self._bits >= 8:
+            self._bits -= 8
+            self.buffer.append((self._current >> self._bits) & 0xFF)
+        self._current &= (1 << self._bits) - 1
+
+    def to_bytes(self) -> bytes:
+        """
+        :returns: everything written so far, the last byte is filled up with zeros
+        """
+        if self._bits:
+            return bytes(self.buffer) + bytes([(self._current << (8 - self._bits)) & 0xFF])
+        return bytes(self.buffer)
+
+
+class BitReader:
+    def __init__(self, data: bytes, offset=0):
+        self.data = data
+        self._position = offset
+        self._current = 0
+        self._bits = 0
+
+    def read(self, bits: int) -> int:
+        while self._bits < bits:
+            self._current = (self._current << 8) | self.data[self._position]  # IndexError if the blob is cut short
+            self._position += 1
+            self._bits += 8
+        self._bits -= bits
+        value = self._current >> self._bits
+        self._current &= (1 << self._bits) - 1
+        return value
+
+
+def _zigzag(value: int) -> int:
+    # maps signed to unsigned so that small negative numbers stay small: 0, -1, 1, -2 -> 0, 1, 2, 3
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value // 2 if not value & 1 else -(value + 1) // 2
+
+
+def _write_bucketed(writer: BitWriter, value: int, buckets: tuple):
+    value = _zigzag(value)
+    if value == 0:
+        writer.write(0, 1)
+        return
+    for prefix, prefix_bits, bits in buckets:
+        if value < (1 << bits):
+            writer.write(prefix, prefix_bits)
+            writer.write(value, bits)
+            return
+    raise ValueError(f"archive: {value} does not fit into 64 bits")
+
+
+def _read_bucketed(reader: BitReader, buckets: tuple) -> int:
+    if not reader.read(1):
+        return 0
+    prefix_bits = 1
+    while prefix_bits < 4 and reader.read(1):
+        prefix_bits += 1
+    return _unzigzag(reader.read(buckets[prefix_bits - 1][2]))
+
+
+def to_microseconds(timepoint: datetime) -> int:
+    delta = timepoint - _epoch
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_microseconds(value: int) -> datetime:
+    return _epoch + timedelta(microseconds=value)
+
+
+def encode_timestamps(stamps: list) -> bytes:
+    """
+    Delta of delta encoding of sorted timestamps
+
+    :param list stamps: microseconds since the epoch as int, see to_microseconds()
+    :rtype: bytes
+    """
+    writer = BitWriter()
+    previous, delta = None, 0
+    for stamp in stamps:
+        if previous is None:
+            writer.write(_zigzag(stamp), 64)
+            previous = stamp
+            continue
+        new_delta = stamp - previous
+        _write_bucketed(writer, new_delta - delta, _dod_buckets)
+        previous, delta = stamp, new_delta
+    return writer.to_bytes()
+
+
+def decode_timestamps(data: bytes, count: int) -> list:
+    """
+    Inverse of encode_timestamps(), count is the number of timestamps that went in
+    """
+    reader = BitReader(data)
+    stamps = []
+    previous, delta = None, 0
+    for _ in range(count):
+        if previous is None:
+            previous = _unzigzag(reader.read(64))
+            stamps.append(previous)
+            continue
+        delta += _read_bucketed(reader, _dod_buckets)
+        previous += delta
+        stamps.append(previous)
+    return stamps
+
+
+def encode_floats(values: list, decimals=None) -> bytes:
+    """
+    XOR encoding of a series of floats, None is allowed and costs one bit; the first byte tells if there are any and
+    which of the two encodings is used
+
+    :param list values: floats, ints or None
+    :param int decimals: round to that many decimals and store the differences instead, lossy but a lot smaller. Has
+    no effect if there is something like inf or nan in the values
+    :rtype: bytes
+    """
+    with_nulls = any(value is None for value in values)
+    writer = BitWriter()
+    if decimals is not None:
+        scale = 10 ** decimals
+        try:
+            scaled = [None if value is None else round(value * scale) for value in values]
+        except (OverflowError, ValueError):
+            scaled = None
+        if scaled is not None and all(value is None or abs(value) < 1 << 62 for value in scaled):
+            writer.write(_scaled | (_with_nulls if with_nulls else 0), 8)
+            writer.write(decimals, 8)
+            previous = 0
+            for value in scaled:
+                if with_nulls:
+                    writer.write(0 if value is None else 1, 1)
+                    if value is None:
+                        continue
+                _write_bucketed(writer, value - previous, _delta_buckets)
+                previous = value
+            return writer.to_bytes()
+    writer.write(_with_nulls if with_nulls else 0, 8)
+    previous = None
+    leading, trailing = -1, -1  # window of meaningful bits of the last xor that was written in full
+    for value in values:
+        if with_nulls:
+            writer.write(0 if value is None else 1, 1)
+            if value is None:
+                continue
+        bits = _unsigned.unpack(_double.pack(value))[0]
+        if previous is None:
+            writer.write(bits, 64)
+            previous = bits
+            continue
+        xor = bits ^ previous
+        previous = bits
+        if not xor:
+            writer.write(0, 1)
+            continue
+        writer.write(1, 1)
+        new_leading = min(64 - xor.bit_length(), 31)
+        new_trailing = (xor & -xor).bit_length() - 1
+        if leading >= 0 and new_leading >= leading and new_trailing >= trailing:
+            writer.write(0, 1)
+            writer.write(xor >> trailing, 64 - leading - trailing)
+        else:
+            leading, trailing = new_leading, new_trailing
+            length = 64 - leading - trailing
+            writer.write(1, 1)
+            writer.write(leading, 5)
+            writer.write(length - 1, 6)
+            writer.write(xor >> trailing, length)
+    return writer.to_bytes()
+
+
+def chunk_decimals(data: bytes):
+    """
+    :returns: the decimals a chunk of encode_floats() was rounded to, None if it is lossless
+    """
+    return data[1] if data[0] & _scaled else None
+
+
+def decode_floats(data: bytes, count: int) -> list:
+    """
+    Inverse of encode_floats(), count is the number of values that went in (including the None)
+    """
+    with_nulls = bool(data[0] & _with_nulls)
+    values = []
+    if data[0] & _scaled:
+        scale = 10 ** data[1]
+        reader = BitReader(data, 2)
+        current = 0
+        for _ in range(count):
+            if with_nulls and not reader.read(1):
+                values.append(None)
+                continue
+            current += _read_bucketed(reader, _delta_buckets)
+            values.append(current / scale)
+        return values
+    reader = BitReader(data, 1)
+    previous = None
+    leading, trailing = 0, 0
+    for _ in range(count):
+        if with_nulls and not reader.read(1):
+            values.append(None)
+            continue
+        if previous is None:
+            previous = reader.read(64)
+        elif reader.read(1):
+            if reader.read(1):
+                leading = reader.read(5)
+                trailing = 64 - leading - reader.read(6) - 1
+            previous ^= reader.read(64 - leading - trailing) << trailing
+        values.append(_double.unpack(_unsigned.pack(previous))[0])
+    return values
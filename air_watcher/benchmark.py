@@ -0,0 +1,604 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2021 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of AirWatcher.
+#
+# AirWatcher is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# AirWatcher is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import argparse
+import copy
+import json
+import logging
+import math
+import os
+import platform
+import random
+import re
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import wave
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import numpy
+
+from sensors import SensorBundle
+from local_database import LocalCache, _columns, _select_columns, sensor_precision
+from sparkline import audio_sparklines, directory_sparklines
+
+logger = logging.getLogger(__name__)
+
+"""
+Benchmarks for the parts that get slow when the history grows: writing into the LocalCache, reading it back and turning
+it into pictures. Everything runs on synthetic data that is derived from the demo values of the SensorBundle plus some
+noise, seeded so two runs on the same machine see exactly the same data. The result is a json document that can be
+diffed against an older run, see compare_results()
+
+python3 benchmark.py --sizes day,week --output bench.json
+python3 benchmark.py --compare old.json new.json
+
+--stress runs a different thing, a LocalCache shared by writer and reader threads for a while, checking that no
+operation fails and that every reader always sees a consistent database, see stress_test()
+
+python3 benchmark.py --stress 30 --readers 4 --writers 2
+"""
+
+# history sizes in days
+sizes = {
+    'day': 1,
+    'week': 7,
+    'month': 30,
+    'year': 365
+}
+
+
+def synthetic_history(days: float, interval=300, seed=42, start=None) -> dict:
+    """
+    Creates a history in the same format as values.json, the demo values of the SensorBundle are taken as baseline,
+    temperature and light follow the sun, everything else wobbles a bit and particles get the occasional spike
+
+    :param float days: length of the history
+    :param int interval: seconds between two samples
+    :param int seed: seed for the random generator, same seed gives same history
+    :param datetime start: first timestamp, defaults to days before the 1st of January 2022 to stay reproducible
+    :returns: dictionary of the format { 'iso_string' : {'gas': {}, 'particles': {}, ...}, ...}
+    :rtype: dict
+    """
+    rng = random.Random(seed)
+    bundle = SensorBundle(demo=True)
+    base = bundle.get_all(one_shot=False, condensed=True)
+    if not start:
+        start = datetime(2022, 1, 1) - timedelta(days=days)
+    history = {}
+    for i in range(int(days * 86400 / interval)):
+        timepoint = start + timedelta(seconds=i * interval)
+        sun = math.sin((timepoint.hour * 3600 + timepoint.minute * 60) / 86400 * 2 * math.pi - math.pi / 2)
+        spike = 20 if rng.random() < 0.01 else 0
+        gas = {key: value * rng.gauss(1, 0.05) for key, value in base['gas'].items() if value is not None}
+        history[timepoint.isoformat()] = {
+            'gas': gas,
+            'approx_gas': bundle.approx_gas_readings(gas),
+            'particles': {'m3': {'atmo': {
+                key: max(0, int(value + spike + rng.gauss(0, 1)))
+                for key, value in base['particles']['m3']['atmo'].items()
+            }}},
+            'weather': {
+                'temperature': base['weather']['temperature'] + 3 * sun + rng.gauss(0, 0.2),
+                'pressure': base['weather']['pressure'] + rng.gauss(0, 0.5),
+                'humidity': base['weather']['humidity'] - 5 * sun + rng.gauss(0, 1),
+                'altitude': base['weather']['altitude']
+            },
+            'light': {
+                'lux': max(0.0, base['light']['lux'] * (sun + 0.2) + rng.gauss(0, 5)),
+                'proximity': 0,
+                'ir': max(0, int(base['light']['ir'] * (sun + 0.2) + rng.gauss(0, 5)))
+            },
+            'noise': {  # demo mode has no noise readings, so those are made up
+                '20-1K': abs(rng.gauss(0.3, 0.1)),
+                '1K-3K': abs(rng.gauss(0.1, 0.05)),
+                '3K-8K': abs(rng.gauss(0.05, 0.02))
+            }
+        }
+    return history
+
+
+def synthetic_wave(file_path: str, duration=10, sample_rate=16000, seed=42):
+    """
+    Writes a mono 16 bit wave file with a few sine tones and noise, the same thing record_audio() would write
+    """
+    rng = numpy.random.default_rng(seed)
+    t = numpy.arange(int(duration * sample_rate)) / sample_rate
+    signal = numpy.sin(2 * numpy.pi * 440 * t) * (0.5 + 0.5 * numpy.sin(2 * numpy.pi * 0.3 * t))
+    signal += 0.3 * numpy.sin(2 * numpy.pi * 2500 * t) + 0.1 * rng.standard_normal(len(t))
+    data = (signal / numpy.abs(signal).max() * numpy.iinfo(numpy.int16).max).astype(numpy.int16)
+    with wave.open(file_path, mode='wb') as wb:
+        wb.setnchannels(1)
+        wb.setsampwidth(2)
+        wb.setframerate(sample_rate)
+        wb.writeframes(data.tobytes())
+
+
+def _timed(func, repeat=3) -> dict:
+    """
+    Runs func `repeat` times and gives back the min and median time in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        epoch = perf_counter()
+        func()
+        timings.append(perf_counter() - epoch)
+    return {'min_s': min(timings), 'median_s': statistics.median(timings), 'repeat': repeat}
+
+
+def _fresh_db(folder: str, name: str) -> LocalCache:
+    path = os.path.join(folder, name)
+    if os.path.exists(path):
+        os.remove(path)
+    return LocalCache(path)
+
+
+def run_benchmarks(size_names: list, interval=300, seed=42, repeat=3, plots=True) -> dict:
+    """
+    Runs every benchmark for every requested history size
+
+    :param list size_names: keys of sizes
+    :param int interval: seconds between two synthetic samples
+    :param int seed: seed of the synthetic data
+    :param int repeat: how often every measurement is repeated
+    :param bool plots: also benchmark the svg charts and the matplotlib plotters if matplotlib is available
+    :returns: a json serializable dictionary with meta information and a list of results
+    :rtype: dict
+    """
+    results = []
+
+    def record(name, size, items, timing):
+        timing.update({'name': name, 'size': size, 'items': items})
+        timing['per_item_us'] = timing['min_s'] / items * 1e6 if items else None
+        results.append(timing)
+        logger.info(f"{name:<28} {size:<6} {items:>8} items {timing['min_s']*1000:>10.2f}ms")
+
+    with tempfile.TemporaryDirectory() as folder:
+        for size in size_names:
+            history = synthetic_history(sizes[size], interval=interval, seed=seed)
+            items = len(history)
+            keys = list(history.keys())
+            first, last = datetime.fromisoformat(keys[0]), datetime.fromisoformat(keys[-1])
+
+            # insert_block, one commit per call, limited to a sane number of calls
+            block_count = min(items, 500)
+
+            def insert_blocks():
+                db = _fresh_db(folder, "block.db")
+                for key in keys[:block_count]:
+                    db.insert_block(history[key], synthetic_date=datetime.fromisoformat(key))
+                db.close()
+            record("insert_block", size, block_count, _timed(insert_blocks, repeat))
+
+            def insert_bulk():
+                db = _fresh_db(folder, "bulk.db")
+                db.insert_bulk(history)
+                db.close()
+            record("insert_bulk", size, items, _timed(insert_bulk, repeat))
+
+            json_path = os.path.join(folder, "values.json")
+            with open(json_path, "w") as json_out:
+                json.dump(history, json_out)
+
+            def fill_from_json():
+                db = _fresh_db(folder, "json.db")
+                db.fill_from_json(json_path)
+                db.close()
+            record("fill_from_json", size, items, _timed(fill_from_json, repeat))
+
+            db = _fresh_db(folder, "read.db")
+            db.insert_bulk(history)
+            record("fetch_by_range_all", size, items, _timed(
+                lambda: db.fetch_by_range(first - timedelta(seconds=1), last + timedelta(seconds=1)), repeat))
+            day_items = len(db.fetch_by_range(last - timedelta(days=1), last + timedelta(seconds=1)))
+            record("fetch_by_range_last_day", size, day_items, _timed(
+                lambda: db.fetch_by_range(last - timedelta(days=1), last + timedelta(seconds=1)), repeat))
+            rows = db.db.execute(f"SELECT {_select_columns} FROM sensor_data").fetchall()
+            record("_row_to_transfer_format", size, len(rows), _timed(
+                lambda: [LocalCache._row_to_transfer_format(row) for row in rows], repeat))
+            # daily 98th percentile of PM2.5, from the sketches and the old way of sorting all raw values
+            record("fetch_quantiles_daily", size, items, _timed(
+                lambda: db.fetch_quantiles(first, last, (0.98, ), ['particles_2_5'], bucket=timedelta(days=1)),
+                repeat))
+
+            def sorted_quantiles():
+                days = {}
+                for stamp, value in db.db.execute("SELECT timepoint, particles_2_5 FROM sensor_data "
+                                                  "WHERE timepoint >= ? AND timepoint < ?", (first, last)):
+                    if value is not None:
+                        days.setdefault(stamp[:10], []).append(value)
+                return {day: sorted(values)[int(0.98 * (len(values) - 1))] for day, values in days.items()}
+            record("quantiles_raw_sort_daily", size, items, _timed(sorted_quantiles, repeat))
+
+            # everything into the archive, only once as there is nothing left to compact afterwards
+            db_path = os.path.join(folder, "read.db")
+            raw_bytes = os.path.getsize(db_path)
+            timing = _timed(lambda: db.compact(last + timedelta(days=1), precision=sensor_precision, vacuum=True), 1)
+            timing.update({'bytes_before': raw_bytes, 'bytes_after': os.path.getsize(db_path)})
+            record("compact", size, items, timing)
+            record("fetch_by_range_archived", size, items, _timed(
+                lambda: db.fetch_by_range(first - timedelta(seconds=1), last + timedelta(seconds=1)), repeat))
+            db.close()
+
+            if plots:
+                _svg_benchmarks(history, size, folder, record, repeat)
+                _plot_benchmarks(history, size, folder, record, repeat)
+                _startup_benchmarks(history, size, folder, record, repeat)
+
+        _display_benchmarks(record, repeat)
+        wave_path = os.path.join(folder, "noise.wav")
+        synthetic_wave(wave_path, seed=seed)
+        record("audio_sparklines", "10s", 1, _timed(lambda: audio_sparklines(wave_path), repeat))
+        # a folder of recordings, first without cache, then the repeated overview that only looks things up
+        wave_folder = os.path.join(folder, "recordings")
+        os.makedirs(wave_folder)
+        for i in range(8):
+            synthetic_wave(os.path.join(wave_folder, f"{i:02d}.wav"), seed=seed + i)
+        cache_path = os.path.join(folder, "sparklines.db")
+        record("directory_sparklines", "8x10s", 8, _timed(lambda: directory_sparklines(wave_folder), repeat))
+        directory_sparklines(wave_folder, cache_path=cache_path)
+        record("directory_sparklines_cached", "8x10s", 8, _timed(
+            lambda: directory_sparklines(wave_folder, cache_path=cache_path), repeat))
+
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'sqlite': sqlite3.sqlite_version,
+            'columns': len(_columns),
+            'interval': interval,
+            'seed': seed
+        },
+        'results': results
+    }
+
+
+def _plot_benchmarks(history: dict, size: str, folder: str, record, repeat: int):
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        import visualize
+        from downsample import downsample_to_width, plot_series
+    except ImportError as err:
+        logger.warning(f"benchmark: skipping plotters, {err}")
+        return
+    dpi = 100
+    pixels = int(plt.rcParams['figure.figsize'][0] * dpi)
+    for name in ('weather', 'particles', 'gas', 'light'):
+        plotter = getattr(visualize, f"plot_{name}")
+        output = os.path.join(folder, f"{name}.png")
+
+        def plot():
+            plotter(downsample_to_width(history, plot_series[name], pixels), output=output, day_only=False, dpi=dpi)
+            plt.close("all")
+        record(f"plot_{name}", size, len(history), _timed(plot, repeat))
+
+
+def _svg_benchmarks(history: dict, size: str, folder: str, record, repeat: int):
+    import svg_charts
+    from downsample import downsample_to_width, plot_series
+    width = 800
+    for name in svg_charts.views:
+        output = os.path.join(folder, f"{name}.svg")
+        record(f"svg_{name}", size, len(history), _timed(lambda: svg_charts.render_view(
+            name, downsample_to_width(history, plot_series[name], width), output, day_only=False, width=width),
+            repeat))
+    # a reducing resistance of 0 stored by an older version gives approx_gas CO = inf, the charts have to draw a gap
+    broken = dict(list(history.items())[:100])
+    for index, key in enumerate(broken):
+        broken[key] = copy.deepcopy(broken[key])
+        broken[key].setdefault('approx_gas', {})['CO'] = (math.inf, -math.inf, math.nan)[index % 3]
+    document = svg_charts.render_svg('gas', broken)
+    if re.search(r'd="[^"]*(inf|nan)', document):
+        raise RuntimeError("benchmark: svg_charts drew a non finite value")
+
+
+# what a fresh process has to do to get the four charts of a downsampled history out, imports included
+_startup_scripts = {
+    'svg': """import json, sys, svg_charts
+raw = json.load(open(sys.argv[1]))
+for name in svg_charts.views:
+    svg_charts.render_view(name, raw, sys.argv[2] + name + ".svg", day_only=False)
+""",
+    'matplotlib': """import json, sys, matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt, visualize
+raw = json.load(open(sys.argv[1]))
+for name in ('weather', 'particles', 'gas', 'light'):
+    getattr(visualize, "plot_" + name)(raw, output=sys.argv[2] + name + ".png", day_only=False, dpi=100)
+    plt.close("all")
+"""
+}
+
+
+def _display_benchmarks(record, repeat: int):
+    """
+    A few frames on a FakeDisplay per mode and rotation, checks that every bar ends up in the right place and color
+    before timing the frames
+    """
+    from display import DisplayRenderer, FakeDisplay, rgb565
+
+    def reading(i):
+        return {'noise': {'20-1K': (i + 1) / 8, '1K-3K': 0.0, '3K-8K': 0.0}}  # bar of 8 * (i + 1) pixels
+
+    frames = 5
+    for mode in ("sweep", "scroll"):
+        for rotation in (90, 270):
+            disp = FakeDisplay(rotation=rotation)
+            renderer = DisplayRenderer(disp, rotation=rotation, fps=1000, mode=mode)
+            renderer.clear()
+            for i in range(frames):
+                renderer.push(reading(i))
+            width, height = disp.width, disp.height
+            background = rgb565(0, 0, 0)
+            for i in range(frames):
+                x = i if mode == "sweep" else width - frames + i
+                bar = 8 * (i + 1)
+                expected = [(height - bar, rgb565((i + 1) * 16, 0, 0)), (height - 1, rgb565((i + 1) * 16, 0, 0)),
+                            (height - bar - 1, background), (0, background)]
+                for y, color in expected:
+                    if disp.pixel(x, y) != color:
+                        raise RuntimeError(f"benchmark: {mode} {rotation} frame {i} pixel {x},{y} is "
+                                           f"{disp.pixel(x, y).hex()} instead of {color.hex()}")
+            if mode == "sweep" and disp.pixel(frames, 0) != rgb565(60, 60, 60):
+                raise RuntimeError(f"benchmark: sweep {rotation} cursor is not at column {frames}")
+            if mode == "scroll" and disp.pixel(width - frames - 1, height - 1) != background:
+                raise RuntimeError(f"benchmark: scroll {rotation} has a bar left of the oldest frame")
+
+        disp = FakeDisplay()
+        renderer = DisplayRenderer(disp, fps=1000, mode=mode)
+        record(f"display_{mode}", "frames", 100, _timed(lambda: [renderer.push(reading(i % 8)) for i in range(100)],
+                                                        repeat))
+
+
+def _startup_benchmarks(history: dict, size: str, folder: str, record, repeat: int):
+    """
+    Startup plus render time of both renderers in a new interpreter each, on a Pi the imports are most of it
+    """
+    from downsample import downsample_minmax, plot_series
+    paths = [path for series in plot_series.values() for path in series]
+    json_path = os.path.join(folder, "charts.json")
+    with open(json_path, "w") as json_out:
+        json.dump(downsample_minmax(history, paths, 400), json_out)
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name, script in _startup_scripts.items():
+        command = [sys.executable, "-c", script, json_path, os.path.join(folder, f"startup_{name}_")]
+        check = subprocess.run(command, cwd=here, capture_output=True, text=True)
+        if check.returncode:
+            logger.warning(f"benchmark: skipping startup_{name}, {check.stderr.strip().splitlines()[-1:]}")
+            continue
+        record(f"startup_render_{name}", size, len(history), _timed(
+            lambda: subprocess.run(command, cwd=here, check=True, capture_output=True), repeat))
+
+
+def stress_test(seconds=10.0, readers=4, writers=2, seed=42) -> dict:
+    """
+    One LocalCache, writer threads inserting (every writer as its own node, mostly insert_block and now and then a
+    small insert_bulk), reader threads running the fetch methods and one more thread with a LocalCache of its own on the
+    same file, the way visualize.py would open it. Halfway through the history gets compacted into the archive.
+
+    Readers check two things on every round: the rows of the static history never change in number, not even while
+    compact() moves them into the archive, and the rows of a writer never go down between two reads
+
+    :param float seconds: how long the threads run
+    :param int readers: reader threads on the shared instance
+    :param int writers: writer threads on the shared instance
+    :param int seed: seed of the synthetic history
+    :returns: operations, errors, consistency violations and latencies per kind of operation
+    :rtype: dict
+    """
+    history = synthetic_history(2, interval=60, seed=seed)
+    keys = list(history)
+    first = datetime.fromisoformat(keys[0])
+    end = datetime.fromisoformat(keys[-1]) + timedelta(minutes=1)
+    values = list(history.values())
+    everything = (first - timedelta(days=1), end + timedelta(days=365))
+    stop = threading.Event()
+    lock = threading.Lock()
+    timings = {}
+    errors = []
+    violations = []
+    written = {}  # node -> rows the writer thread wrote
+
+    def note(kind, started):
+        with lock:
+            timings.setdefault(kind, []).append(perf_counter() - started)
+
+    def count(db, node):
+        grid = db.fetch_aggregated(*everything, timedelta(days=400), ('count', ), ['particles_2_5'], node=node)
+        return sum(entry['particles_2_5']['count'] for entry in grid.values())
+
+    def writer(db, index):
+        node = f"writer{index}"
+        i = 0
+        while not stop.is_set():
+            try:
+                started = perf_counter()
+                if i % 50 == 49:
+                    batch = {(end + timedelta(seconds=10 * (i + j))).isoformat(): values[(i + j) % len(values)]
+                             for j in range(20)}
+                    db.insert_bulk(batch, node=node)
+                    note("insert_bulk", started)
+                    i += 20
+                else:
+                    db.insert_block(values[i % len(values)], end + timedelta(seconds=10 * i), node=node)
+                    note("insert_block", started)
+                    i += 1
+            except Exception as err:
+                with lock:
+                    errors.append(f"{node}: {type(err).__name__} {err}")
+        with lock:
+            written[node] = i
+
+    def reader(db, name):
+        seen = {}
+        rng = random.Random(name)
+        while not stop.is_set():
+            try:
+                started = perf_counter()
+                found = len(db.fetch_by_range(*everything, node="history"))  # raw rows, archived or not
+                note("fetch_history", started)
+                if found != len(history):
+                    with lock:
+                        violations.append(f"{name}: history has {found} rows instead of {len(history)}")
+                node = f"writer{rng.randrange(writers)}" if writers else "history"
+                started = perf_counter()
+                found = count(db, node)
+                note("count_writer", started)
+                if found < seen.get(node, 0):
+                    with lock:
+                        violations.append(f"{name}: {node} went from {seen[node]} to {found} rows")
+                seen[node] = found
+                started = perf_counter()
+                db.fetch_by_range(end - timedelta(hours=1), end + timedelta(days=1))
+                note("fetch_by_range", started)
+                started = perf_counter()
+                db.fetch_quantiles(first, end, (0.5, 0.98), ['particles_2_5'], bucket=timedelta(days=1))
+                note("fetch_quantiles", started)
+            except Exception as err:
+                with lock:
+                    errors.append(f"{name}: {type(err).__name__} {err}")
+
+    def outsider(path):
+        # own instance on the same file, like visualize.py or a second process
+        db = LocalCache(path)
+        reader(db, "outsider")
+        db.close()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "stress.db")
+        shared = LocalCache(path, cache_hours=2, cache_size=16, readers=readers)
+        shared.insert_bulk(history, node="history")
+        threads = [threading.Thread(target=writer, args=(shared, i), name=f"writer{i}") for i in range(writers)]
+        threads += [threading.Thread(target=reader, args=(shared, f"reader{i}"), name=f"reader{i}")
+                    for i in range(readers)]
+        threads.append(threading.Thread(target=outsider, args=(path, ), name="outsider"))
+        epoch = perf_counter()
+        for thread in threads:
+            thread.start()
+        stop.wait(seconds / 2)
+        started = perf_counter()
+        try:
+            shared.compact(end - timedelta(hours=12), precision=sensor_precision)
+            note("compact", started)
+        except Exception as err:
+            errors.append(f"compact: {type(err).__name__} {err}")
+        stop.wait(seconds / 2)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        duration = perf_counter() - epoch
+        for node, expected in written.items():
+            found = count(shared, node)
+            if found != expected:
+                violations.append(f"{node} wrote {expected} rows but the database has {found}")
+        shared.close()
+    return {
+        'seconds': duration,
+        'readers': readers,
+        'writers': writers,
+        'written': written,
+        'errors': errors[:20],
+        'error_count': len(errors),
+        'violations': violations[:20],
+        'violation_count': len(violations),
+        'operations': {
+            kind: {'count': len(x), 'per_s': len(x) / duration, 'median_ms': statistics.median(x) * 1000,
+                   'max_ms': max(x) * 1000}
+            for kind, x in sorted(timings.items())
+        }
+    }
+
+
+def compare_results(old: dict, new: dict, threshold=0.1) -> list:
+    """
+    Compares two benchmark runs and lists everything that got slower by more than threshold
+
+    :param dict old: result of an older run_benchmarks()
+    :param dict new: result of a newer run_benchmarks()
+    :param float threshold: relative slowdown that counts as regression, 0.1 is 10%
+    :returns: list of dictionaries with name, size, old and new min time and the ratio
+    :rtype: list
+    """
+    before = {(x['name'], x['size']): x for x in old['results']}
+    regressions = []
+    for entry in new['results']:
+        reference = before.get((entry['name'], entry['size']))
+        if not reference or not reference['min_s']:
+            continue
+        ratio = entry['min_s'] / reference['min_s']
+        if ratio > 1 + threshold:
+            regressions.append({
+                'name': entry['name'], 'size': entry['size'],
+                'old_s': reference['min_s'], 'new_s': entry['min_s'], 'ratio': ratio
+            })
+    return regressions
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(message)s', level=logging.INFO, stream=sys.stderr)
+    parser = argparse.ArgumentParser(description="AirWatcher benchmarks, results are written as json")
+    parser.add_argument("--sizes", default="day,week,month", help=f"comma separated, any of {', '.join(sizes)}")
+    parser.add_argument("--interval", type=int, default=300, help="seconds between two synthetic samples")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-plots", action="store_true", help="skip the matplotlib plotters")
+    parser.add_argument("--output", default="-", help="file for the json result, - for stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files instead")
+    parser.add_argument("--stress", type=float, metavar="SECONDS", help="run the concurrency stress test instead")
+    parser.add_argument("--readers", type=int, default=4, help="reader threads of the stress test")
+    parser.add_argument("--writers", type=int, default=2, help="writer threads of the stress test")
+    args = parser.parse_args()
+
+    if args.stress:
+        outcome = stress_test(args.stress, args.readers, args.writers, args.seed)
+        json.dump(outcome, sys.stdout, indent=2)
+        print()
+        exit(1 if outcome['error_count'] or outcome['violation_count'] else 0)
+
+    if args.compare:
+        with open(args.compare[0]) as old_fh, open(args.compare[1]) as new_fh:
+            slower = compare_results(json.load(old_fh), json.load(new_fh))
+        for item in slower:
+            print(f"{item['name']:<28} {item['size']:<6} {item['old_s']*1000:.2f}ms -> {item['new_s']*1000:.2f}ms "
+                  f"({item['ratio']:.2f}x)")
+        exit(1 if slower else 0)
+
+    wanted = [x.strip() for x in args.sizes.split(",") if x.strip()]
+    unknown = [x for x in wanted if x not in sizes]
+    if unknown:
+        parser.error(f"unknown sizes: {', '.join(unknown)}")
+    report = run_benchmarks(wanted, interval=args.interval, seed=args.seed, repeat=args.repeat,
+                            plots=not args.no_plots)
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as json_out:
+            json.dump(report, json_out, indent=2)
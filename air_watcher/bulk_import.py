@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2021 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of AirWatcher.
+#
+# AirWatcher is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# AirWatcher is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import json
+import logging
+import multiprocessing
+import os
+import time
+from datetime import datetime
+from queue import Empty
+
+from json_stream import iter_json_object
+from local_database import LocalCache
+
+logger = logging.getLogger(__name__)
+
+"""
+Imports a whole fleet worth of values.json files into one LocalCache. Parsing the json, the iso strings and flattening
+the nested dictionaries is what takes the time, so that happens in a pool of worker processes, one file per worker at
+a time. The rows come back in batches through a bounded queue to this process, which is the only one writing into
+sqlite, one transaction per batch. The bound keeps the workers from running off with the memory if the disk is slower
+than the parsing.
+
+Every file gets a node name, entries that are already in the database (same timepoint and node) are merged by the
+upsert of the LocalCache, so importing a file twice or overlapping files does not create duplicates.
+
+python3 bulk_import.py fleet.db kitchen/values.json balcony/values.json old.json@kitchen
+"""
+
+_queue = None  # the result queue of the worker processes, set by _init_worker
+
+
+def split_node(item: str) -> tuple:
+    """
+    Path and node name of a file argument: 'file.json@name' gives name, otherwise the file name without extension, for
+    files that are all called values.json the name of the folder they are in
+
+    :returns: tuple (path, node)
+    """
+    if "@" in os.path.basename(item):
+        return tuple(item.rsplit("@", 1))
+    name = os.path.splitext(os.path.basename(item))[0]
+    if name == "values":
+        name = os.path.basename(os.path.dirname(os.path.abspath(item))) or name
+    return item, name
+
+
+def _init_worker(queue):
+    global _queue
+    _queue = queue
+
+
+def _parse_file(path: str, source: str, node: str, skip: int, batch_size: int):
+    """
+    Runs in a worker, streams one file and puts ('rows', source, node, rows, entries) for every batch and one
+    ('done', source, entries, date_errors, error message or None) at the end into the queue
+    """
+    entries = 0
+    date_errors = 0
+    rows = []
+    try:
+        with open(path, "r") as json_in:
+            for key, value in iter_json_object(json_in):
+                entries += 1
+                if entries <= skip:
+                    continue
+                try:
+                    rows.append(LocalCache._flatten(value, datetime.fromisoformat(key), node))
+                except ValueError:
+                    date_errors += 1
+                if len(rows) >= batch_size:
+                    _queue.put(('rows', source, node, rows, entries))
+                    rows = []
+    except (OSError, json.JSONDecodeError) as err:
+        _queue.put(('rows', source, node, rows, entries))
+        _queue.put(('done', source, entries, date_errors, f"{type(err).__name__}: {err}"))
+        return
+    _queue.put(('rows', source, node, rows, entries))
+    _queue.put(('done', source, entries, date_errors, None))
+
+
+def bulk_import(db: LocalCache, files: list, workers=None, batch_size=5000, resume=False, progress=None) -> dict:
+    """
+    Imports many json files in the format of values.json in parallel
+
+    :param LocalCache db: where everything goes, only this process writes into it
+    :param list files: paths, optionally with '@node', see split_node(), or (path, node) tuples
+    :param int workers: number of parsing processes, defaults to the number of cores
+    :param int batch_size: rows per transaction
+    :param bool resume: skip the entries a previous import of the same file already wrote, see fill_from_json()
+    :param callable progress: called after every batch with (rows_written, files_done, files_total)
+    :returns: dictionary with the number of files, entries, written rows, parsing errors, failed files and seconds
+    :rtype: dict
+    """
+    jobs = []
+    for item in files:
+        path, node = item if isinstance(item, tuple) else split_node(item)
+        source = os.path.realpath(path)
+        skip = db.import_progress(source, node) if resume else 0
+        jobs.append((path, source, node, skip, batch_size))
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) or 1))
+    result = {'files': len(jobs), 'entries': 0, 'rows': 0, 'date_errors': 0, 'failed': {}, 'workers': workers}
+    epoch = time.perf_counter()
+    queue = multiprocessing.Queue(maxsize=workers * 2)
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(queue, )) as pool:
+        pending = pool.starmap_async(_parse_file, jobs)
+        finished = 0
+        while finished < len(jobs):
+            try:
+                message = queue.get(timeout=1.0)
+            except Empty:
+                if pending.ready():
+                    pending.get()  # raises whatever killed a worker in a way _parse_file did not expect
+                    break
+                continue
+            if message[0] == 'rows':
+                _, source, node, rows, entries = message
+                db._import_batch(rows, source, entries, node)
+                result['rows'] += len(rows)
+                if progress:
+                    progress(result['rows'], finished, len(jobs))
+                continue
+            _, source, entries, date_errors, error = message
+            finished += 1
+            result['entries'] += entries
+            result['date_errors'] += date_errors
+            if error:
+                result['failed'][source] = error
+                logger.error(f"bulk_import: {source} stopped after {entries} entries, {error}")
+            else:
+                logger.info(f"bulk_import: {source} done, {entries} entries")
+    result['seconds'] = time.perf_counter() - epoch
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="imports many values.json files in parallel into one database")
+    parser.add_argument("db", help="LocalCache database, gets created if it does not exist")
+    parser.add_argument("files", nargs="+", help="json files, file.json@node sets the node name explicitly")
+    parser.add_argument("--workers", type=int, help="parsing processes, defaults to the number of cores")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per transaction")
+    parser.add_argument("--resume", action="store_true", help="skip what earlier imports of the files already wrote")
+    args = parser.parse_args()
+    target = LocalCache(args.db)
+    print(json.dumps(bulk_import(target, args.files, args.workers, args.batch_size, args.resume), indent=2))
+    target.close()
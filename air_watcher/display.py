@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2021 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of AirWatcher.
+#
+# AirWatcher is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# AirWatcher is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+"""
+Grown up version of the display loop in snippets.py. That one copied the whole PIL image every frame, pasted it one
+pixel further and pushed all 160x80 pixels over SPI as fast as the Pi could manage. This keeps the picture as RGB565
+bytes, already in the order the ST7735 wants them, one line per graph column. A new reading only changes one column,
+and in sweep mode (default, works like an ECG monitor) only that column and the cursor after it get send to the
+display. Scroll mode looks like the old loop but has to send everything every frame.
+
+No PIL and no numpy needed, the display only has to provide set_window() and data() like the ST7735 library does.
+"""
+
+
+def rgb565(red: int, green: int, blue: int) -> bytes:
+    """
+    Packs a color into the two bytes (big endian) the ST7735 expects per pixel
+    """
+    red, green, blue = (max(0, min(255, int(x))) for x in (red, green, blue))
+    return (((red & 0xF8) << 8) | ((green & 0xFC) << 3) | (blue >> 3)).to_bytes(2, "big")
+
+
+def noise_column(reading: dict, color_scale=128, height_scale=64):
+    """
+    Turns a reading into the look of the old snippet loop: the three noise bands are red, green and blue, their sum
+    is the height of the bar
+
+    :param dict reading: output of SensorBundle.get_all() or at least {'noise': get_noise_readings()}
+    :returns: tuple of (rgb tuple, height in pixels) or None if there is no noise reading
+    """
+    noise = reading.get('noise') if reading else None
+    if not noise:
+        return None
+    low, mid, high = noise.get('20-1K', 0), noise.get('1K-3K', 0), noise.get('3K-8K', 0)
+    return (low * color_scale, mid * color_scale, high * color_scale), (low + mid + high) * height_scale
+
+
+def feed_source(feed):
+    """
+    Source for DisplayRenderer.run() that picks up the newest frame of a live_feed.LiveFeed, None while nothing new was
+    published. Reading the sensors takes far longer than a frame, so that has to happen somewhere else
+
+    :param live_feed.LiveFeed feed: where the sampler publishes its readings
+    :rtype: callable
+    """
+    seen = 0
+
+    def source():
+        nonlocal seen
+        sequence, frame, _ = feed.latest()
+        if sequence == seen or frame is None:
+            return None
+        seen = sequence
+        return frame[1]
+    return source
+
+
+def sample_noise(noise, feed, stop=None):
+    """
+    Records the microphone over and over and publishes the three bands, runs in its own thread. One
+    get_noise_profile() is a single recording, get_noise_readings() of the SensorBundle takes three of them
+
+    :param noise: enviroplus.noise.Noise
+    :param live_feed.LiveFeed feed: where the readings go
+    :param threading.Event stop: ends the loop once set, None runs forever
+    """
+    while stop is None or not stop.is_set():
+        # low, mid and high are split at fixed fractions of the sample rate, close enough to the bands of the bundle
+        low, mid, high, _ = noise.get_noise_profile()
+        feed.publish({'noise': {'20-1K': low, '1K-3K': mid, '3K-8K': high}})
+
+
+class FakeDisplay:
+    """
+    In memory stand in for ST7735.ST7735 with the same set_window()/data() interface, keeps the native pixel memory as
+    bytes and counts what was send so tests can check both the picture and the SPI traffic
+    """
+    def __init__(self, width=80, height=160, rotation=90):
+        self._width = width  # native size, like the library
+        self._height = height
+        self._rotation = rotation
+        self.memory = bytearray(width * height * 2)
+        self._window = (0, 0, width - 1, height - 1)
+        self._cursor = 0
+        self.windows = 0
+        self.bytes_sent = 0
+
+    @property
+    def width(self):
+        return self._width if self._rotation in (0, 180) else self._height
+
+    @property
+    def height(self):
+        return self._height if self._rotation in (0, 180) else self._width
+
+    def begin(self):
+        pass
+
+    def set_window(self, x0=0, y0=0, x1=None, y1=None):
+        x1 = self._width - 1 if x1 is None else x1
+        y1 = self._height - 1 if y1 is None else y1
+        self._window = (x0, y0, x1, y1)
+        self._cursor = 0
+        self.windows += 1
+
+    def data(self, data):
+        x0, y0, x1, y1 = self._window
+        window_width = x1 - x0 + 1
+        for i in range(0, len(data), 2):
+            pixel = self._cursor
+            x = x0 + pixel % window_width
+            y = y0 + pixel // window_width
+            offset = (y * self._width + x) * 2
+            self.memory[offset:offset + 2] = data[i:i + 2]
+            self._cursor += 1
+        self.bytes_sent += len(data)
+
+    def pixel(self, x: int, y: int) -> bytes:
+        """
+        Color of a pixel in logical (rotated) coordinates, inverse of what image_to_data() of the library does
+        """
+        width, height = self.width, self.height
+        if self._rotation == 0:
+            nx, ny = x, y
+        elif self._rotation == 90:
+            nx, ny = y, width - 1 - x
+        elif self._rotation == 180:
+            nx, ny = width - 1 - x, height - 1 - y
+        else:
+            nx, ny = height - 1 - y, x
+        offset = (ny * self._width + nx) * 2
+        return bytes(self.memory[offset:offset + 2])
+
+
+class DisplayRenderer:
+    def __init__(self, disp, rotation=90, fps=10, mode="sweep", column=noise_column, background=(0, 0, 0),
+                 cursor=(60, 60, 60)):
+        """
+        :param disp: ST7735.ST7735 or FakeDisplay, already begun
+        :param int rotation: the rotation the display was created with, 0, 90, 180 or 270
+        :param float fps: frame budget, the loop never draws more often than this
+        :param str mode: 'sweep' only sends changed columns, 'scroll' moves the whole picture every frame
+        :param callable column: turns a reading into (rgb, height) or None, see noise_column()
+        :param tuple background: rgb of the empty area
+        :param tuple cursor: rgb of the column in front of the newest one in sweep mode
+        """
+        if mode not in ("sweep", "scroll"):
+            raise ValueError(f"DisplayRenderer: unknown mode {mode}")
+        self.disp = disp
+        self.rotation = rotation
+        self.frame_time = 1.0 / fps
+        self.mode = mode
+        self.column = column
+        self.width = disp.width  # logical, one graph column per x
+        self.height = disp.height
+        self.line = self.height * 2  # bytes per column
+        self.background = rgb565(*background)
+        self.cursor = rgb565(*cursor)
+        self._empty = self.background * self.height
+        self.framebuffer = bytearray(self._empty * self.width)
+        self._view = memoryview(self.framebuffer)
+        self.head = 0  # next column that gets written
+        self.frames = 0
+        self.overruns = 0
+
+    def _window(self, x: int) -> tuple:
+        """
+        Native window of the logical column x, the line bytes are stored in the order that window wants them
+        """
+        if self.rotation == 0:
+            return x, 0, x, self.height - 1
+        if self.rotation == 90:
+            return 0, self.width - 1 - x, self.height - 1, self.width - 1 - x
+        if self.rotation == 180:
+            return self.width - 1 - x, 0, self.width - 1 - x, self.height - 1
+        return 0, x, self.height - 1, x
+
+    def _bar_at_start(self) -> bool:
+        # bars grow from the logical bottom, which is the start of a native line for 180 and 270 degrees
+        return self.rotation in (180, 270)
+
+    def draw_column(self, index: int, color=None, height=0):
+        """
+        Writes one column into the framebuffer, a bar of `height` pixels from the bottom in `color`, nothing is send
+        """
+        offset = index * self.line
+        self.framebuffer[offset:offset + self.line] = self._empty
+        height = max(0, min(self.height, int(height)))
+        if not height or color is None:
+            return
+        bar = rgb565(*color) * height
+        if self._bar_at_start():
+            self.framebuffer[offset:offset + height * 2] = bar
+        else:
+            self.framebuffer[offset + self.line - height * 2:offset + self.line] = bar
+
+    def _send(self, x: int, index: int):
+        self.disp.set_window(*self._window(x))
+        self.disp.data(self._view[index * self.line:(index + 1) * self.line])
+
+    def push(self, reading: dict):
+        """
+        Adds one reading as newest column and updates the display
+        """
+        result = self.column(reading)
+        color, height = result if result else (None, 0)
+        self.draw_column(self.head, color, height)
+        if self.mode == "sweep":
+            self._send(self.head, self.head)
+            cursor = (self.head + 1) % self.width
+            offset = cursor * self.line
+            self.framebuffer[offset:offset + self.line] = self.cursor * self.height
+            self._send(cursor, cursor)
+        else:
+            # the oldest column is on the left, the one just written on the right
+            for x in range(self.width):
+                self._send(x, (self.head + 1 + x) % self.width)
+        self.head = (self.head + 1) % self.width
+        self.frames += 1
+
+    def clear(self):
+        self.framebuffer[:] = self._empty * self.width
+        for x in range(self.width):
+            self._send(x, x)
+        self.head = 0
+
+    def run(self, source, frames=None):
+        """
+        Draws readings from source at a fixed frame rate, if a frame takes longer than the budget the next one starts
+        right away and the schedule starts over instead of trying to catch up
+
+        :param callable source: gives the newest reading or None if there is nothing new, has to return right away,
+        see feed_source()
+        :param int frames: stop after that many frames, None runs forever
+        """
+        deadline = time.monotonic()
+        count = 0
+        while frames is None or count < frames:
+            reading = source()
+            if reading is not None:
+                self.push(reading)
+            count += 1
+            deadline += self.frame_time
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.overruns += 1
+                deadline = time.monotonic()
+
+
+if __name__ == "__main__":
+    import threading
+    import ST7735
+    from enviroplus.noise import Noise
+    from live_feed import LiveFeed
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO)
+    st7735 = ST7735.ST7735(port=0, cs=ST7735.BG_SPI_CS_FRONT, dc=9, backlight=12, rotation=90)
+    st7735.begin()
+    # only the microphone, the rest of the SensorBundle is not needed to draw noise
+    live = LiveFeed()
+    threading.Thread(target=sample_noise, args=(Noise(), live), name="noise-sampler", daemon=True).start()
+    renderer = DisplayRenderer(st7735, rotation=90, fps=10)
+    renderer.clear()
+    renderer.run(feed_source(live))
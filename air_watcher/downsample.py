@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2021 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of AirWatcher.
+#
+# AirWatcher is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# AirWatcher is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import math
+from datetime import datetime
+
+from local_database import deep_get
+
+"""
+Reduces the amount of data points before they get handed to a plotter. A plot that is 2000 pixels wide cannot show
+more than 2000 distinct x-values anyway, so everything beyond that is just burning cpu time and memory. This uses the
+min/max per bucket approach: the time range is cut into equal sized buckets (one per pixel or so) and for every series
+only the rows holding the minimum and maximum of that bucket survive, which means peaks are never lost.
+
+The number of buckets is per series, each bucket can keep two entries for every series. downsample_to_width() does the
+math for a plot of a given width, the gas view with its six lines gets a sixth of the buckets the light view gets.
+"""
+
+# the series each plotter of visualize.py actually draws, keys are in deep_get format
+plot_series = {
+    'weather': ["weather|temperature", "weather|pressure", "weather|humidity"],
+    'particles': ["particles|m3|atmo|1.0", "particles|m3|atmo|2.5", "particles|m3|atmo|10"],
+    'gas': ["gas|oxidising", "gas|reducing", "gas|nh3", "approx_gas|NO2", "approx_gas|CO", "approx_gas|NH3"],
+    'light': ["light|lux", "light|ir"]
+}
+
+
+def downsample_minmax(raw_values: dict, paths: list, buckets=1000) -> dict:
+    """
+    Thins out a dictionary in transfer format so that every given series has at most two points per bucket, the first
+    and last entry are always kept so the x-axis does not shrink
+
+    The buckets are spaced by time, not by index, therefore gaps in the data stay gaps in the plot
+
+    :param dict raw_values: dictionary of the format { 'iso_string' : {'data_a': {}, ...}, ...}
+    :param list paths: series that should be preserved, deep_get format like "weather|temperature"
+    :param int buckets: number of time buckets, two points per bucket and series might survive, so up to
+    2 * buckets * len(paths) entries in total
+    :returns: a new dictionary in the same format, ordered by time, containing only the surviving entries
+    :rtype: dict
+    """
+    if not isinstance(buckets, int) or buckets < 1:
+        buckets = 1
+    stamps = []
+    for iso_data in raw_values:
+        try:
+            stamps.append((datetime.fromisoformat(iso_data), iso_data))
+        except ValueError:
+            continue
+    if len(stamps) <= buckets * 2:
+        return {key: raw_values[key] for _, key in sorted(stamps)}
+    stamps.sort()
+    first = stamps[0][0]
+    span = (stamps[-1][0] - first).total_seconds() or 1.0
+    keep = {stamps[0][1], stamps[-1][1]}
+    # (bucket, path) -> [min_value, min_key, max_value, max_key]
+    extremes = {}
+    for that_date, key in stamps:
+        bucket = min(int((that_date - first).total_seconds() / span * buckets), buckets - 1)
+        for path in paths:
+            value = deep_get(raw_values[key], path)
+            # NaN compares false with everything and would stay the extreme of its bucket for good
+            if not isinstance(value, (int, float)) or not math.isfinite(value):
+                continue
+            current = extremes.get((bucket, path))
+            if current is None:
+                extremes[(bucket, path)] = [value, key, value, key]
+                continue
+            if value < current[0]:
+                current[0], current[1] = value, key
+            if value > current[2]:
+                current[2], current[3] = value, key
+    for _, min_key, _, max_key in extremes.values():
+        keep.add(min_key)
+        keep.add(max_key)
+    return {key: raw_values[key] for _, key in stamps if key in keep}
+
+
+def downsample_to_width(raw_values: dict, paths: list, width: int) -> dict:
+    """
+    downsample_minmax() with as many buckets as fit into width, the result has at most width entries (plus the first
+    and last one) no matter how many series are drawn
+
+    :param int width: number of points the plot can actually show, usually its width in pixels
+    :rtype: dict
+    """
+    return downsample_minmax(raw_values, paths, max(1, width // (2 * max(1, len(paths)))))
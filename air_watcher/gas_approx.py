@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2021 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of AirWatcher.
+#
+# AirWatcher is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# AirWatcher is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import math
+
+import numpy
+
+"""
+The one place where the raw resistance of the gas sensor gets turned into something resembling ppm. Used to live twice,
+once in the sensor bundle and once in visualize, both doing it value by value.
+
+The gas readings are wildly inaccurate and the sensor is definitely meant to be used as a qualitative tool, getting real
+ppm needs lab grade equipment which is rather expensive and needs finely calibrated equipment
+"""
+
+# R0 values, the resistance of the sensor in fresh air, these are the ones from the forum post
+default_calibration = {
+    'oxidising': 20000.0,  # chosen to give value approx 0.01 in fresh air (detectable = 0.05 to 10)
+    'reducing': 150000.0,  # chosen to give value approx 2 in fresh air (detectable = 1 to 1000)
+    'nh3': 570000.0  # chosen to give value approx 2 in fresh air (detectable = 1 to 300)
+}
+
+
+def approx_gas(oxidising, reducing, nh3, calibration=None):
+    """
+    Calculates the approximated NO2, CO and NH3 ppm values for either single values or whole arrays at once, None
+    values in the input become NaN in the output. So does a resistance of 0, which would be an infinite amount of gas
+
+    stolen here: https://forums.pimoroni.com/t/pms5003-gas-measurement-with-an-enviro-on-a-raspberry/15868/5
+
+    :param oxidising: raw oxidising reading(s) in Ohm, a number or anything array like
+    :param reducing: raw reducing reading(s) in Ohm
+    :param nh3: raw nh3 reading(s) in Ohm
+    :param dict calibration: R0 values with the keys 'oxidising', 'reducing' and 'nh3', defaults to default_calibration
+    :returns: a dictionary with the keys 'NO2', 'CO' and 'NH3', floats for scalar input, numpy arrays otherwise
+    :rtype: dict
+    """
+    r0 = dict(default_calibration)
+    if calibration:
+        r0.update(calibration)
+    scalar = all(numpy.ndim(x) == 0 for x in (oxidising, reducing, nh3))
+    ox = numpy.asarray(oxidising, dtype=numpy.float64)
+    red = numpy.asarray(reducing, dtype=numpy.float64)
+    ammonia = numpy.asarray(nh3, dtype=numpy.float64)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        # oxidising, NO2: ppm = Rs / (6.5 * R0)
+        no2 = ox / 6.5 / r0['oxidising']
+        # reducing, CO: ppm = 10^((log10(Rs / 3.5 / R0)) / -0.845 ) which is the same as (Rs / 3.5 / R0)^(-1/0.845)
+        co = numpy.power(red / 3.5 / r0['reducing'], -1 / 0.845)
+        # NH3: ppm = 10^((log10(Rs / 0.77 / R0)) / -0.5335 )
+        nh3_ppm = numpy.power(ammonia / 0.77 / r0['nh3'], -1 / 0.5335)
+    # inf is not a reading, and neither json nor the charts can do anything sensible with it
+    no2, co, nh3_ppm = (numpy.where(numpy.isfinite(x), x, numpy.nan) for x in (no2, co, nh3_ppm))
+    if scalar:
+        return {'NO2': float(no2), 'CO': float(co), 'NH3': float(nh3_ppm)}
+    return {'NO2': no2, 'CO': co, 'NH3': nh3_ppm}
+
+
+def nan_to_none(values) -> list:
+    """
+    Turns a numpy array into a plain list with None instead of NaN or inf, which is what sqlite and json want to see
+
+    :param values: one dimensional numpy array
+    :rtype: list
+    """
+    return [x if math.isfinite(x) else None for x in values.tolist()]
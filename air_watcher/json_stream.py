@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2021 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of AirWatcher.
+#
+# AirWatcher is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# AirWatcher is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import json
+
+"""
+values.json is one big object with an iso string as key per reading, after a few years that does not fit into the
+memory of a Pi Zero anymore when loaded with json.load(). This reads such an object key by key, only ever holding a
+chunk of the file and one value at a time.
+"""
+
+_whitespace = " \t\n\r"
+
+
+def iter_json_object(file_handle, chunk_size=65536, max_value=1 << 20):
+    """
+    Generator over the top level key/value pairs of a json object in a (text mode) file, without reading the whole
+    file; the values themselves are decoded with the normal json module
+
+    :param file_handle: file opened in text mode, positioned at the start of the object
+    :param int chunk_size: characters read at once
+    :param int max_value: characters a single value may take, a broken value would otherwise have the rest of the file
+    read into memory while waiting for it to end
+    :returns: generator of (key, value) tuples in file order
+    :raises json.JSONDecodeError: if the file is not a json object or broken somewhere
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def more():
+        # appends the next chunk, drops the already consumed part of the buffer from time to time
+        nonlocal buffer, position, eof
+        if position > chunk_size:
+            buffer = buffer[position:]
+            position = 0
+        chunk = file_handle.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer += chunk
+
+    def next_char():
+        # skips whitespace and gives the next meaningful character, None at the end of the file
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in _whitespace:
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if eof:
+                return None
+            more()
+
+    def decode():
+        # decodes one json value at position, reads more if the value is cut off by the end of the buffer
+        nonlocal position
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as err:
+                # only an error right at the end of the buffer (or in a string that is not closed yet) can be a value
+                # that is cut off, anything before that stays broken no matter how much more is read
+                if eof or (err.pos < len(buffer) - 8 and not err.msg.startswith("Unterminated string")):
+                    raise
+                if len(buffer) - position > max_value:
+                    raise json.JSONDecodeError(f"Value longer than {max_value} characters", buffer, position)
+                more()
+                continue
+            # a number can end early on a cut off chunk, 12 might be 123 and 1e might be 1e-07, so a value that ends
+            # this close to the end of the buffer is decoded again with more of the file behind it
+            if len(buffer) - end < 8 and not eof:
+                more()
+                continue
+            position = end
+            return value
+
+    if next_char() != "{":
+        raise json.JSONDecodeError("Expecting '{'", buffer, position)
+    position += 1
+    first = True
+    while True:
+        char = next_char()
+        if char == "}":
+            position += 1
+            if next_char() is not None:
+                raise json.JSONDecodeError("Extra data", buffer, position)
+            return
+        if not first:
+            if char != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, position)
+            position += 1
+            next_char()
+        first = False
+        key = decode()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Expecting property name", buffer, position)
+        if next_char() != ":":
+            raise json.JSONDecodeError("Expecting ':' delimiter", buffer, position)
+        position += 1
+        next_char()
+        yield key, decode()
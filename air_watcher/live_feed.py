@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2021 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of AirWatcher.
+#
+# AirWatcher is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# AirWatcher is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import json
+import logging
+import math
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from profiling import tracker
+
+logger = logging.getLogger(__name__)
+
+"""
+Hands the newest reading to everybody who wants it without asking the sensors or the database again. The sampler
+publishes every result of get_all() exactly once, it gets serialized once and every subscriber just picks up the newest
+frame whenever it is ready for the next one. A slow subscriber therefore never sees a backlog, it simply skips the
+frames it was too slow for.
+
+Subscribers can either live in the same process (subscribe()) or connect via http as server sent events:
+
+curl -N http://localhost:8765/events
+curl http://localhost:8765/latest
+"""
+
+
+def _finite(value):
+    """
+    Copy of a reading with every NaN or inf replaced by None, json.dumps would write them as bare NaN and Infinity
+    which is not json and makes JSON.parse in the browser throw
+    """
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite(x) for key, x in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(x) for x in value]
+    return value
+
+
+class LiveFeed:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._sequence = 0
+        self._frame = None  # (timepoint, reading)
+        self._payload = None  # the same thing as json string, serialized once for all http clients
+        self.published = 0
+
+    def publish(self, reading: dict, timepoint=None):
+        """
+        Makes a new reading the newest frame and wakes up every waiting subscriber
+
+        :param dict reading: output of SensorBundle.get_all()
+        :param datetime timepoint: time of the reading, defaults to now
+        """
+        if not timepoint:
+            timepoint = datetime.now()
+        payload = json.dumps({'timepoint': timepoint.isoformat(), 'data': _finite(reading)}, allow_nan=False)
+        with self._condition:
+            self._sequence += 1
+            self._frame = (timepoint, reading)
+            self._payload = payload
+            self.published += 1
+            self._condition.notify_all()
+
+    def latest(self):
+        """
+        :returns: tuple of (sequence, (timepoint, reading), json payload), sequence is 0 if nothing was published yet
+        """
+        with self._condition:
+            return self._sequence, self._frame, self._payload
+
+    def wait(self, after=0, timeout=None):
+        """
+        Blocks till there is a frame newer than `after`, always gives the newest one, older ones are skipped
+
+        :param int after: sequence number of the last frame the caller has seen
+        :param float timeout: seconds to wait at most, None waits forever
+        :returns: same as latest() or None if the timeout ran out
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._sequence > after, timeout=timeout):
+                return None
+            return self._sequence, self._frame, self._payload
+
+    def subscribe(self, timeout=None):
+        """
+        Generator for in process consumers like the display loop, yields (timepoint, reading) of every frame the
+        consumer manages to pick up, stops if nothing new arrived within timeout
+
+        `for timepoint, reading in feed.subscribe():`
+        """
+        sequence = 0
+        while True:
+            result = self.wait(sequence, timeout)
+            if result is None:
+                return
+            sequence, frame, _ = result
+            yield frame
+
+    def serve(self, host="127.0.0.1", port=8765, keepalive=15.0) -> ThreadingHTTPServer:
+        """
+        Starts a small http server in a background thread, /events streams server sent events, /latest gives the newest
+        frame as json
+
+        :param str host: interface to listen on, localhost by default as there is no authentication whatsoever
+        :param int port: port to listen on
+        :param float keepalive: seconds after which an idle event stream gets a comment line to keep proxies happy
+        :returns: the running server, call .shutdown() to stop it
+        """
+        feed = self
+
+        class FeedHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/latest":
+                    _, _, payload = feed.latest()
+                    body = (payload or "{}").encode("utf-8")
+                    self.send_response(200 if payload else 204)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                elif self.path == "/events":
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Cache-Control", "no-cache")
+                    self.end_headers()
+                    sequence = 0
+                    try:
+                        while True:
+                            result = feed.wait(sequence, timeout=keepalive)
+                            if result is None:
+                                self.wfile.write(b": keepalive\n\n")
+                            else:
+                                sequence, _, payload = result
+                                self.wfile.write(f"id: {sequence}\ndata: {payload}\n\n".encode("utf-8"))
+                            self.wfile.flush()
+                    except (BrokenPipeError, ConnectionResetError):
+                        return  # client is gone, nothing to clean up
+                else:
+                    self.send_error(404)
+
+            def log_message(self, format, *args):
+                logger.debug(f"live_feed: {self.address_string()} {format % args}")
+
+        server = ThreadingHTTPServer((host, port), FeedHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="live-feed", daemon=True).start()
+        logger.info(f"LiveFeed: serving on http://{host}:{port}/events")
+        return server
+
+
+def run_sampler(sensor, feed: LiveFeed, interval=10.0, db=None, cycles=None, scheduler=None):
+    """
+    Reads the sensors every interval seconds, publishes the result and optionally writes it into a LocalCache, this
+    is the only place that touches the hardware, no matter how many subscribers there are
+
+    :param sensors.SensorBundle sensor: the sensors, a replaying bundle stamps the readings with the recorded time
+    :param LiveFeed feed: where the readings get published
+    :param float interval: seconds between two readings
+    :param local_database.LocalCache db: if set every reading also gets written there
+    :param int cycles: stop after that many readings, None runs forever
+    :param scheduler.AdaptiveScheduler scheduler: if set it decides the time till the next reading instead of interval
+    """
+    count = 0
+    one_shot = True  # the first reading needs a warm up, after that the sensors are busy enough
+    while cycles is None or count < cycles:
+        epoch = time.monotonic()
+        reading = sensor.get_all(one_shot=one_shot, condensed=True)
+        one_shot = False
+        now = sensor.replay.timepoint if sensor.replay else datetime.now()
+        feed.publish(reading, now)
+        if db:
+            db.insert_block(reading, now)
+        tracker.maybe_log()
+        count += 1
+        wait = scheduler.observe(reading) if scheduler else interval
+        time.sleep(max(0.0, wait - (time.monotonic() - epoch)))
+
+
+if __name__ == "__main__":
+    import argparse
+    from sensors import SensorBundle
+    from local_database import LocalCache
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="reads the sensors and serves the newest reading as event stream")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between two readings")
+    parser.add_argument("--db", help="also write every reading into this LocalCache")
+    parser.add_argument("--demo", action="store_true", help="use the demo values instead of the sensors")
+    parser.add_argument("--replay", metavar="SOURCE", help="replay values.json or a database instead of the sensors")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, recorded seconds per real second")
+    parser.add_argument("--adaptive", type=float, metavar="MAX_INTERVAL",
+                        help="sample adaptively between --interval and this many seconds")
+    args = parser.parse_args()
+    adaptive = None
+    if args.adaptive:
+        from scheduler import AdaptiveScheduler
+        adaptive = AdaptiveScheduler(min_interval=args.interval, max_interval=args.adaptive)
+    replay_source = None
+    if args.replay:
+        from replay import ReplaySource
+        replay_source = ReplaySource(args.replay, speed=args.speed)
+    live = LiveFeed()
+    live.serve(host=args.host, port=args.port)
+    bundle = SensorBundle(demo=args.demo, stream_particles=True, replay=replay_source)
+    run_sampler(bundle, live, interval=args.interval,
+                db=LocalCache(args.db) if args.db else None, scheduler=adaptive)
@@ -25,9 +25,20 @@ import sqlite3
 import os
 import logging
 import json
+import queue
 import sys
-from functools import reduce
-from datetime import date, datetime, time, timedelta
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from functools import reduce, wraps
+from datetime import date, datetime, time, timedelta, timezone
+
+from archive import chunk_decimals, decode_floats, decode_timestamps, encode_floats, encode_timestamps
+from archive import from_microseconds, to_microseconds
+from gas_approx import approx_gas, default_calibration, nan_to_none
+from json_stream import iter_json_object
+from profiling import timed, tracker
+from sketch import QuantileSketch
 
 logger = logging.getLogger(__name__)
 
@@ -104,57 +115,418 @@ data_mapping = {
     'noise_1': "noise|20-1K",
     'noise_2': "noise|1K-3K",
     'noise_3': "noise|3K-8K",
-    'co2': "gas|co2"  # currently, not even implemented but I got the sensor
+    'co2': "gas|co2",  # currently, not even implemented but I got the sensor
+    'approx_no2': "approx_gas|NO2",  # the approximations are derived from the gas columns and the calibration
+    'approx_co': "approx_gas|CO",
+    'approx_nh3': "approx_gas|NH3"
+}
+approx_columns = ('approx_no2', 'approx_co', 'approx_nh3')
+
+_columns = ["timepoint", "node"] + list(data_mapping)
+# one row per timepoint and node, a second insert of the same timepoint fills the gaps of the first one instead of
+# creating a duplicate, values that are already there win over NULL but not over new values
+_insert_query = f"""
+    INSERT INTO sensor_data ({", ".join(_columns)})
+        VALUES({", ".join("?" * len(_columns))})
+        ON CONFLICT (timepoint, node) DO UPDATE SET
+            {", ".join(f"{column} = COALESCE(excluded.{column}, {column})" for column in data_mapping)}
+"""
+_select_columns = ", ".join(_columns)
+# unpacking an archived day, rows that got into sensor_data in the meantime (another process writing into a day it did
+# not know was archived) are newer than the archive and keep their values, the archive only fills their gaps
+_thaw_query = f"""
+    INSERT INTO sensor_data ({_select_columns})
+        VALUES({", ".join("?" * len(_columns))})
+        ON CONFLICT (timepoint, node) DO UPDATE SET
+            {", ".join(f"{column} = COALESCE({column}, excluded.{column})" for column in data_mapping)}
+"""
+# data_mapping paths split once, deep_get splits the string again for every single value
+_mapping_paths = [tuple(path.split("|")) for path in data_mapping.values()]
+# position of the raw gas values in a row as build by LocalCache._flatten()
+_gas_index = {name: _columns.index(f"gas_{name}") for name in ('oxidising', 'reducing', 'nh3')}
+_approx_index = [_columns.index(name) for name in approx_columns]
+
+aggregate_functions = ('avg', 'min', 'max', 'count', 'sum')
+_epoch = datetime(1970, 1, 1)  # naive, same as sqlite's strftime('%s') which treats the stored time as UTC
+# sensor_hourly keeps count, sum, min and max per hour, node and column so that aggregations over long ranges do not
+# have to touch every raw row
+_hourly_columns = [f"{column}_{stat}" for column in data_mapping for stat in ('count', 'sum', 'min', 'max')]
+_hourly_selects = ", ".join(f"COUNT({x}), SUM({x}), MIN({x}), MAX({x})" for x in data_mapping)
+# sqlite gives these back as int, the archive stores everything as float
+_integer_columns = ('particles_1_0', 'particles_2_5', 'particles_10_0')
+# decimals that are more than the sensors can actually resolve, used by LocalCache.compact() if asked to round
+sensor_precision = {
+    'gas_oxidising': 0,
+    'gas_reducing': 0,
+    'gas_nh3': 0,
+    'particles_1_0': 0,
+    'particles_2_5': 0,
+    'particles_10_0': 0,
+    'weather_temperature': 2,
+    'weather_pressure': 2,
+    'weather_humidity': 2,
+    'light_lux': 2,
+    'light_ir': 2,
+    'noise_1': 4,
+    'noise_2': 4,
+    'noise_3': 4,
+    'co2': 0,
+    'approx_no2': 4,
+    'approx_co': 4,
+    'approx_nh3': 4
 }
+# columns that get an hourly quantile sketch in sensor_sketch, see fetch_quantiles()
+sketch_columns = ('particles_1_0', 'particles_2_5', 'particles_10_0', 'noise_1', 'noise_2', 'noise_3')
+sketch_accuracy = 0.01  # relative error of the percentiles, changing it needs a rebuild of sensor_sketch
+_sketch_index = [_columns.index(name) for name in sketch_columns]
+# the tables next to sensor_data, created right away for new files and by LocalCache._migrate() for older ones
+_table_queries = {
+    'calibration': "CREATE TABLE IF NOT EXISTS calibration (name TEXT PRIMARY KEY, value REAL);",
+    'import_progress':
+        """CREATE TABLE IF NOT EXISTS import_progress (
+        source TEXT NOT NULL,
+        node TEXT NOT NULL DEFAULT '',
+        entries INTEGER,
+        updated TIMESTAMP,
+        PRIMARY KEY (source, node)
+    );""",
+    'sensor_archive': """CREATE TABLE IF NOT EXISTS sensor_archive (
+        day TEXT NOT NULL,
+        node TEXT NOT NULL,
+        name TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (day, node, name)
+    ) WITHOUT ROWID;""",
+    'sensor_sketch': """CREATE TABLE IF NOT EXISTS sensor_sketch (
+        slot INTEGER NOT NULL,
+        node TEXT NOT NULL,
+        name TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (slot, node, name)
+    ) WITHOUT ROWID;""",
+    'sensor_hourly': f"""CREATE TABLE IF NOT EXISTS sensor_hourly (
+        slot INTEGER NOT NULL,
+        node TEXT NOT NULL,
+        {", ".join(f"{x} {'INTEGER' if x.endswith('_count') else 'REAL'}" for x in _hourly_columns)},
+        PRIMARY KEY (slot, node)
+    );"""
+}
+
+
+def _naive_utc(timepoint: datetime) -> datetime:
+    # everything is stored without timezone, iso keys with an offset (+02:00) are converted to UTC first
+    if timepoint.tzinfo is None:
+        return timepoint
+    return timepoint.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _hour_slot(timepoint: datetime) -> int:
+    return int((timepoint - _epoch).total_seconds()) // 3600
+
+
+def _slot_runs(slots) -> list:
+    """
+    Groups hours into runs of neighbouring ones, [[first, last], ...], so each run is one query
+    """
+    runs = []
+    for slot in sorted(slots):
+        if runs and slot == runs[-1][1] + 1:
+            runs[-1][1] = slot
+        else:
+            runs.append([slot, slot])
+    return runs
+
+
+def _merge_partial(a: tuple, b: tuple) -> tuple:
+    """
+    Merges two (count, sum, min, max) tuples of the same bucket
+    """
+    return a[0] + b[0], a[1] + b[1], min(a[2], b[2]), max(a[3], b[3])
+
+
+def _merge_partials(target: dict, source: dict):
+    """
+    Merges partials of the format { slot: {'column': (count, sum, min, max)}} into target, in place
+    """
+    for slot, stats in source.items():
+        entry = target.setdefault(slot, {})
+        for column, partial in stats.items():
+            entry[column] = _merge_partial(entry[column], partial) if column in entry else partial
+
+
+def _fill_grid(grid: dict, columns: list, funcs: list, method: str):
+    """
+    Fills the None values of an aggregated grid (slot -> column -> func -> value) in place, either with the last value
+    before ('previous') or linear between the values before and after ('linear'), gaps at the borders stay None for
+    linear as there is nothing to interpolate from
+    """
+    slots = sorted(grid)
+    for column in columns:
+        for func in funcs:
+            known = [(slot, grid[slot][column][func]) for slot in slots if grid[slot][column][func] is not None]
+            if not known:
+                continue
+            if method == 'previous':
+                current = None
+                for slot in slots:
+                    value = grid[slot][column][func]
+                    if value is None:
+                        grid[slot][column][func] = current
+                    else:
+                        current = value
+                continue
+            for (left, left_value), (right, right_value) in zip(known, known[1:]):
+                for slot in range(left + 1, right):
+                    grid[slot][column][func] = left_value + (right_value - left_value) * (slot - left) / (right - left)
+
+
+class RecentWindow:
+    """
+    Keeps the last couple of hours of data in memory so that 'the last hour' does not have to go through sqlite every
+    single time. Entries are kept sorted by time, everything older than `hours` before the newest entry falls out of
+    the window.
+
+    The entries are kept as reading.Reading, a fraction of the memory the nested dictionaries would take, those are
+    only build by fetch()
+    """
+    def __init__(self, hours: float, start: datetime):
+        """
+        :param float hours: size of the window in hours
+        :param datetime start: everything after this point in time is known to be in the window
+        """
+        from reading import Reading  # reading.py builds on data_mapping of this module, so not at the top
+        self._reading = Reading
+        self.span = timedelta(hours=hours)
+        self.start = start
+        self.stamps = []  # sorted list of (datetime, key)
+        self.entries = {}  # key -> Reading
+
+    def add(self, row):
+        """
+        Adds one row in the format of LocalCache._flatten() or a sqlite row with the sensor_data columns
+        """
+        timepoint = row[0]
+        if isinstance(timepoint, datetime):
+            key = timepoint.isoformat(" ")  # exactly the way the sqlite adapter writes it
+        else:
+            key = timepoint
+            timepoint = datetime.fromisoformat(timepoint)
+        if timepoint <= self.start:
+            return
+        data = self._reading.from_row(row)
+        if key not in self.entries:
+            insort(self.stamps, (timepoint, key))
+            self.entries[key] = data
+        else:
+            self.entries[key].merge(data)  # same thing the upsert does in the database
+        self._prune()
+
+    def remove(self, timepoint: datetime):
+        key = timepoint.isoformat(" ")
+        if key in self.entries:
+            del self.entries[key]
+            self.stamps.remove((timepoint, key))
+
+    def covers(self, past: datetime) -> bool:
+        return past >= self.start
+
+    def fetch(self, past: datetime, future: datetime) -> dict:
+        """
+        Same semantic as LocalCache.fetch_by_range(), both borders are exclusive
+        """
+        first = bisect_right(self.stamps, (past, "\uffff"))
+        last = bisect_left(self.stamps, (future, ""))
+        return {key: self.entries[key].to_dict() for _, key in self.stamps[first:last]}
+
+    def _prune(self):
+        cutoff = self.stamps[-1][0] - self.span
+        if cutoff <= self.start:
+            return
+        self.start = cutoff
+        index = bisect_right(self.stamps, (cutoff, "\uffff"))
+        for _, key in self.stamps[:index]:
+            del self.entries[key]
+        del self.stamps[:index]
+
+
+def _reads(func):
+    """
+    Runs a fetch method of LocalCache on a connection out of the reader pool, in one read transaction so everything
+    it queries comes from the same snapshot even if the writer commits in between. Nested calls and calls from inside
+    a write use the connection that is already there
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if getattr(self._local, 'connection', None) is not None:
+            return func(self, *args, **kwargs)
+        connection = self._checkout()
+        self._local.connection = connection
+        try:
+            connection.execute("BEGIN")
+            return func(self, *args, **kwargs)
+        finally:
+            connection.rollback()  # nothing to keep, ends the read transaction
+            self._local.connection = None
+            self._readers.put(connection)
+    return wrapper
+
+
+def _writes(func):
+    """
+    Serializes the methods of LocalCache that write, there is exactly one writer connection and only one thread at a
+    time gets to use it. Reads from inside a write go through the writer as well and see what was written so far
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._write_lock:
+            previous = getattr(self._local, 'connection', None)
+            self._local.connection = self.db
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self._local.connection = previous
+    return wrapper
 
 
 class LocalCache:
-    def __init__(self, db_path):
+    def __init__(self, db_path, gas_calibration=None, cache_hours=None, cache_size=0, latency=None, readers=4,
+                 busy_timeout=5.0):
+        """
+        Opens the sqlite database or creates it if it does not exist yet, older databases get the new columns added
+
+        One instance can be shared between threads, the sampler can insert while a web or display thread reads. All
+        writes go through one connection one at a time, the fetch methods get a read only connection out of a small
+        pool. The database is switched to WAL so readers see the last commit and never wait for a write in progress,
+        other processes reading the same file (visualize.py) do not get in the way either
+
+        Optionally keeps the most recent hours in memory and remembers the results of the last few range queries, both
+        are updated or thrown away by every insert or delete of this instance. Another process writing into the same
+        file is not noticed, so only use this if this instance is the only writer
+
+        :param str db_path: path to the sqlite file
+        :param dict gas_calibration: R0 values for the gas approximation, if they differ from the ones stored in the
+        database all approx_gas columns get recomputed
+        :param float cache_hours: if set, that many hours of the newest data are kept in memory
+        :param int cache_size: number of fetch_by_range results that are remembered, 0 disables that
+        :param profiling.LatencyTracker latency: where the durations of the writes go, defaults to profiling.tracker
+        :param int readers: maximum number of read connections, more threads reading at once wait for a free one
+        :param float busy_timeout: seconds a connection waits for a lock held by another process before giving up
+        """
+        self.latency = latency or tracker
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.readers = max(1, readers)
+        self._readers = queue.LifoQueue()  # idle read connections, the last one used is the warmest
+        self._reader_count = 0
+        self._pool_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._cache_lock = threading.Lock()  # the recent window and the range cache
+        self._generation = 0  # goes up whenever the caches are thrown away, see fetch_by_range()
+        self._local = threading.local()
         if not os.path.exists(db_path):
             self.db = sqlite3.connect(db_path)
             self.cur = self.db.cursor()
             self.init_database()
             self.db.close()
         try:
-            self.db = sqlite3.connect(f"file:{db_path}?mode=rw", uri=True)
+            self.db = sqlite3.connect(f"file:{db_path}?mode=rw", uri=True, timeout=busy_timeout,
+                                      check_same_thread=False)  # only ever used by one thread at a time, see _writes
             self.db.row_factory = sqlite3.Row  # different access mode
+            self.db.execute("PRAGMA journal_mode = WAL")
+            self.db.execute("PRAGMA synchronous = NORMAL")  # safe with WAL, a power cut can only lose the last commit
             self.cur = self.db.cursor()
         except sqlite3.OperationalError as err:
             logger.error(f"Database operation error: {err}")
             raise  # I cannot actually let the instantiation fail so forwarding the exception it is
+        self.gas_calibration = dict(default_calibration)
+        self.cache_hours = cache_hours
+        self.cache_size = cache_size
+        self._recent = None
+        self._range_cache = OrderedDict()
+        self._migrate()
+        if gas_calibration:
+            self.set_gas_calibration(gas_calibration)
+        self._prime_recent()
 
     def export(self, export_format="json", time_depth=604800):
         pass
 
-    def insert_block(self, raw_data: dict, synthetic_date=None):
+    def _checkout(self) -> sqlite3.Connection:
+        """
+        An idle read connection out of the pool, a new one if there are less than self.readers, otherwise waits
+        """
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            grow = self._reader_count < self.readers
+            if grow:
+                self._reader_count += 1
+        if not grow:
+            return self._readers.get()
+        try:
+            connection = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=self.busy_timeout,
+                                         check_same_thread=False)
+        except sqlite3.Error:
+            with self._pool_lock:
+                self._reader_count -= 1
+            raise
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        The connection of the current read or write, the writer outside of both (opening, migrating)
+        """
+        return getattr(self._local, 'connection', None) or self.db
+
+    def _invalidate(self):
+        # throws away the remembered range results, has to be called with _cache_lock held
+        self._range_cache.clear()
+        self._generation += 1
+
+    @timed("db_insert_block")
+    @_writes
+    def insert_block(self, raw_data: dict, synthetic_date=None, node=""):
         """
         Inserts the output of one .get_all() into the database, or synthetic data with blanks, procdure does not
         care, will use datetime.today() of the local system for timestamp if not otherwise stated
 
-        :param dict raw_data: assumed output of .get_all() from the sensor library, will use data_mapping as key
+        If there is already an entry for that timepoint (and node) the two get merged, see _insert_query
+
+        :param dict raw_data: assumed output of .get_all() from the sensor library, will use data_mapping as key, a
+        reading.Reading works as well and brings its own time
         :param datetime synthetic_date: if set overwrites default .today() with the provided timestamp
-        """
-        query = """
-            INSERT INTO sensor_data (
-                timepoint, gas_oxidising, gas_reducing, gas_nh3, particles_1_0, particles_2_5, particles_10_0,
-                weather_temperature, weather_pressure, weather_humidity, light_lux, light_ir, noise_1, noise_2, noise_3,
-                co2)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        :param str node: name of the device the data comes from, empty for this one
         """
         # my one-liner sense tingles, but I cant be bothered
         if synthetic_date and isinstance(synthetic_date, datetime):
-            inserts = [synthetic_date]
+            timepoint = synthetic_date
         else:
-            inserts = [datetime.now()]  # I once read that a list is a collection of similar items, well about that...
-        for key, path in data_mapping.items():
-            inserts.append(deep_get(raw_data, path))
+            timepoint = getattr(raw_data, "timepoint", None) or datetime.now()
+        if hasattr(raw_data, "to_row"):  # a Reading, already in the right order
+            inserts = [raw_data.to_row(node)]
+            inserts[0][0] = timepoint
+        else:
+            inserts = [self._flatten(raw_data, timepoint, node)]
         try:
-            self.cur.execute(query, tuple(inserts))
+            self._write_rows(inserts)
             self.db.commit()
-        except ValueError:
-            logging.error("Value Error, test, delete this")
+        except ValueError as e:
+            self.db.rollback()
+            logger.error(f"LocalCache.insert_block() could not write the reading of {timepoint}: {e}")
+            return
+        except BaseException:
+            self.db.rollback()  # the write transaction would otherwise keep the file locked for other processes
+            raise
+        self._cache_inserted(inserts)
 
-    def insert_bulk(self, raw_data_list: dict):
+    @timed("db_insert_bulk")
+    @_writes
+    def insert_bulk(self, raw_data_list: dict, node=""):
         """
         Inserts a more than one entry into the database of the format:
         "isoformat-data": { key: value }
@@ -166,13 +538,11 @@ class LocalCache:
         This might be aswell:
         `for key, raw_data in raw_data_list():`
         `    my_db.insert_block(raw_data, synthetic_date=datetime.fromisoformat(key))`
-        """
-        query = """
-            INSERT INTO sensor_data (
-                timepoint, gas_oxidising, gas_reducing, gas_nh3, particles_1_0, particles_2_5, particles_10_0,
-                weather_temperature, weather_pressure, weather_humidity, light_lux, light_ir, noise_1, noise_2, noise_3,
-                co2)
-                VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+
+        Entries that already exist are merged and not duplicated, so the same data can be inserted twice
+
+        :param dict raw_data_list: dictionary of the format { 'iso_string' : {'gas': {}, ...}, ...}
+        :param str node: name of the device the data comes from, empty for this one
         """
         date_errors = 0
         inserts = []
@@ -183,20 +553,51 @@ class LocalCache:
             except ValueError:
                 date_errors += 1
                 continue
-            one_line = [temp_date]
-            for prop, path in data_mapping.items():
-                one_line.append(deep_get(value, path))
-            inserts.append(tuple(one_line))
+            inserts.append(self._flatten(value, temp_date, node))
         try:
-            self.cur.executemany(query, inserts)
+            self._write_rows(inserts)
             self.db.commit()
         except sqlite3.OperationalError as e:
+            self.db.rollback()
             logger.error(f"LocalCache.insert_bulk() failed with exception: {e}")
             return False
+        except BaseException:
+            self.db.rollback()
+            raise
+        self._cache_inserted(inserts)
         if date_errors > 0:
             logger.warning(f"There were {date_errors} parsing errors of iso strings")
         return True
 
+    @timed("db_insert_readings")
+    @_writes
+    def insert_readings(self, readings, node=""):
+        """
+        Inserts many readings at once without any dictionaries in between
+
+        :param readings: a reading.ReadingBatch or a list of reading.Reading, every one of them needs a timepoint
+        :param str node: name of the device the data comes from, empty for this one
+        """
+        if hasattr(readings, "rows"):
+            inserts = readings.rows(node)
+        else:
+            inserts = [reading.to_row(node) for reading in readings]
+        if any(row[0] is None for row in inserts):
+            raise ValueError("LocalCache.insert_readings: every reading needs a timepoint")
+        try:
+            self._write_rows(inserts)
+            self.db.commit()
+        except sqlite3.OperationalError as e:
+            self.db.rollback()
+            logger.error(f"LocalCache.insert_readings() failed with exception: {e}")
+            return False
+        except BaseException:
+            self.db.rollback()
+            raise
+        self._cache_inserted(inserts)
+        return True
+
+    @_reads
     def fetch_by_exact_date(self, target_date: datetime) -> dict:
         """
         Fetches exactly one entry by an exact datetime (down to the millisecond)
@@ -205,14 +606,15 @@ class LocalCache:
         :returns: Either None if nothing was found or a dictionary containing all available data
         :rtype: None or dict
         """
-        query = """SELECT timepoint, gas_oxidising, gas_reducing, gas_nh3, particles_1_0, particles_2_5, particles_10_0,
-                    weather_temperature, weather_pressure, weather_humidity, light_lux, light_ir, noise_1, noise_2,
-                    noise_3, co2 
+        query = f"""SELECT {_select_columns}
                 FROM sensor_data 
                 WHERE timepoint = ? 
                 LIMIT 1"""
-        self.cur.execute(query, [target_date])
-        raw_data = self.cur.fetchone()
+        raw_data = self._connection().execute(query, [target_date]).fetchone()
+        if raw_data is None:
+            archived = self._archived_rows(target_date, target_date + timedelta(microseconds=1), include_start=True)
+            if archived:
+                return LocalCache._row_to_transfer_format(LocalCache._archived_to_raw(archived[0]))
         return LocalCache._row_to_transfer_format(raw_data)
 
     def fetch_by_aoe_date(self, target_date: datetime, aoe: int) -> dict:
@@ -230,28 +632,270 @@ class LocalCache:
         future = target_date+delta
         return self.fetch_by_range(past, future)
 
-    def fetch_by_range(self, past: datetime, future: datetime):
+    @_reads
+    def fetch_by_range(self, past: datetime, future: datetime, node=None):
         """
         Fetches as many entries as possible for the given intervall
         :param datetime past: earlierst point in time you want data from, precise to the millisecond
         :param datetime future: latest point in t ime you want data from
+        :param str node: only data of this device, None for all of them (same timepoints of different nodes overwrite
+        each other in the result then)
         :returns: a dictionary with the format { 'iso_string' : {'data_a': {}, 'data_b': {}, ...}, 'iso_string': ....}
         """
-        query = """SELECT 
-                        timepoint, gas_oxidising, gas_reducing, gas_nh3, particles_1_0, particles_2_5, particles_10_0,
-                        weather_temperature, weather_pressure, weather_humidity, light_lux, light_ir, noise_1, noise_2, 
-                        noise_3, co2 
+        with self._cache_lock:
+            if node is None and self._recent and self._recent.covers(past):
+                return self._recent.fetch(past, future)
+            if (past, future, node) in self._range_cache:
+                self._range_cache.move_to_end((past, future, node))
+                return dict(self._range_cache[(past, future, node)])
+            generation = self._generation
+        query = f"""SELECT {_select_columns}
                     FROM sensor_data 
                     WHERE timepoint > ? AND timepoint < ?"""
+        params = [past, future]
+        if node is not None:
+            query += " AND node = ?"
+            params.append(node)
         # db call
-        self.cur.execute(query, (past, future))
-        rows = self.cur.fetchall()
-        # data processing
+        rows = self._connection().execute(query, params).fetchall()
+        # data processing, older days come out of the archive
         result = {}
+        for raw_data in self._archived_rows(past, future, node):
+            result.update(LocalCache._row_to_transfer_format(LocalCache._archived_to_raw(raw_data)))
         for raw_data in rows:
             result.update(LocalCache._row_to_transfer_format(raw_data))
+        if self.cache_size > 0:
+            with self._cache_lock:
+                if generation == self._generation:  # nothing was written while this was read
+                    self._range_cache[(past, future, node)] = result
+                    if len(self._range_cache) > self.cache_size:
+                        self._range_cache.popitem(last=False)
+            return dict(result)
         return result
 
+    @_reads
+    def fetch_aggregated(self, past: datetime, future: datetime, bucket, funcs=('avg', 'min', 'max', 'count'),
+                         columns=None, fill=None, node=None) -> dict:
+        """
+        Cuts the time between past and future into equal buckets and aggregates every column per bucket, the grouping
+        is done by sqlite so only one row per bucket ever reaches python. Buckets are aligned to the unix epoch, so 15
+        minute buckets always start at :00, :15, :30 and :45
+
+        `db.fetch_aggregated(now - timedelta(days=7), now, timedelta(minutes=15), columns=['particles_2_5'])`
+
+        :param datetime past: start of the range, inclusive
+        :param datetime future: end of the range, exclusive
+        :param bucket: size of one bucket as timedelta or in seconds
+        :param funcs: any of aggregate_functions
+        :param list columns: keys of data_mapping, defaults to all of them
+        :param str fill: what happens with buckets without data: None leaves them None (count 0), 'previous' carries
+        the last known bucket forward and 'linear' interpolates between the neighbouring buckets with data
+        :param str node: only data of this device, None for all of them
+        :returns: a regular grid of the format { 'iso_string_bucket_start' : {'column': {'avg': x, 'max': y}, ...}, ...}
+        :rtype: dict
+        """
+        bucket = int(bucket.total_seconds()) if isinstance(bucket, timedelta) else int(bucket)
+        if bucket < 1:
+            raise ValueError("LocalCache.fetch_aggregated: bucket has to be at least one second")
+        columns = list(columns) if columns else list(data_mapping)
+        unknown = [x for x in columns if x not in data_mapping] + [x for x in funcs if x not in aggregate_functions]
+        if unknown:
+            raise ValueError(f"LocalCache.fetch_aggregated: unknown columns or functions {unknown}")
+        if fill not in (None, 'previous', 'linear'):
+            raise ValueError(f"LocalCache.fetch_aggregated: unknown fill method {fill}")
+        # whole seconds, rounded down for the start and up for the end, a future of 10:00:00.5 still has half a second
+        # of data in the 10:00 bucket
+        first = (past - _epoch) // timedelta(seconds=1) // bucket
+        last = (-((_epoch - future) // timedelta(seconds=1)) - 1) // bucket
+        partials = self._aggregate_partials(past, future, bucket, columns, node)
+
+        grid = {}
+        for slot in range(first, last + 1):
+            stats = partials.get(slot, {})
+            entry = {}
+            for column in columns:
+                count, total, minimum, maximum = stats.get(column, (0, None, None, None))
+                values = {'count': count, 'sum': total, 'min': minimum, 'max': maximum,
+                          'avg': total / count if count else None}
+                entry[column] = {func: values[func] for func in funcs}
+            grid[slot] = entry
+        if fill:
+            _fill_grid(grid, columns, [x for x in funcs if x != 'count'], fill)
+        return {(_epoch + timedelta(seconds=slot * bucket)).isoformat(" "): entry for slot, entry in grid.items()}
+
+    def _aggregate_partials(self, past: datetime, future: datetime, bucket: int, columns: list, node=None) -> dict:
+        """
+        Count, sum, min and max per bucket and column, those can be merged with other partials. Buckets that are whole
+        hours come from the sensor_hourly rollup, only the partial hours at the borders of the range are read from the
+        raw rows
+
+        :returns: dictionary of the format { slot: {'column': (count, sum, min, max)}} with slot = epoch // bucket
+        """
+        if bucket % 3600:
+            return self._raw_partials(past, future, bucket, columns, node)
+        first_hour = -(-int((past - _epoch).total_seconds()) // 3600)  # rounded up
+        last_hour = int((future - _epoch).total_seconds()) // 3600
+        if first_hour >= last_hour:
+            return self._raw_partials(past, future, bucket, columns, node)
+        selects = ", ".join(f"SUM({x}_count), SUM({x}_sum), MIN({x}_min), MAX({x}_max)" for x in columns)
+        query = f"""SELECT slot / ? AS bucket_slot, {selects}
+                    FROM sensor_hourly
+                    WHERE slot >= ? AND slot < ?"""
+        params = [bucket // 3600, first_hour, last_hour]
+        if node is not None:
+            query += " AND node = ?"
+            params.append(node)
+        partials = self._collect_partials(self._connection().execute(query + " GROUP BY bucket_slot", params),
+                                          columns)
+        for start, end in ((past, _epoch + timedelta(hours=first_hour)), (_epoch + timedelta(hours=last_hour), future)):
+            if start < end:
+                _merge_partials(partials, self._raw_partials(start, end, bucket, columns, node))
+        return partials
+
+    def _raw_partials(self, past: datetime, future: datetime, bucket: int, columns: list, node=None) -> dict:
+        selects = ", ".join(f"COUNT({x}), SUM({x}), MIN({x}), MAX({x})" for x in columns)
+        query = f"""SELECT CAST(strftime('%s', timepoint) AS INTEGER) / ? AS slot, {selects}
+                    FROM sensor_data
+                    WHERE timepoint >= ? AND timepoint < ?"""
+        params = [bucket, past, future]
+        if node is not None:
+            query += " AND node = ?"
+            params.append(node)
+        partials = self._collect_partials(self._connection().execute(query + " GROUP BY slot", params), columns)
+        rows = self._archived_rows(past, future, node, columns, include_start=True)
+        if rows:
+            _merge_partials(partials, self._partials_from_rows(rows, bucket, columns))
+        return partials
+
+    @staticmethod
+    def _partials_from_rows(rows: list, bucket: int, columns: list) -> dict:
+        """
+        Same as the GROUP BY of _raw_partials() but in python, for rows as given by _archived_rows()
+        """
+        partials = {}
+        for row in rows:
+            stats = partials.setdefault(int((row[0] - _epoch).total_seconds()) // bucket, {})
+            for column, value in zip(columns, row[2:]):
+                if value is None:
+                    continue
+                current = stats.get(column)
+                if current is None:
+                    stats[column] = (1, value, value, value)
+                else:
+                    stats[column] = (current[0] + 1, current[1] + value, min(current[2], value), max(current[3], value))
+        return partials
+
+    @staticmethod
+    def _collect_partials(rows, columns: list) -> dict:
+        partials = {}
+        for row in rows:
+            partials[row[0]] = {
+                column: tuple(row[1 + i * 4:5 + i * 4]) for i, column in enumerate(columns) if row[1 + i * 4]
+            }
+        return partials
+
+    @_reads
+    def fetch_quantiles(self, past: datetime, future: datetime, quantiles=(0.5, 0.98), columns=None, bucket=None,
+                        node=None) -> dict:
+        """
+        Percentiles of the sketched columns without touching the raw rows, the hourly sketches of sensor_sketch are
+        merged over the range, only the partial hours at the borders come from sensor_data. Every value is within
+        sketch_accuracy (1%) of the exact percentile
+
+        `db.fetch_quantiles(now - timedelta(days=90), now, (0.98, ), ['particles_2_5'], bucket=timedelta(days=1))`
+
+        :param datetime past: start of the range, inclusive
+        :param datetime future: end of the range, exclusive
+        :param quantiles: between 0 and 1, 0.5 is the median
+        :param list columns: any of sketch_columns, defaults to all of them
+        :param bucket: None for one result over the whole range, otherwise timedelta or seconds, whole hours only,
+        aligned to the unix epoch like fetch_aggregated()
+        :param str node: only data of this device, None for all of them
+        :returns: without bucket {'column': {'count': n, 0.5: x, 0.98: y}, ...}, with bucket a grid of that per bucket
+        { 'iso_string_bucket_start' : {'column': {...}, ...}, ...}. Values are None if there is no data
+        :rtype: dict
+        """
+        columns = list(columns) if columns else list(sketch_columns)
+        unknown = [x for x in columns if x not in sketch_columns]
+        if unknown:
+            raise ValueError(f"LocalCache.fetch_quantiles: no sketches for the columns {unknown}")
+        if any(not 0 <= q <= 1 for q in quantiles):
+            raise ValueError("LocalCache.fetch_quantiles: quantiles have to be between 0 and 1")
+        if bucket is not None:
+            bucket = int(bucket.total_seconds()) if isinstance(bucket, timedelta) else int(bucket)
+            if bucket < 3600 or bucket % 3600:
+                raise ValueError("LocalCache.fetch_quantiles: bucket has to be whole hours, sketches are hourly")
+        sketches = self._merged_sketches(past, future, bucket, columns, node)
+
+        def evaluate(entry: dict) -> dict:
+            result = {}
+            for column in columns:
+                sketch = entry.get(column)
+                values = {'count': sketch.count if sketch else 0}
+                values.update({q: sketch.quantile(q) if sketch else None for q in quantiles})
+                result[column] = values
+            return result
+
+        if bucket is None:
+            return evaluate(sketches.get(0, {}))
+        # whole seconds, rounded down for the start and up for the end, a future of 10:00:00.5 still has half a second
+        # of data in the 10:00 bucket
+        first = (past - _epoch) // timedelta(seconds=1) // bucket
+        last = (-((_epoch - future) // timedelta(seconds=1)) - 1) // bucket
+        return {(_epoch + timedelta(seconds=slot * bucket)).isoformat(" "): evaluate(sketches.get(slot, {}))
+                for slot in range(first, last + 1)}
+
+    def _merged_sketches(self, past: datetime, future: datetime, bucket, columns: list, node=None) -> dict:
+        """
+        :param int bucket: seconds, None puts everything into slot 0
+        :returns: dictionary of the format { slot: {'column': QuantileSketch}} with slot = epoch // bucket
+        """
+        merged = {}
+        first_hour = -(-int((past - _epoch).total_seconds()) // 3600)  # rounded up
+        last_hour = int((future - _epoch).total_seconds()) // 3600
+        if first_hour >= last_hour:
+            borders = [(past, future)]
+        else:
+            borders = [(past, _epoch + timedelta(hours=first_hour)), (_epoch + timedelta(hours=last_hour), future)]
+            query = f"""SELECT slot, name, data
+                        FROM sensor_sketch
+                        WHERE slot >= ? AND slot < ? AND name IN ({", ".join("?" * len(columns))})"""
+            params = [first_hour, last_hour] + columns
+            if node is not None:
+                query += " AND node = ?"
+                params.append(node)
+            for slot, name, data in self._connection().execute(query, params):
+                entry = merged.setdefault(slot * 3600 // bucket if bucket else 0, {})
+                sketch = QuantileSketch.from_bytes(data)
+                if name in entry:
+                    entry[name].merge(sketch)
+                else:
+                    entry[name] = sketch
+        # the partial hours at the borders, straight from the rows
+        for start, end in borders:
+            if start >= end:
+                continue
+            query = f"""SELECT CAST(strftime('%s', timepoint) AS INTEGER), {", ".join(columns)}
+                        FROM sensor_data
+                        WHERE timepoint >= ? AND timepoint < ?"""
+            params = [start, end]
+            if node is not None:
+                query += " AND node = ?"
+                params.append(node)
+            rows = self._connection().execute(query, params).fetchall()
+            rows.extend((int((row[0] - _epoch).total_seconds()), *row[2:])
+                        for row in self._archived_rows(start, end, node, columns, include_start=True))
+            for row in rows:
+                if row[0] is None:
+                    continue
+                entry = merged.setdefault(row[0] // bucket if bucket else 0, {})
+                for column, value in zip(columns, row[1:]):
+                    if value is not None:
+                        if column not in entry:
+                            entry[column] = QuantileSketch(sketch_accuracy)
+                        entry[column].add(value)
+        return merged
+
     @staticmethod
     def _row_to_transfer_format(raw_data):
         data_point = {}
@@ -262,12 +906,590 @@ class LocalCache:
                 deep_update(data_point, deep_set(raw_data[key], data_mapping[key]))
         return {raw_data['timepoint']: data_point}
 
+    @staticmethod
+    def _flatten(raw_data: dict, timepoint, node="") -> list:
+        """
+        Turns one nested dictionary as given by .get_all() into a list in the order of the columns of sensor_data
+        """
+        one_line = [timepoint, node]
+        for keys in _mapping_paths:
+            value = raw_data
+            for key in keys:
+                value = value.get(key) if isinstance(value, dict) else None
+            one_line.append(value)
+        return one_line
+
+    def _fill_approx(self, rows: list) -> list:
+        """
+        Overwrites the approx_gas part of the given rows (lists as given by _flatten()) with values calculated from the
+        raw gas columns with the calibration of this database, all rows at once
+
+        :param list rows: list of mutable rows
+        :returns: the very same list, changed in place
+        """
+        if not rows:
+            return rows
+        approx = approx_gas(
+            [row[_gas_index['oxidising']] for row in rows],
+            [row[_gas_index['reducing']] for row in rows],
+            [row[_gas_index['nh3']] for row in rows],
+            calibration=self.gas_calibration
+        )
+        for index, values in zip(_approx_index, (approx['NO2'], approx['CO'], approx['NH3'])):
+            for row, value in zip(rows, nan_to_none(values)):
+                row[index] = value
+        return rows
+
+    def _write_rows(self, rows: list):
+        """
+        The one place rows (as given by _flatten()) get written, calculates the approx_gas columns, upserts the rows and
+        refreshes the hourly rollup of the touched hours, commiting is up to the caller. Timepoints with a timezone are
+        converted to naive UTC in place
+
+        New rows are simply added to the stored sketches of their hour, only hours in which an existing row got
+        overwritten by the upsert are sketched again from the raw rows
+        """
+        if not rows:
+            return
+        for row in rows:
+            row[0] = _naive_utc(row[0])
+        self._begin()
+        days = {(row[0].date().isoformat(), row[1]) for row in rows}
+        for day, node in days & self._archived_days(min(days)[0], max(days)[0]):
+            self._thaw(day, node)
+        self._fill_approx(rows)
+        existing = self._existing_keys(rows)
+        self.cur.executemany(_insert_query, rows)
+        slots = {}
+        changed = {}  # hours with an overwritten row, per node
+        seen = set()
+        for row in rows:
+            slot = _hour_slot(row[0])
+            slots.setdefault(row[1], set()).add(slot)
+            key = (row[0].isoformat(" "), row[1])
+            if key in existing or key in seen:
+                changed.setdefault(row[1], set()).add(slot)
+            seen.add(key)
+        for node, node_slots in slots.items():
+            self._refresh_hourly(node_slots, node)
+            if node in changed:
+                self._refresh_sketches(changed[node], node)
+        self._add_to_sketches([row for row in rows if _hour_slot(row[0]) not in changed.get(row[1], ())])
+
+    def _existing_keys(self, rows: list) -> set:
+        """
+        Which of the rows are already in sensor_data and get merged by the upsert instead of inserted
+
+        :returns: set of (timepoint as stored, node)
+        :rtype: set
+        """
+        found = set()
+        nodes = {}
+        for row in rows:
+            nodes.setdefault(row[1], []).append(row[0])
+        for node, stamps in nodes.items():
+            for start in range(0, len(stamps), 500):  # sqlite has a limit on the number of parameters
+                part = stamps[start:start + 500]
+                found.update((stamp, node) for stamp, in self.db.execute(
+                    f"SELECT timepoint FROM sensor_data WHERE node = ? AND timepoint IN ({', '.join('?' * len(part))})",
+                    [node] + part))
+        return found
+
+    def _add_to_sketches(self, rows: list):
+        """
+        Merges rows that are new in sensor_data into the stored sketches of their hours, a sketch only ever counts
+        values so this is exact as long as no value it already counted got replaced
+        """
+        pending = {}  # (slot, node) -> {column: QuantileSketch}
+        for row in rows:
+            key = (_hour_slot(row[0]), row[1])
+            sketches = pending.get(key)
+            if sketches is None:
+                sketches = pending[key] = {column: QuantileSketch(sketch_accuracy) for column in sketch_columns}
+                for name, data in self.db.execute("SELECT name, data FROM sensor_sketch WHERE slot = ? AND node = ?",
+                                                  key):
+                    sketches[name] = QuantileSketch.from_bytes(data)
+            for column, index in zip(sketch_columns, _sketch_index):
+                if row[index] is not None:
+                    sketches[column].add(row[index])
+        self.cur.executemany(
+            "INSERT OR REPLACE INTO sensor_sketch (slot, node, name, count, data) VALUES (?, ?, ?, ?, ?)",
+            [(slot, node, column, sketch.count, sketch.to_bytes())
+             for (slot, node), sketches in pending.items() for column, sketch in sketches.items() if sketch.count])
+
+    def _refresh_hourly(self, slots=None, node=None):
+        """
+        Recalculates the sensor_hourly rollup for the given hours (slot = hours since the epoch) from sensor_data,
+        neighbouring hours are done in one go, without slots the whole table is rebuild, archived days included
+
+        :param set slots: hours that changed, None for all of them
+        :param str node: only the rollup of this device, None for all of them. Archived days of other devices in the
+        same hours are not in sensor_data, so give the node whenever only one device changed
+        """
+        insert = f"""INSERT INTO sensor_hourly (slot, node, {", ".join(_hourly_columns)})
+                     SELECT CAST(strftime('%s', timepoint) AS INTEGER) / 3600 AS slot, node, {_hourly_selects}
+                     FROM sensor_data"""
+        if slots is None:
+            self.cur.execute("DELETE FROM sensor_hourly")
+            self.cur.execute(insert + " GROUP BY slot, node")
+            for day, archived_node in self._archived_days():
+                self._archive_hourly(day, archived_node)
+            return
+        node_filter, node_params = (" AND node = ?", (node, )) if node is not None else ("", ())
+        for first, last in _slot_runs(slots):
+            self.cur.execute("DELETE FROM sensor_hourly WHERE slot >= ? AND slot <= ?" + node_filter,
+                             (first, last) + node_params)
+            self.cur.execute(
+                insert + " WHERE timepoint >= ? AND timepoint < ?" + node_filter + " GROUP BY slot, node",
+                (_epoch + timedelta(hours=first), _epoch + timedelta(hours=last + 1)) + node_params)
+
+    def _archive_hourly(self, day: str, node: str):
+        """
+        Writes the sensor_hourly rows of one archived day, only needed when the whole rollup gets rebuild
+        """
+        start = datetime.fromisoformat(day)
+        columns = list(data_mapping)
+        rows = self._archived_rows(start, start + timedelta(days=1), node, include_start=True)
+        inserts = []
+        for slot, stats in self._partials_from_rows(rows, 3600, columns).items():
+            values = [slot, node]
+            for column in columns:
+                values.extend(stats.get(column, (0, None, None, None)))
+            inserts.append(values)
+        self.cur.executemany(
+            f"INSERT INTO sensor_hourly (slot, node, {', '.join(_hourly_columns)}) "
+            f"VALUES ({', '.join('?' * (len(_hourly_columns) + 2))})", inserts)
+
+    def _refresh_sketches(self, slots=None, node=None):
+        """
+        Rebuilds the quantile sketches in sensor_sketch for the given hours from the raw rows, same rules as
+        _refresh_hourly(). Needed whenever the upsert overwrote values, a sketch cannot forget a value it has counted,
+        plain new rows go through _add_to_sketches()
+
+        :param set slots: hours that changed, None for all of them
+        :param str node: only the sketches of this device, None for all of them
+        """
+        select = f"""SELECT CAST(strftime('%s', timepoint) AS INTEGER) / 3600 AS slot, node, {", ".join(sketch_columns)}
+                     FROM sensor_data"""
+        if slots is None:
+            self.cur.execute("DELETE FROM sensor_sketch")
+            self._store_sketches(self.db.execute(select + " ORDER BY timepoint"))
+            for day, archived_node in sorted(self._archived_days()):
+                start = datetime.fromisoformat(day)
+                rows = self._archived_rows(start, start + timedelta(days=1), archived_node, sketch_columns, True)
+                self._store_sketches((_hour_slot(row[0]), *row[1:]) for row in rows)
+            return
+        node_filter, node_params = (" AND node = ?", (node, )) if node is not None else ("", ())
+        for first, last in _slot_runs(slots):
+            self.cur.execute("DELETE FROM sensor_sketch WHERE slot >= ? AND slot <= ?" + node_filter,
+                             (first, last) + node_params)
+            self._store_sketches(self.db.execute(
+                select + " WHERE timepoint >= ? AND timepoint < ?" + node_filter,
+                (_epoch + timedelta(hours=first), _epoch + timedelta(hours=last + 1)) + node_params))
+
+    def _store_sketches(self, rows):
+        """
+        Sketches rows of (slot, node, *sketch_columns) and writes one sensor_sketch row per hour, node and column. The
+        rows have to be sorted by slot, every hour is written as soon as the rows move past it so a full rebuild does
+        not keep the whole history in memory
+        """
+        pending = {}  # (slot, node) -> {column: QuantileSketch}
+        current = None
+
+        def flush(before):
+            done = [key for key in pending if before is None or key[0] < before]
+            self.cur.executemany(
+                "INSERT INTO sensor_sketch (slot, node, name, count, data) VALUES (?, ?, ?, ?, ?)",
+                [(slot, node, column, sketch.count, sketch.to_bytes())
+                 for slot, node in done for column, sketch in pending.pop((slot, node)).items() if sketch.count])
+
+        for row in rows:
+            if row[0] is None:  # timepoint sqlite could not parse
+                continue
+            if current is not None and row[0] > current:
+                flush(row[0])
+            current = row[0]
+            sketches = pending.get((row[0], row[1]))
+            if sketches is None:
+                sketches = pending[(row[0], row[1])] = {x: QuantileSketch(sketch_accuracy) for x in sketch_columns}
+            for column, value in zip(sketch_columns, row[2:]):
+                if value is not None:
+                    sketches[column].add(value)
+        flush(None)
+
+    def _cache_inserted(self, rows: list):
+        """
+        Keeps the in memory caches consistent after rows were written, the recent window simply gets the new rows, the
+        remembered range results are thrown away as a whole
+        """
+        with self._cache_lock:
+            self._invalidate()
+            if self._recent:
+                for row in rows:
+                    self._recent.add(row)
+
+    def _prime_recent(self):
+        """
+        (Re)fills the recent window from the database, called on open and when rows changed in bulk
+        """
+        with self._cache_lock:
+            self._invalidate()
+        if not self.cache_hours:
+            return
+        newest = self.db.execute("SELECT MAX(timepoint) FROM sensor_data").fetchone()[0]
+        newest = datetime.fromisoformat(newest) if newest else None
+        last_day = self.db.execute("SELECT MAX(day) FROM sensor_archive").fetchone()[0]
+        if last_day:  # if everything is archived the newest data is in there
+            archived = self._archived_rows(datetime.fromisoformat(last_day), datetime.max)
+            if archived:
+                last_archived = max(row[0] for row in archived)
+                newest = last_archived if newest is None else max(newest, last_archived)
+        newest = newest or datetime.now()
+        start = newest - timedelta(hours=self.cache_hours)
+        recent = RecentWindow(self.cache_hours, start)  # filled first, readers only ever see a complete window
+        for row in self._archived_rows(start, datetime.max):
+            recent.add(row)
+        query = f"SELECT {_select_columns} FROM sensor_data WHERE timepoint > ? ORDER BY timepoint"
+        for row in self.db.execute(query, (start, )):
+            recent.add(tuple(row))
+        with self._cache_lock:
+            self._recent = recent
+            self._invalidate()
+
+    @_writes
+    def set_gas_calibration(self, calibration: dict):
+        """
+        Stores new R0 values for the gas approximation and recomputes every approx_gas column in the database if they
+        actually changed
+
+        :param dict calibration: R0 values with the keys 'oxidising', 'reducing' and/or 'nh3'
+        """
+        new_calibration = dict(self.gas_calibration)
+        new_calibration.update(calibration)
+        if new_calibration == self.gas_calibration:
+            return
+        self.gas_calibration = new_calibration
+        self.cur.executemany(
+            "INSERT OR REPLACE INTO calibration (name, value) VALUES (?, ?)",
+            [(f"gas_r0_{key}", value) for key, value in new_calibration.items()]
+        )
+        self.db.commit()
+        self.recompute_approx_gas()
+
+    @_writes
+    def recompute_approx_gas(self, only_missing=False, batch_size=50000):
+        """
+        Calculates the approx_gas columns for existing rows, in batches and vectorized, used for backfilling older
+        databases and after the calibration changed
+
+        :param bool only_missing: only touch rows that have no approximation yet
+        :param int batch_size: amount of rows that are calculated at once
+        :returns: number of rows updated
+        :rtype: int
+        """
+        query = "SELECT uid, gas_oxidising, gas_reducing, gas_nh3 FROM sensor_data"
+        if only_missing:
+            query += " WHERE approx_no2 IS NULL AND gas_oxidising IS NOT NULL"
+        update = "UPDATE sensor_data SET approx_no2 = ?, approx_co = ?, approx_nh3 = ? WHERE uid = ?"
+        reader = self.db.cursor()
+        reader.execute(query)
+        updated = 0
+        while True:
+            rows = reader.fetchmany(batch_size)
+            if not rows:
+                break
+            approx = approx_gas(
+                [row[1] for row in rows], [row[2] for row in rows], [row[3] for row in rows],
+                calibration=self.gas_calibration
+            )
+            self.cur.executemany(update, zip(
+                nan_to_none(approx['NO2']), nan_to_none(approx['CO']), nan_to_none(approx['NH3']),
+                [row[0] for row in rows]
+            ))
+            updated += len(rows)
+        if not only_missing:
+            updated += self._recompute_archive_approx()
+        self._refresh_hourly()
+        self.db.commit()
+        if updated:
+            self._prime_recent()
+        return updated
+
+    def _migrate(self):
+        """
+        Brings databases created by older versions up to date, adds the approx_gas columns and backfills them, adds
+        the node column and the unique index (merging existing duplicates once), builds the hourly rollup and the
+        quantile sketches and loads the stored gas calibration
+        """
+        tables = {row[0] for row in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        has_sketch = 'sensor_sketch' in tables
+        has_hourly = 'sensor_hourly' in tables
+        if 'import_progress' in tables and 'node' not in {row[1] for row in self.db.execute(
+                "PRAGMA table_info(import_progress)")}:
+            # progress used to be per file only, the node it was imported as is unknown so it goes to the default one
+            self.db.execute("ALTER TABLE import_progress RENAME TO import_progress_old")
+            self.db.execute(_table_queries['import_progress'])
+            self.db.execute("INSERT INTO import_progress (source, node, entries, updated) "
+                            "SELECT source, '', entries, updated FROM import_progress_old")
+            self.db.execute("DROP TABLE import_progress_old")
+        for query in _table_queries.values():
+            self.db.execute(query)
+        existing = {row[1] for row in self.db.execute("PRAGMA table_info(sensor_data)")}
+        added = False
+        for column in approx_columns:
+            if column not in existing:
+                self.db.execute(f"ALTER TABLE sensor_data ADD COLUMN {column} REAL")
+                added = True
+        if 'node' not in existing:
+            self.db.execute("ALTER TABLE sensor_data ADD COLUMN node TEXT NOT NULL DEFAULT ''")
+        has_index = self.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'sensor_data_timepoint'").fetchone()
+        if not has_index:
+            self._merge_duplicates()
+            self.db.execute("CREATE UNIQUE INDEX sensor_data_timepoint ON sensor_data (timepoint, node);")
+        self.db.commit()
+        for name, value in self.db.execute("SELECT name, value FROM calibration"):
+            if name.startswith("gas_r0_"):
+                self.gas_calibration[name[7:]] = value
+        if added:
+            logger.info("LocalCache: added approx_gas columns, backfilling existing rows")
+            self.recompute_approx_gas(only_missing=True)
+        elif not has_hourly:
+            logger.info("LocalCache: building the hourly rollup")
+            self._refresh_hourly()
+            self.db.commit()
+        if not has_sketch:
+            logger.info("LocalCache: building the quantile sketches")
+            self._refresh_sketches()
+            self.db.commit()
+
+    def _merge_duplicates(self):
+        """
+        Older versions happily inserted the same timepoint more than once, before the unique index can be created
+        those get merged into the oldest row, the first value that is not NULL wins per column
+        """
+        groups = self.db.execute(
+            "SELECT timepoint, node FROM sensor_data GROUP BY timepoint, node HAVING COUNT(*) > 1").fetchall()
+        if not groups:
+            return
+        logger.warning(f"LocalCache: merging {len(groups)} duplicated timepoints")
+        columns = list(data_mapping)
+        for timepoint, node in groups:
+            rows = self.db.execute(
+                f"SELECT uid, {', '.join(columns)} FROM sensor_data WHERE timepoint = ? AND node = ? ORDER BY uid",
+                (timepoint, node)).fetchall()
+            merged = [next((row[i] for row in rows if row[i] is not None), None) for i in range(1, len(columns) + 1)]
+            self.db.execute(
+                f"UPDATE sensor_data SET {', '.join(f'{column} = ?' for column in columns)} WHERE uid = ?",
+                merged + [rows[0][0]])
+            self.db.executemany("DELETE FROM sensor_data WHERE uid = ?", [(row[0], ) for row in rows[1:]])
+
+    @_writes
     def delete_by_date(self, target_date: datetime):
         """
         Attempts to delete all timepoints with the exact ISO Date, to the millisecond
         """
-        query = """DELETE FROM sensor_data WHERE timepoint = ? """
-        self.db.execute(query, [target_date])
+        try:
+            self._begin()
+            for day, node in self._archived_days(target_date.date().isoformat()):
+                self._thaw(day, node)
+            query = """DELETE FROM sensor_data WHERE timepoint = ? """
+            self.db.execute(query, [target_date])
+            self._refresh_hourly({_hour_slot(target_date)})
+            self._refresh_sketches({_hour_slot(target_date)})
+            self.db.commit()
+        except BaseException:
+            self.db.rollback()
+            raise
+        with self._cache_lock:
+            self._invalidate()
+            if self._recent:
+                self._recent.remove(target_date)
+
+    def compact(self, older_than: datetime, precision=None, vacuum=False) -> int:
+        """
+        Moves every day before older_than out of sensor_data into sensor_archive, one compressed chunk per day, node and
+        column (see archive.py). The hourly rollup and the quantile sketches stay as they are and all fetch methods read
+        the archive as if nothing happened, writing into an archived day simply unpacks that day again first. Meant to
+        run once a night with something like datetime.now() - timedelta(days=30)
+
+        :param datetime older_than: days before the one this is in get archived, that day itself stays as it is
+        :param dict precision: column -> decimals the values get rounded to, e.g. sensor_precision. Without it the
+        archive is lossless but a lot bigger, full precision floats from noisy sensors barely compress
+        :param bool vacuum: shrink the file afterwards, without it sqlite only reuses the freed space for new rows
+        :returns: number of rows that were moved into the archive
+        :rtype: int
+        """
+        cutoff = datetime.combine(older_than.date(), time())
+        with self._write_lock:
+            days = self.db.execute(
+                "SELECT DISTINCT substr(timepoint, 1, 10), node FROM sensor_data WHERE timepoint < ?", (cutoff, )
+            ).fetchall()
+        moved = 0
+        for day, node in sorted(tuple(x) for x in days):
+            moved += self._compact_day(day, node, precision)
+        with self._cache_lock:
+            self._invalidate()
+        if vacuum:
+            with self._write_lock:
+                self.db.execute("VACUUM")
+        logger.info(f"LocalCache.compact: archived {moved} rows of {len(days)} days")
+        return moved
+
+    @_writes
+    def _compact_day(self, day: str, node: str, precision=None) -> int:
+        """
+        Archives one day of one node in its own transaction, the writer is only blocked for that long so the sampler
+        can keep inserting while a long history gets compacted
+
+        :returns: number of rows that were moved into the archive
+        :rtype: int
+        """
+        # comparing strings, like sqlite does with everything stored by the datetime adapter
+        span = (day, (date.fromisoformat(day) + timedelta(days=1)).isoformat(), node)
+        try:
+            self._begin()
+            if (day, node) in self._archived_days(day):
+                # rows got written into the day after it was archived, by an older version or a process that
+                # did not unpack it first, archive and rows are merged and the day gets archived again
+                self._thaw(day, node)
+                start = datetime.fromisoformat(day)
+                slots = set(range(_hour_slot(start), _hour_slot(start + timedelta(days=1))))
+                self._refresh_hourly(slots, node)
+                self._refresh_sketches(slots, node)
+            rows = self.db.execute(
+                f"SELECT {_select_columns} FROM sensor_data WHERE timepoint >= ? AND timepoint < ? AND node = ? "
+                f"ORDER BY timepoint", span).fetchall()
+            stamps = [datetime.fromisoformat(row[0]) for row in rows]
+            if not rows or any(stamp.tzinfo or stamp.isoformat(" ") != row[0] for stamp, row in zip(stamps, rows)):
+                self.db.rollback()
+                if rows:
+                    logger.warning(f"LocalCache.compact: {day} has timepoints that cannot be archived, leaving it")
+                return 0
+            chunks = [(day, node, 'timepoint', len(rows), encode_timestamps([to_microseconds(x) for x in stamps]))]
+            for index, column in enumerate(data_mapping, 2):
+                values = [row[index] for row in rows]
+                if any(value is not None for value in values):
+                    chunks.append((day, node, column, len(rows), encode_floats(values, (precision or {}).get(column))))
+            self.cur.executemany("INSERT INTO sensor_archive (day, node, name, count, data) VALUES (?, ?, ?, ?, ?)",
+                                 chunks)
+            self.cur.execute("DELETE FROM sensor_data WHERE timepoint >= ? AND timepoint < ? AND node = ?", span)
+            self.db.commit()
+        except BaseException:
+            self.db.rollback()
+            raise
+        return len(rows)
+
+    def _begin(self):
+        """
+        Starts the write transaction right away instead of at the first change, so that what gets read before that
+        (which days are archived) cannot be changed by another process until the commit
+        """
+        if not self.db.in_transaction:
+            self.db.execute("BEGIN IMMEDIATE")
+
+    def _archived_days(self, first=None, last=None) -> set:
+        """
+        The (day, node) pairs that are in sensor_archive, always asked from the database as another process might have
+        archived or unpacked days since this one opened the file
+
+        :param str first: only days from this iso date on
+        :param str last: only days up to this one, defaults to first if that is given
+        :rtype: set
+        """
+        query = "SELECT DISTINCT day, node FROM sensor_archive"
+        params = ()
+        if first is not None:
+            query += " WHERE day >= ? AND day <= ?"
+            params = (first, last or first)
+        return {tuple(row) for row in self._connection().execute(query, params)}
+
+    def _thaw(self, day: str, node: str):
+        """
+        Moves one archived day back into sensor_data, done before anything in that day changes, commiting is up to
+        the caller
+        """
+        start = datetime.fromisoformat(day)
+        rows = self._archived_rows(start, start + timedelta(days=1), node, include_start=True)
+        self.cur.executemany(_thaw_query, rows)
+        self.cur.execute("DELETE FROM sensor_archive WHERE day = ? AND node = ?", (day, node))
+        logger.info(f"LocalCache: unpacked archived day {day} {node}")
+
+    def _archived_rows(self, past: datetime, future: datetime, node=None, columns=None, include_start=False) -> list:
+        """
+        Decodes the archived chunks between past and future (exclusive, like fetch_by_range) into rows
+
+        :param list columns: keys of data_mapping that are decoded, defaults to all of them
+        :param bool include_start: past is inclusive, like fetch_aggregated
+        :returns: list of tuples (timepoint as datetime, node, *columns) sorted by time per day and node
+        :rtype: list
+        """
+        connection = self._connection()
+        columns = list(columns) if columns else list(data_mapping)
+        names = ["timepoint"] + columns
+        query = f"""SELECT day, node, name, count, data
+                    FROM sensor_archive
+                    WHERE day >= ? AND day <= ? AND name IN ({", ".join("?" * len(names))})"""
+        params = [past.date().isoformat(), future.date().isoformat()] + names
+        if node is not None:
+            query += " AND node = ?"
+            params.append(node)
+        chunks = {}
+        for day, chunk_node, name, count, data in connection.execute(query + " ORDER BY day, node", params):
+            chunks.setdefault((day, chunk_node), {})[name] = (count, data)
+        rows = []
+        for (day, chunk_node), chunk in chunks.items():
+            count, data = chunk['timepoint']
+            stamps = [from_microseconds(x) for x in decode_timestamps(data, count)]
+            first = bisect_left(stamps, past) if include_start else bisect_right(stamps, past)
+            last = bisect_left(stamps, future)
+            if first >= last:
+                continue
+            values = []
+            for column in columns:
+                if column not in chunk:
+                    values.append([None] * (last - first))
+                    continue
+                decoded = decode_floats(chunk[column][1], count)[first:last]
+                if column in _integer_columns:
+                    decoded = [int(x) if x is not None and x.is_integer() else x for x in decoded]
+                values.append(decoded)
+            rows.extend(zip(stamps[first:last], [chunk_node] * (last - first), *values))
+        return rows
+
+    @staticmethod
+    def _archived_to_raw(row: tuple) -> dict:
+        # a row of _archived_rows() with all columns in the shape _row_to_transfer_format() wants
+        raw = dict(zip(_columns, row))
+        raw['timepoint'] = row[0].isoformat(" ")
+        return raw
+
+    def _recompute_archive_approx(self) -> int:
+        """
+        The approx_gas part of recompute_approx_gas() for archived days, only the three approx chunks get rewritten
+        """
+        updated = 0
+        gas_columns = ['gas_oxidising', 'gas_reducing', 'gas_nh3']
+        for day, node in sorted(self._archived_days()):
+            start = datetime.fromisoformat(day)
+            rows = self._archived_rows(start, start + timedelta(days=1), node, gas_columns, include_start=True)
+            if not rows:
+                continue
+            approx = approx_gas([row[2] for row in rows], [row[3] for row in rows], [row[4] for row in rows],
+                                calibration=self.gas_calibration)
+            selection = f"FROM sensor_archive WHERE day = ? AND node = ? AND name IN ({', '.join('?' * 3)})"
+            params = (day, node) + approx_columns
+            # keeps the rounding the chunks were compacted with
+            chunks = self.db.execute("SELECT name, data " + selection, params).fetchall()
+            decimals = {name: chunk_decimals(data) for name, data in chunks}
+            self.cur.execute("DELETE " + selection, params)
+            for column, key in zip(approx_columns, ('NO2', 'CO', 'NH3')):
+                values = nan_to_none(approx[key])
+                if any(value is not None for value in values):
+                    self.cur.execute("INSERT INTO sensor_archive (day, node, name, count, data) VALUES (?, ?, ?, ?, ?)",
+                                     (day, node, column, len(rows), encode_floats(values, decimals.get(column))))
+            updated += len(rows)
+        return updated
 
     def delete_by_date_range(self, start_date: datetime, stop_data: datetime):
         pass
@@ -275,31 +1497,108 @@ class LocalCache:
     def delete_by_data_aoe(self, target_date: datetime, aoe: int):
         pass
 
-    def fill_from_json(self, json_file_path: str):
+    def fill_from_json(self, json_file_path: str, batch_size=5000, resume=False, progress=None, node=""):
         """
-        Puts all the data from a normalized json file into this database, will create duplicates without looking back
+        Puts all the data from a normalized json file into this database, entries that already exist get merged so
+        importing the same file twice does no harm
+
+        The file is read entry by entry and written in batches, every batch is one transaction that also records how
+        many entries of the file are done. The writer is only held per batch, the sampler keeps inserting while a
+        long file is imported. With resume=True an interrupted import continues after the last finished
+        batch, and as values.json only ever grows at the end this also works to import only the new entries of a file
+        that was imported before
 
         :param str json_file_path: Path to a properly formatted json
+        :param int batch_size: number of entries written per transaction
+        :param bool resume: skip the entries a previous import of the same file already wrote
+        :param callable progress: called after every batch with (entries_done, bytes_read, bytes_total)
+        :param str node: name of the device the file comes from, empty for this one
+        :returns: False if the json could not be parsed (batches before the error stay written), True otherwise
+        :rtype: bool
         """
+        source = os.path.realpath(json_file_path)
+        skip = self.import_progress(source, node) if resume else 0
+        total_size = os.path.getsize(json_file_path)
+        entries = 0
+        date_errors = 0
+        rows = []
         with open(json_file_path, "r") as json_in:
             try:
-                raw = json.load(json_in)
+                for key, value in iter_json_object(json_in):
+                    entries += 1
+                    if entries <= skip:
+                        continue
+                    try:
+                        rows.append(self._flatten(value, datetime.fromisoformat(key), node))
+                    except ValueError:
+                        date_errors += 1
+                    if entries % batch_size == 0:
+                        self._import_batch(rows, source, entries, node)
+                        rows = []
+                        if progress:
+                            progress(entries, json_in.buffer.tell(), total_size)
             except json.JSONDecodeError as e:
-                logging.error(f"LocalCache>fill_from_json: json decode error: {e:120}")
+                logging.error(f"LocalCache>fill_from_json: json decode error: {e}")
                 return False
-            self.insert_bulk(raw)
-            # for key, raw_data in raw.items():
-            #    my_db.insert_block(raw_data, synthetic_date=datetime.fromisoformat(key))
+            self._import_batch(rows, source, entries, node)
+        if progress:
+            progress(entries, total_size, total_size)
+        if date_errors > 0:
+            logger.warning(f"There were {date_errors} parsing errors of iso strings")
+        if skip:
+            logger.info(f"LocalCache>fill_from_json: resumed after {skip} of {entries} entries")
         return True
 
+    @_reads
+    def import_progress(self, source: str, node="") -> int:
+        """
+        Number of entries of a file that earlier imports already wrote, see fill_from_json(). The same file imported
+        as another node is a different import and starts from the beginning
+
+        :param str source: real path of the file
+        :param str node: node the file was imported as
+        :rtype: int
+        """
+        done = self._connection().execute("SELECT entries FROM import_progress WHERE source = ? AND node = ?",
+                                          (source, node)).fetchone()
+        return done[0] if done else 0
+
+    @timed("db_import_batch")
+    @_writes
+    def _import_batch(self, rows: list, source: str, entries: int, node=""):
+        """
+        Writes one batch of a file import together with the progress in one transaction
+        """
+        try:
+            self._write_rows(rows)
+            self.cur.execute(
+                "INSERT OR REPLACE INTO import_progress (source, node, entries, updated) VALUES (?, ?, ?, ?)",
+                (source, node, entries, datetime.now())
+            )
+            self.db.commit()
+        except BaseException:
+            self.db.rollback()
+            raise
+        self._cache_inserted(rows)
+
     def close(self):
-        self.db.close()
+        """
+        Closes the writer and every idle reader, call it once no other thread uses this instance anymore
+        """
+        with self._write_lock:
+            self.db.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
 
     def init_database(self):
         query = """
             CREATE TABLE IF NOT EXISTS sensor_data (
                 uid INTEGER PRIMARY KEY AUTOINCREMENT,
                 timepoint TIMESTAMP NOT NULL,
+                node TEXT NOT NULL DEFAULT '',
                 gas_oxidising REAL,
                 gas_reducing REAL,
                 gas_nh3 REAL,
@@ -314,20 +1613,31 @@ class LocalCache:
                 noise_1 REAL,
                 noise_2 REAL,
                 noise_3 REAL,
-                co2 REAL
+                co2 REAL,
+                approx_no2 REAL,
+                approx_co REAL,
+                approx_nh3 REAL
             );"""
         self.db.execute(query)
+        self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS sensor_data_timepoint ON sensor_data (timepoint, node);")
+        for table_query in _table_queries.values():
+            self.db.execute(table_query)
+        self.db.commit()
 
 
 if __name__ == "__main__":
 
     logger.info("local_database: main called, accepts 1 args: [fill] (deletes local.db and fills it with values.json)")
+    logger.info("or [compact] [days] to archive everything older than days (default 30)")
     my_db = LocalCache("./local_cache.db")
 
     print(sys.argv)
     if sys.argv[1] == "fill":
         logger.warning("filling local.db")
         my_db.fill_from_json("./values.json")
+    elif sys.argv[1] == "compact":
+        keep_days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+        my_db.compact(datetime.now() - timedelta(days=keep_days), precision=sensor_precision, vacuum=True)
     bla = my_db.fetch_by_aoe_date(datetime.combine(date.today(), time(12, 0, 0)), 3600*24)
     print(bla)
 
@@ -22,9 +22,11 @@
 
 from sensors import SensorBundle
 from local_database import LocalCache
+from profiling import profile_call, tracker
 import logging
 import json
 import os
+import sys
 import datetime
 
 save_path = "values.json"
@@ -39,7 +41,12 @@ if __name__ == "__main__":
     logging.info("Waking up, priming sensors...")
     sensor = SensorBundle(warmup_cycles=15)
     logging.info(f"Sensors ready, warming up {sensor.warmup_cycles} times, then reading")
-    all_raw = sensor.get_all(condensed=True)
+    if "--profile" in sys.argv:  # one cycle under cProfile, optionally followed by a file name for the raw stats
+        position = sys.argv.index("--profile") + 1
+        profile_path = sys.argv[position] if len(sys.argv) > position else None
+        all_raw = profile_call(sensor.get_all, condensed=True, output=profile_path)
+    else:
+        all_raw = sensor.get_all(condensed=True)
 
     now = datetime.datetime.now()
     history = {}
@@ -58,4 +65,5 @@ if __name__ == "__main__":
     db = LocalCache(db_path)
     db.insert_block(all_raw, now)
     db.close()
+    tracker.log_stats()
 
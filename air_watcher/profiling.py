@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2021 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of AirWatcher.
+#
+# AirWatcher is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# AirWatcher is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import cProfile
+import functools
+import io
+import logging
+import pstats
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import monotonic, perf_counter_ns
+
+logger = logging.getLogger(__name__)
+
+"""
+Tiny bit of instrumentation to find out which part of a sampling cycle is slow, the PMS5003, the i2c bus, the audio
+device or sqlite. Every timed section keeps the last few hundred durations, percentiles are only calculated when
+somebody actually asks for them so the cost per measurement is two clock reads and a deque append.
+"""
+
+
+class LatencyTracker:
+    def __init__(self, window=512):
+        """
+        :param int window: number of most recent durations kept per name
+        """
+        self.window = window
+        self.samples = {}
+        self.errors = {}
+        self._last_log = monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, name: str, nanoseconds: int, failed=False):
+        samples = self.samples.get(name)
+        if samples is None:
+            with self._lock:
+                samples = self.samples.setdefault(name, deque(maxlen=self.window))
+        samples.append(nanoseconds)
+        if failed:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    @contextmanager
+    def time(self, name: str):
+        """
+        Context manager that records how long the block took, also if it raised
+
+        `with tracker.time("particles"):`
+        `    sensor.read()`
+        """
+        epoch = perf_counter_ns()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.record(name, perf_counter_ns() - epoch, failed)
+
+    def stats(self) -> dict:
+        """
+        Calculates p50, p95 and max in milliseconds for every name over the kept window
+
+        :returns: dictionary of the format { name: {'count': n, 'p50_ms': x, 'p95_ms': y, 'max_ms': z, 'errors': e} }
+        :rtype: dict
+        """
+        result = {}
+        for name, samples in list(self.samples.items()):
+            values = sorted(samples)
+            if not values:
+                continue
+            count = len(values)
+            result[name] = {
+                'count': count,
+                'p50_ms': values[int(0.50 * (count - 1))] / 1e6,
+                'p95_ms': values[int(0.95 * (count - 1))] / 1e6,
+                'max_ms': values[-1] / 1e6,
+                'errors': self.errors.get(name, 0)
+            }
+        return result
+
+    def log_stats(self, level=logging.INFO):
+        """
+        Writes one line per timed section into the log
+        """
+        for name, stat in sorted(self.stats().items()):
+            logger.log(level, f"latency {name:<24} n={stat['count']:<5} p50={stat['p50_ms']:.1f}ms "
+                              f"p95={stat['p95_ms']:.1f}ms max={stat['max_ms']:.1f}ms errors={stat['errors']}")
+        self._last_log = monotonic()
+
+    def maybe_log(self, interval=300.0, level=logging.INFO) -> bool:
+        """
+        Calls log_stats() if the last dump is longer than interval seconds ago, meant to be called once per cycle
+
+        :returns: True if something was logged
+        """
+        if monotonic() - self._last_log < interval:
+            return False
+        self.log_stats(level)
+        return True
+
+    def reset(self):
+        with self._lock:
+            self.samples = {}
+            self.errors = {}
+
+
+# the one tracker everything reports into unless told otherwise, so main.py can dump a single summary
+tracker = LatencyTracker()
+
+
+def timed(name: str):
+    """
+    Decorator for methods, times every call under `name` with the `latency` attribute of the instance or the module
+    tracker if there is none
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with getattr(self, "latency", tracker).time(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profile_call(func, *args, output=None, top=25, **kwargs):
+    """
+    Runs one call of func under cProfile, meant for a single sampling cycle as the overhead is considerable
+
+    :param callable func: the thing to profile, usually SensorBundle.get_all
+    :param str output: if set the raw stats get dumped there (readable with snakeviz or pstats), otherwise the top
+    entries sorted by cumulative time are logged
+    :param int top: number of entries that are logged
+    :returns: whatever func returned
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        if output:
+            profiler.dump_stats(output)
+            logger.info(f"profile of {getattr(func, '__name__', func)} written to {output}")
+        else:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(top)
+            logger.info(f"profile of {getattr(func, '__name__', func)}:\n{stream.getvalue()}")
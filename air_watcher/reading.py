@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2021 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of AirWatcher.
+#
+# AirWatcher is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# AirWatcher is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+from array import array
+from datetime import datetime
+
+import numpy
+
+from local_database import _integer_columns, data_mapping
+
+"""
+One reading as returned by get_all() is half a dozen nested dictionaries with string keys, around 3 KB per sample.
+Fine for a single reading, not so fine for a few hours of them in memory on a Pi Zero with 512 MB. A Reading keeps
+exactly the values the database stores (data_mapping) as flat array of doubles plus a bit mask for the missing ones,
+a ReadingBatch keeps many of them in one preallocated numpy array. Both turn into the usual nested dictionaries only
+when somebody asks with to_dict(), and both go into the LocalCache without any dictionary in between.
+"""
+
+fields = list(data_mapping)
+field_index = {name: index for index, name in enumerate(fields)}
+_paths = [tuple(path.split("|")) for path in data_mapping.values()]
+_integer_index = {field_index[name] for name in _integer_columns}
+_all_present = (1 << len(fields)) - 1
+_zeros = array('d', [0.0]) * len(fields)  # copies of this are allocated with the exact size, array(bytes) is not
+
+
+def _nested_get(data: dict, keys: tuple):
+    for key in keys:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def _to_dict(values, present) -> dict:
+    # builds the transfer format from a sequence of values in field order and an iterable of the present indices
+    result = {}
+    for index in present:
+        keys = _paths[index]
+        level = result
+        for key in keys[:-1]:
+            level = level.setdefault(key, {})
+        value = float(values[index])
+        level[keys[-1]] = int(value) if index in _integer_index and value.is_integer() else value
+    return result
+
+
+class Reading:
+    __slots__ = ('timepoint', 'values', 'mask')
+
+    def __init__(self, timepoint=None, values=None, mask=0):
+        """
+        :param datetime timepoint: time of the reading
+        :param array values: array('d') in the order of data_mapping, zeros if not given
+        :param int mask: bit n is set if value n is present
+        """
+        self.timepoint = timepoint
+        self.values = values if values is not None else _zeros[:]
+        self.mask = mask
+
+    @classmethod
+    def from_dict(cls, data: dict, timepoint=None):
+        """
+        Takes the output of get_all() or a transfer format entry, everything that is not in data_mapping is dropped
+
+        :rtype: Reading
+        """
+        reading = cls(timepoint)
+        for index, keys in enumerate(_paths):
+            value = _nested_get(data, keys)
+            if value is None:
+                continue
+            try:
+                reading.values[index] = value
+            except TypeError:  # strings and other garbage count as missing
+                continue
+            reading.mask |= 1 << index
+        return reading
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Takes a row in the column order of sensor_data, as given by sqlite or LocalCache._flatten(), the node is ignored
+
+        :rtype: Reading
+        """
+        timepoint = row[0]
+        reading = cls(datetime.fromisoformat(timepoint) if isinstance(timepoint, str) else timepoint)
+        for index, value in enumerate(row[2:]):
+            if value is not None:
+                reading.values[index] = value
+                reading.mask |= 1 << index
+        return reading
+
+    def get(self, name: str, default=None):
+        index = field_index[name]
+        if not self.mask >> index & 1:
+            return default
+        value = self.values[index]
+        return int(value) if index in _integer_index and value.is_integer() else value
+
+    def __getitem__(self, name: str):
+        return self.get(name)
+
+    def set(self, name: str, value):
+        """
+        Sets one value by its data_mapping key, None removes it
+        """
+        index = field_index[name]
+        if value is None:
+            self.mask &= ~(1 << index)
+        else:
+            self.values[index] = value
+            self.mask |= 1 << index
+
+    def merge(self, other):
+        """
+        Takes every value that is present in other, same thing the upsert of the database does
+        """
+        for index in range(len(fields)):
+            if other.mask >> index & 1:
+                self.values[index] = other.values[index]
+        self.mask |= other.mask
+
+    def to_dict(self) -> dict:
+        """
+        :returns: the nested format of the database transfer format, {'gas': {'oxidising': x, ...}, ...}
+        :rtype: dict
+        """
+        return _to_dict(self.values, (i for i in range(len(fields)) if self.mask >> i & 1))
+
+    def to_row(self, node="") -> list:
+        """
+        :returns: list in the column order of sensor_data (timepoint, node, values...) with None for missing values
+        :rtype: list
+        """
+        mask = self.mask
+        if mask == _all_present:
+            return [self.timepoint, node, *self.values]
+        return [self.timepoint, node] + [value if mask >> i & 1 else None for i, value in enumerate(self.values)]
+
+    def __repr__(self):
+        return f"Reading({self.timepoint}, {self.to_dict()})"
+
+
+class ReadingBatch:
+    """
+    Many readings in one preallocated array of capacity x len(fields) doubles, missing values are NaN. Grows by
+    doubling if it runs full
+    """
+    def __init__(self, capacity=1024):
+        self.values = numpy.full((capacity, len(fields)), numpy.nan)
+        self.timepoints = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, reading, timepoint=None):
+        """
+        :param reading: a Reading or a dictionary in the format of get_all()
+        :param datetime timepoint: overwrites the time of a Reading, required for dictionaries
+        """
+        if self.count == len(self.values):
+            self.values = numpy.concatenate((self.values, numpy.full_like(self.values, numpy.nan)))
+        row = self.values[self.count]
+        if isinstance(reading, Reading):
+            row[:] = reading.values
+            for index in range(len(fields)):
+                if not reading.mask >> index & 1:
+                    row[index] = numpy.nan
+            timepoint = timepoint or reading.timepoint
+        else:
+            for index, keys in enumerate(_paths):
+                value = _nested_get(reading, keys)
+                if isinstance(value, (int, float)):
+                    row[index] = value
+        self.timepoints.append(timepoint)
+        self.count += 1
+
+    def column(self, name: str):
+        """
+        :returns: numpy view of one column of all readings so far, NaN where it is missing
+        """
+        return self.values[:self.count, field_index[name]]
+
+    def __getitem__(self, position: int) -> Reading:
+        if not -self.count <= position < self.count:
+            raise IndexError("ReadingBatch index out of range")
+        position %= self.count
+        row = self.values[position]
+        present = ~numpy.isnan(row)
+        mask = sum(1 << int(i) for i in numpy.flatnonzero(present))
+        values = _zeros[:]
+        values[:] = array('d', row.tobytes())
+        return Reading(self.timepoints[position], values, mask)
+
+    def rows(self, node="") -> list:
+        """
+        All readings in the column order of sensor_data, ready for the executemany of the database
+        """
+        rows = self.values[:self.count].astype(object)
+        rows[numpy.isnan(self.values[:self.count])] = None
+        return [[timepoint, node, *row] for timepoint, row in zip(self.timepoints, rows.tolist())]
+
+    def to_dict(self) -> dict:
+        """
+        :returns: the whole batch in the format of values.json, { 'iso_string' : {'gas': {}, ...}, ...}
+        """
+        result = {}
+        for timepoint, row in zip(self.timepoints, self.values[:self.count].tolist()):
+            result[timepoint.isoformat()] = _to_dict(row, (i for i, value in enumerate(row) if value == value))
+        return result
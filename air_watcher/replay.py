@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2021 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of AirWatcher.
+#
+# AirWatcher is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# AirWatcher is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import json
+import logging
+import sqlite3
+import statistics
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+from json_stream import iter_json_object
+
+logger = logging.getLogger(__name__)
+
+"""
+Plays a recorded history back through SensorBundle(replay=...), everything downstream (database, live feed, display)
+sees the same get_*_readings() it would see on the Pi. The demo mode only knows one set of constants, this gives
+realistic data with days and nights, spikes and gaps.
+
+Replays either in (scaled) real time, speed=60 plays one recorded minute per second, or in steps where every reading
+is simply the next recorded one, as fast as the consumer asks. run_fleet() runs many of those as virtual nodes at once
+to see how storage behaves with a whole bunch of devices:
+
+python3 replay.py values.json --nodes 20 --cycles 1000 --db fleet.db
+"""
+
+
+def load_history(source, node=None) -> list:
+    """
+    Reads a recorded history from a dictionary in the format of values.json, a json file of that format (streamed) or
+    a LocalCache database
+
+    :param source: dict, path to a .json file or path to a database
+    :param str node: only this device if the source is a database, None for all of them
+    :returns: list of (datetime, reading) sorted by time
+    :rtype: list
+    """
+    if isinstance(source, dict):
+        entries = source.items()
+    elif str(source).endswith(".json"):
+        with open(source, "r") as json_in:
+            entries = list(iter_json_object(json_in))
+    else:
+        from local_database import LocalCache
+        db = LocalCache(source)
+        entries = db.fetch_by_range(datetime.min, datetime.max, node).items()
+        db.close()
+    frames = []
+    for key, reading in entries:
+        try:
+            frames.append((datetime.fromisoformat(key), reading))
+        except ValueError:
+            continue
+    frames.sort(key=lambda frame: frame[0])
+    if not frames:
+        raise ValueError("load_history: no readings with a valid timestamp in the source")
+    return frames
+
+
+class ReplaySource:
+    def __init__(self, history, speed=None, loop=True, phase=0.0):
+        """
+        :param history: anything load_history() understands or its result, the list is shared and never changed so
+        many sources can use the same one
+        :param float speed: recorded seconds per real second, 1 is real time; None or 0 gives the next recorded reading
+        on every advance()
+        :param bool loop: start over at the end, the timestamps keep counting up as if the history happened again. If
+        False the last reading stays forever
+        :param float phase: where to start, as fraction of the history, so virtual nodes do not all show the same data
+        """
+        self.frames = history if isinstance(history, list) else load_history(history)
+        self.stamps = [stamp for stamp, _ in self.frames]
+        self.speed = speed or None
+        self.loop = loop
+        first, last = self.stamps[0], self.stamps[-1]
+        gaps = [(b - a).total_seconds() for a, b in zip(self.stamps, self.stamps[1:])]
+        # one lap is the recorded time plus one typical gap, otherwise the last and first reading would share a time
+        self.span = (last - first) + timedelta(seconds=statistics.median(gaps) if gaps else 1)
+        start = int(len(self.frames) * phase) % len(self.frames)
+        self.index = start - 1  # advance() goes to the next one first
+        self.laps = 0
+        self.offset = (self.stamps[start] - first).total_seconds()
+        self.started = None
+        self.timepoint = None
+        self.frame = None
+
+    def advance(self) -> dict:
+        """
+        Moves to the reading that is due now (or the next one in step mode) and returns it, the recorded time of it
+        (shifted by the laps) is in self.timepoint
+
+        :returns: the reading in the format of SensorBundle.get_all(), shared with the history so do not change it
+        :rtype: dict
+        """
+        if self.speed is None:
+            self.index += 1
+            if self.index >= len(self.frames):
+                if self.loop:
+                    self.index = 0
+                    self.laps += 1
+                else:
+                    self.index = len(self.frames) - 1
+        else:
+            if self.started is None:
+                self.started = time.monotonic()
+            position = self.offset + (time.monotonic() - self.started) * self.speed
+            span = self.span.total_seconds()
+            laps, position = divmod(position, span) if self.loop else (0, min(position, span))
+            self.laps = int(laps)
+            self.index = max(0, bisect_right(self.stamps, self.stamps[0] + timedelta(seconds=position)) - 1)
+        stamp, self.frame = self.frames[self.index]
+        self.timepoint = stamp + self.span * self.laps
+        return self.frame
+
+    def current(self) -> dict:
+        """
+        The reading of the last advance(), advances once if there was none yet
+        """
+        if self.frame is None:
+            return self.advance()
+        return self.frame
+
+
+def run_fleet(history, nodes=10, cycles=100, speed=None, interval=0.0, db_path=None, condensed=True) -> dict:
+    """
+    Runs virtual nodes in parallel threads, each one a SensorBundle replaying the history from a different position,
+    every reading gets written with its node name (node00, node01, ...) into a LocalCache. Devices that write into the
+    same file share one LocalCache, it serializes the writes of all threads on its single writer connection instead of
+    having many connections fight over the sqlite lock
+
+    :param history: anything load_history() understands or its result
+    :param int nodes: number of virtual devices
+    :param int cycles: readings per device
+    :param float speed: see ReplaySource
+    :param float interval: real seconds a device waits between two readings
+    :param str db_path: database the readings go to, if it contains {node} every device gets its own file, None only
+    reads
+    :param bool condensed: see SensorBundle.get_all()
+    :returns: dictionary with the number of readings, writes and failed writes, the time it took and the rate
+    :rtype: dict
+    """
+    from local_database import LocalCache
+    from sensors import SensorBundle
+    frames = history if isinstance(history, list) else load_history(history)
+    names = [f"node{i:02d}" for i in range(nodes)]
+    caches = {}
+    if db_path:
+        for path in {db_path.format(node=name) for name in names}:
+            caches[path] = LocalCache(path)
+    counts = {'readings': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def device(index: int, name: str):
+        bundle = SensorBundle(replay=ReplaySource(frames, speed=speed, phase=index / nodes))
+        db = caches[db_path.format(node=name)] if db_path else None
+        readings = writes = errors = 0
+        for _ in range(cycles):
+            reading = bundle.get_all(one_shot=False, condensed=condensed)
+            readings += 1
+            if db:
+                try:
+                    db.insert_block(reading, bundle.replay.timepoint, node=name)
+                    writes += 1
+                except sqlite3.OperationalError as err:  # 'database is locked' if another process holds the file
+                    errors += 1
+                    logger.debug(f"run_fleet: {name} {err}")
+            if interval:
+                time.sleep(interval)
+        with lock:
+            counts['readings'] += readings
+            counts['writes'] += writes
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=device, args=(i, name), name=name) for i, name in enumerate(names)]
+    epoch = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counts['seconds'] = time.perf_counter() - epoch
+    for cache in caches.values():
+        cache.close()
+    counts['readings_per_s'] = counts['readings'] / counts['seconds'] if counts['seconds'] else None
+    counts['nodes'] = nodes
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="replays a recorded history as many virtual nodes")
+    parser.add_argument("source", help="values.json or a LocalCache database")
+    parser.add_argument("--nodes", type=int, default=10)
+    parser.add_argument("--cycles", type=int, default=100, help="readings per node")
+    parser.add_argument("--speed", type=float, default=0, help="recorded seconds per real second, 0 for steps")
+    parser.add_argument("--interval", type=float, default=0.0, help="real seconds between two readings of a node")
+    parser.add_argument("--db", help="write into this database, {node} in the name gives every node its own file")
+    args = parser.parse_args()
+    result = run_fleet(args.source, nodes=args.nodes, cycles=args.cycles, speed=args.speed, interval=args.interval,
+                       db_path=args.db)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2021 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of AirWatcher.
+#
+# AirWatcher is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# AirWatcher is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import json
+import logging
+import math
+import sys
+from datetime import datetime, timedelta
+
+from local_database import deep_get
+
+logger = logging.getLogger(__name__)
+
+"""
+Decides how long to wait till the next reading. Every observed value updates an exponentially weighted mean and
+variance per signal, if a new value is more than `threshold` standard deviations away from that mean something is
+happening (somebody is cooking, a truck drives by) and the scheduler drops to the fastest interval. While everything is
+calm the interval grows by `decay` per reading back to the slow base rate.
+"""
+
+# signals that can trigger faster sampling, in deep_get format
+default_paths = [
+    "particles|m3|atmo|1.0",
+    "particles|m3|atmo|2.5",
+    "particles|m3|atmo|10",
+    "gas|oxidising",
+    "gas|reducing",
+    "gas|nh3",
+    "noise|20-1K",
+    "noise|1K-3K",
+    "noise|3K-8K"
+]
+
+
+class AdaptiveScheduler:
+    def __init__(self, min_interval=10.0, max_interval=300.0, alpha=0.1, threshold=3.0, decay=1.5, paths=None,
+                 warmup=5, min_deviation=0.02):
+        """
+        :param float min_interval: seconds between readings while something is going on
+        :param float max_interval: seconds between readings when everything is calm
+        :param float alpha: weight of a new value in the moving mean and variance, bigger adapts faster
+        :param float threshold: z-score above which a reading counts as event
+        :param float decay: factor the interval grows with per calm reading
+        :param list paths: signals to watch, defaults to default_paths
+        :param int warmup: number of values per signal before it may trigger anything
+        :param float min_deviation: the standard deviation is at least this fraction of the mean, otherwise a signal
+        that was perfectly flat for a while triggers on the tiniest wiggle
+        """
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError("AdaptiveScheduler: need 0 < min_interval <= max_interval")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.alpha = alpha
+        self.threshold = threshold
+        self.decay = decay
+        self.paths = list(paths) if paths else list(default_paths)
+        self.warmup = warmup
+        self.min_deviation = min_deviation
+        self.interval = max_interval
+        self.stats = {}  # path -> [mean, variance, count]
+        self.events = 0
+        self.last_trigger = None
+
+    def observe(self, reading: dict) -> float:
+        """
+        Feeds one reading (format of SensorBundle.get_all()) and gives the seconds till the next one should be taken
+
+        :rtype: float
+        """
+        strongest = 0.0
+        trigger = None
+        for path in self.paths:
+            value = deep_get(reading, path)
+            if value is None:
+                continue
+            stat = self.stats.get(path)
+            if stat is None:
+                self.stats[path] = [float(value), 0.0, 1]
+                continue
+            mean, variance, count = stat
+            diff = value - mean
+            if count >= self.warmup:
+                deviation = max(math.sqrt(variance), abs(mean) * self.min_deviation, 1e-9)
+                score = abs(diff) / deviation
+                if score > strongest:
+                    strongest, trigger = score, path
+            stat[0] = mean + self.alpha * diff
+            stat[1] = (1 - self.alpha) * (variance + self.alpha * diff * diff)
+            stat[2] = count + 1
+        if strongest > self.threshold:
+            self.interval = self.min_interval
+            self.events += 1
+            self.last_trigger = trigger
+            logger.debug(f"AdaptiveScheduler: {trigger} z={strongest:.1f}, sampling every {self.min_interval}s")
+        else:
+            self.interval = min(self.max_interval, self.interval * self.decay)
+        return self.interval
+
+
+def replay(history: dict, scheduler: AdaptiveScheduler) -> dict:
+    """
+    Runs a scheduler over a recorded history that was sampled more often than the scheduler would, a sample is taken
+    whenever the scheduler would have woken up, everything in between is skipped. The result tells how many readings
+    would have been taken and how much of the peaks survived compared to sampling everything
+
+    :param dict history: format of values.json, { 'iso_string' : {'gas': {}, ...}, ...}
+    :param AdaptiveScheduler scheduler: a fresh scheduler
+    :returns: dictionary with total and taken samples, their ratio, the number of events and per watched signal the
+    maximum of all samples versus the maximum of the taken ones
+    :rtype: dict
+    """
+    stamps = sorted((datetime.fromisoformat(key), key) for key in history)
+    due = None
+    taken = 0
+    peaks = {path: [None, None] for path in scheduler.paths}  # [max of everything, max of taken]
+    for timepoint, key in stamps:
+        reading = history[key]
+        sampled = due is None or timepoint >= due
+        if sampled:
+            taken += 1
+            due = timepoint + timedelta(seconds=scheduler.observe(reading))
+        for path, peak in peaks.items():
+            value = deep_get(reading, path)
+            if value is None:
+                continue
+            if peak[0] is None or value > peak[0]:
+                peak[0] = value
+            if sampled and (peak[1] is None or value > peak[1]):
+                peak[1] = value
+    return {
+        'total': len(stamps),
+        'taken': taken,
+        'ratio': taken / len(stamps) if stamps else None,
+        'events': scheduler.events,
+        'peaks': {path: {'all': peak[0], 'taken': peak[1]} for path, peak in peaks.items() if peak[0] is not None}
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    if len(sys.argv) < 2:
+        logger.info("scheduler: replays a history, accepts values.json or a LocalCache file [min] [max interval]")
+        exit(1)
+    source = sys.argv[1]
+    if source.endswith(".json"):
+        from json_stream import iter_json_object
+        with open(source, "r") as json_in:
+            recorded = dict(iter_json_object(json_in))
+    else:
+        from local_database import LocalCache
+        recorded = LocalCache(source).fetch_by_range(datetime.min, datetime.max)
+    limits = [float(x) for x in sys.argv[2:4]]
+    print(json.dumps(replay(recorded, AdaptiveScheduler(*limits)), indent=2))
@@ -21,70 +21,442 @@
 # @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
 
 import time
+import copy
 import logging
-import sounddevice
+import queue
+import statistics
+import threading
 import wave
 import numpy
-from math import log10
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import datetime
+from functools import partial
 
-from bme280 import BME280
-from pms5003 import PMS5003, ReadTimeoutError
-from enviroplus import gas
-from enviroplus.noise import Noise  # TODO: erase that numpy requirement
-# ? weather sensor
-try:
-    from smbus2 import SMBus
-except ImportError:
-    from smbus import SMBus
-# ? light sensor
+from gas_approx import approx_gas
+from profiling import timed, tracker
+from reading import Reading
+
+# the hardware libraries are only needed for real readings, demo mode works without them so benchmarks and tests can
+# run on a machine that is not a raspberry pi
 try:
-    # Transitional fix for breaking change in LTR559
-    from ltr559 import LTR559
-    ltr559 = LTR559()
-except ImportError:
-    import ltr559
+    import sounddevice
+    from bme280 import BME280
+    from pms5003 import PMS5003, ReadTimeoutError
+    from enviroplus import gas
+    from enviroplus.noise import Noise  # TODO: erase that numpy requirement
+    # ? weather sensor
+    try:
+        from smbus2 import SMBus
+    except ImportError:
+        from smbus import SMBus
+    # ? light sensor
+    try:
+        # Transitional fix for breaking change in LTR559
+        from ltr559 import LTR559
+        ltr559 = LTR559()
+    except ImportError:
+        import ltr559
+    hardware_error = None
+except (ImportError, OSError) as err:  # sounddevice throws OSError if portaudio is missing
+    hardware_error = err
+
+    class ReadTimeoutError(Exception):
+        pass
 
 logger = logging.getLogger(__name__)
 
+# every value of one PMS5003 frame, path in the format of get_particle_readings() and the arguments to get it
+particle_fields = [
+    (('m3', 'atmo', '1.0'), 'pm_ug_per_m3', (1.0, True)),
+    (('m3', 'atmo', '2.5'), 'pm_ug_per_m3', (2.5, True)),
+    (('m3', 'atmo', '10'), 'pm_ug_per_m3', (None, True)),  # questionable
+    (('m3', 'non-atmo', '1.0'), 'pm_ug_per_m3', (1.0, False)),
+    (('m3', 'non-atmo', '2.5'), 'pm_ug_per_m3', (2.5, False)),
+    (('m3', 'non-atmo', '10'), 'pm_ug_per_m3', (10, False)),
+    (('1l', '0.3'), 'pm_per_1l_air', (0.3, )),
+    (('1l', '0.5'), 'pm_per_1l_air', (0.5, )),
+    (('1l', '1.0'), 'pm_per_1l_air', (1.0, )),
+    (('1l', '2.5'), 'pm_per_1l_air', (2.5, )),
+    (('1l', '5'), 'pm_per_1l_air', (5, )),
+    (('1l', '10'), 'pm_per_1l_air', (10, )),
+]
+
+# seconds a single read of a sensor may take before the cycle goes on without it, see SensorGuard
+sensor_deadlines = {
+    'gas': 1.0,
+    'particles': 3.0,  # the PMS5003 sends a frame about every second, read() waits for the next one
+    'weather': 1.0,
+    'light': 1.0,
+    'noise': 3.0  # records a short sample before it can say anything
+}
+
+
+def _nest_particles(values, reduced=False) -> dict:
+    """
+    Turns a flat sequence in the order of particle_fields back into the dictionary of get_particle_readings()
+    """
+    result = {}
+    for (path, _, _), value in zip(particle_fields, values):
+        if reduced and path[:2] != ('m3', 'atmo'):
+            continue
+        level = result
+        for key in path[:-1]:
+            level = level.setdefault(key, {})
+        level[path[-1]] = value
+    return result
+
+
+class ParticleStream(threading.Thread):
+    """
+    The PMS5003 sends a frame about every second on its own, instead of waiting for the next one whenever a reading
+    is needed this thread reads all of them into a ring buffer. Readers only ever look at the buffer and never block,
+    timeouts and resets of the sensor happen here with an increasing back off.
+    """
+    def __init__(self, factory=None, capacity=600, backoff=1.0, max_backoff=60.0):
+        """
+        :param callable factory: creates the sensor object, defaults to PMS5003
+        :param int capacity: number of frames kept, at one frame per second 600 are ten minutes
+        :param float backoff: seconds to wait after the first failed read, doubles with every further failure
+        :param float max_backoff: upper limit for the wait
+        """
+        super().__init__(name="pms5003-stream", daemon=True)
+        self.factory = factory or PMS5003
+        self.frames = deque(maxlen=capacity)  # (monotonic time, tuple in the order of particle_fields)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        sensor = None
+        delay = self.backoff
+        while not self._stop_event.is_set():
+            try:
+                if sensor is None:
+                    sensor = self.factory()
+                raw = sensor.read()
+                frame = tuple(getattr(raw, method)(*args) for _, method, args in particle_fields)
+                with self._lock:
+                    self.frames.append((time.monotonic(), frame))
+                delay = self.backoff
+            except Exception as err:  # ReadTimeoutError, serial errors, checksum mismatches, all handled the same
+                self.failures += 1
+                logger.warning(f"ParticleStream: {type(err).__name__} {err}, re initializing in {delay:.0f}s")
+                sensor = None
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def latest(self, max_age=None):
+        """
+        :param float max_age: seconds, older frames count as no frame
+        :returns: newest frame as tuple in the order of particle_fields, None if there is none
+        """
+        with self._lock:
+            if not self.frames:
+                return None
+            stamp, frame = self.frames[-1]
+        if max_age is not None and time.monotonic() - stamp > max_age:
+            return None
+        return frame
+
+    def statistics(self, interval=60.0) -> dict:
+        """
+        Mean, median and max of every field over the frames of the last interval seconds
+
+        :returns: dictionary with 'count' and 'mean', 'median', 'max' as tuples in the order of particle_fields, the
+        latter are None if there were no frames
+        """
+        cutoff = time.monotonic() - interval
+        with self._lock:
+            frames = [frame for stamp, frame in self.frames if stamp >= cutoff]
+        if not frames:
+            return {'count': 0, 'mean': None, 'median': None, 'max': None}
+        columns = list(zip(*frames))
+        return {
+            'count': len(frames),
+            'mean': tuple(statistics.fmean(x) for x in columns),
+            'median': tuple(statistics.median(x) for x in columns),
+            'max': tuple(max(x) for x in columns)
+        }
+
+
+class SensorGuard:
+    """
+    Runs the reads of one sensor in its own worker thread and waits for them at most `deadline` seconds, a read that
+    takes longer or raises gives None and the cycle goes on without that sensor. After `threshold` failures in a row
+    the breaker opens and the sensor is skipped entirely for `backoff` seconds (doubling up to max_backoff while it
+    keeps failing), afterwards one read is tried again.
+
+    Every failure queues the reinit callable on the worker, so re creating the sensor object never happens in the
+    cycle itself. A read that hangs for good cannot be killed in python, the worker is abandoned then (it is a daemon
+    thread) and a fresh one starts with the reinit. Every worker belongs to a generation, whatever an abandoned one
+    still finishes after that is dropped, so a late reinit cannot replace the sensor the fresh worker already made.
+    """
+    def __init__(self, name: str, deadline=1.0, reinit=None, threshold=3, backoff=30.0, max_backoff=600.0,
+                 install=None):
+        """
+        :param str name: used for the thread and the log
+        :param float deadline: seconds one read may take
+        :param callable reinit: creates a new sensor object and returns it, runs in the worker after a failure, None if
+        there is nothing to re create
+        :param int threshold: failures in a row that open the breaker
+        :param float backoff: seconds the breaker stays open the first time
+        :param float max_backoff: upper limit for the time the breaker stays open
+        :param callable install: gets what reinit returned (unless that is None) and puts it where the reads use it
+        """
+        self.name = name
+        self.deadline = deadline
+        self.reinit = reinit
+        self.install = install
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failures = 0  # in a row
+        self.total_failures = 0
+        self.open_until = 0.0  # monotonic
+        self._delay = backoff
+        self._busy = None  # future of a read that ran over its deadline and is still going
+        self._jobs = None
+        self._lock = threading.Lock()  # the hand over of results against abandoning the worker
+        self._generation = 0
+        self._start_worker()
+
+    def _start_worker(self):
+        self._jobs = queue.SimpleQueue()
+        threading.Thread(target=self._work, args=(self._jobs, self._generation), name=f"sensor-{self.name}",
+                         daemon=True).start()
+
+    def _work(self, jobs: queue.SimpleQueue, generation: int):
+        while True:
+            future, func, args = jobs.get()
+            if func is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = func(*args)
+            except BaseException as err:
+                future.set_exception(err)
+                continue
+            with self._lock:
+                if generation != self._generation:
+                    return  # abandoned while this was hanging, nobody waits for it anymore
+                future.set_result(result)
+
+    def _submit(self, func, *args) -> Future:
+        future = Future()
+        self._jobs.put((future, func, args))
+        return future
+
+    @property
+    def is_open(self) -> bool:
+        return time.monotonic() < self.open_until
+
+    def call(self, func, *args):
+        """
+        :returns: whatever func returns, None if the breaker is open, the read timed out or raised
+        """
+        if self.is_open:
+            return None
+        if self._busy is not None and not self._busy.done():
+            self._failed("previous read still hanging")
+            return None
+        self._busy = None
+        future = self._submit(func, *args)
+        try:
+            result = future.result(timeout=self.deadline)
+        except FutureTimeout:
+            self._busy = future
+            self._failed(f"no answer within {self.deadline}s")
+            return None
+        except Exception as err:
+            self._failed(f"{type(err).__name__} {err}")
+            return None
+        if self.failures:
+            logger.info(f"SensorGuard: {self.name} is back after {self.failures} failures")
+        self.failures = 0
+        self._delay = self.backoff
+        return result
+
+    def _failed(self, reason: str):
+        self.failures += 1
+        self.total_failures += 1
+        if self.failures >= self.threshold:
+            self.open_until = time.monotonic() + self._delay
+            logger.warning(f"SensorGuard: {self.name} failed {self.failures} times ({reason}), skipping it for "
+                           f"{self._delay:.0f}s")
+            self._delay = min(self._delay * 2, self.max_backoff)
+        else:
+            logger.warning(f"SensorGuard: {self.name} {reason}")
+        if self._busy is not None and self.failures >= self.threshold:
+            with self._lock:
+                self._generation += 1
+            self._jobs.put((None, None, None))  # the hanging worker ends if it ever comes back
+            self._start_worker()
+            self._busy = None
+        if self.reinit and (self._busy is None or self._busy.done()):
+            self._submit(self._reinit, self._generation)
+
+    def _reinit(self, generation: int):
+        try:
+            sensor = self.reinit()
+        except Exception as err:
+            logger.warning(f"SensorGuard: re initializing {self.name} failed, {type(err).__name__} {err}")
+            return
+        with self._lock:  # installing is the hand over here, the check in _work() would come too late for it
+            if generation != self._generation:
+                logger.info(f"SensorGuard: dropped a late re initialization of {self.name}")
+                return
+            if sensor is not None and self.install:
+                self.install(sensor)
+        logger.info(f"SensorGuard: re initialized {self.name}")
+
+    def state(self) -> dict:
+        return {
+            'open': self.is_open,
+            'failures': self.failures,
+            'total_failures': self.total_failures,
+            'retry_in': max(0.0, self.open_until - time.monotonic())
+        }
+
+    def close(self):
+        self._jobs.put((None, None, None))
+
 
 class SensorBundle:
-    def __init__(self, demo=False, warmup_cycles=5):
+    def __init__(self, demo=False, warmup_cycles=5, gas_calibration=None, latency=None, stream_particles=False,
+                 replay=None, deadlines=None):
         """
         If demo mode is True this will give dummy values for testing without the actual sensors
         :param demo:
         :type demo:
+        :param dict gas_calibration: R0 values for the gas approximation, see gas_approx.default_calibration
+        :param profiling.LatencyTracker latency: where the durations of the readings go, defaults to profiling.tracker
+        :param bool stream_particles: read the PMS5003 continuously in a background thread (ParticleStream) instead of
+        once per reading, meant for long running processes
+        :param replay.ReplaySource replay: gives recorded readings instead of the sensors, like demo mode no hardware
+        is needed, the recorded time of the last reading is in self.replay.timepoint
+        :param dict deadlines: seconds per sensor ('gas', 'particles', 'weather', 'light', 'noise') a read may take
+        before it counts as missing, see SensorGuard. Real sensors always get guarded with sensor_deadlines updated by
+        this, demo and replay only if it is given
         """
         self.warmup_cycles = warmup_cycles
+        self.latency = latency or tracker
+        self.gas_calibration = gas_calibration
         self.demo = False
-        if not demo:
-            self.particle = PMS5003()  # external particle matter sensor
-            bus = SMBus(1)
-            self.weather = BME280(i2c_dev=bus)  # basically dht22
+        self.particle_stream = None
+        self.replay = replay
+        self._replay_frame = None  # pinned for the duration of get_all() so all parts come from the same reading
+        if not demo and replay is None:
+            if hardware_error:
+                raise RuntimeError(f"SensorBundle: sensor libraries missing, only demo works: {hardware_error}")
+            if stream_particles:
+                self.particle_stream = ParticleStream()  # owns the serial port, there is no self.particle then
+                self.particle_stream.start()
+            else:
+                self.particle = PMS5003()  # external particle matter sensor
+            self.bus = SMBus(1)  # shared by every BME280 that gets created, a new SMBus each time leaks the handle
+            self.weather = BME280(i2c_dev=self.bus)  # basically dht22
             self.light = ltr559
             self.gas = gas
             self.noise = Noise()
-        else:
+        elif demo:
             self.demo = True
+        self.guards = {}
+        if deadlines is not None or not (self.demo or self.replay):
+            limits = dict(sensor_deadlines)
+            limits.update(deadlines or {})
+            reinit = {} if self.demo or self.replay else {
+                'particles': None if self.particle_stream else self._reinit_particles,
+                'weather': self._reinit_weather,
+                'light': self._reinit_light,
+                'noise': self._reinit_noise
+            }
+            attributes = {'particles': 'particle', 'weather': 'weather', 'light': 'light', 'noise': 'noise'}
+            self.guards = {
+                name: SensorGuard(name, limit, reinit.get(name),
+                                  install=partial(setattr, self, attributes[name]) if name in attributes else None)
+                for name, limit in limits.items()
+            }
+
+    # the reinit functions only create the new sensor, SensorGuard puts it in place unless the worker was abandoned
+    @staticmethod
+    def _reinit_particles():
+        return PMS5003()
+
+    def _reinit_weather(self):
+        return BME280(i2c_dev=self.bus)
+
+    @staticmethod
+    def _reinit_light():
+        if 'LTR559' not in globals():  # the old module interface has nothing to re create
+            return None
+        return LTR559()
+
+    @staticmethod
+    def _reinit_noise():
+        return Noise()
+
+    def _guarded(self, name: str, func, *args):
+        """
+        Calls func through the guard of that sensor if there is one, a missing reading is an empty dictionary
+        """
+        guard = self.guards.get(name)
+        if guard is None:
+            return func(*args)
+        result = guard.call(func, *args)
+        return {} if result is None else result
+
+    def sensor_health(self) -> dict:
+        """
+        :returns: state of every guarded sensor, {'particles': {'open': False, 'failures': 0, ...}, ...}
+        """
+        return {name: guard.state() for name, guard in self.guards.items()}
 
-    def get_all(self, one_shot=True, condensed=False):
+    @timed("cycle")
+    def get_all(self, one_shot=True, condensed=False, as_reading=False):
         """
         An array with all values, apparently the sensors delive bullshit when used after
         a while so for a one_shot measurement a warm up cycle is initiated
+        :param bool as_reading: give a reading.Reading with the values the database stores instead of the dictionary,
+        a lot smaller if many readings are kept around
         :return:
         :rtype:
         """
         if one_shot:
             self.warm_up_sensors()
-        raw_gas = self.get_gas_readings()
-        return {
-            'gas': raw_gas,
-            'approx_gas': self.approx_gas_readings(raw_gas),
-            'particles': self.get_particle_readings(reduced=condensed),
-            'weather': self.get_weather_readings(),
-            'light': self.get_light_readings(),
-            'noise': self.get_noise_readings()
-        }
+        if self.replay:
+            self._replay_frame = self.replay.advance()
+        try:
+            # a sensor that does not answer in time is simply missing from this reading
+            raw_gas = self._guarded('gas', self.get_gas_readings)
+            result = {
+                'gas': raw_gas,
+                'approx_gas': self.approx_gas_readings(raw_gas) if raw_gas else {},
+                'particles': self._guarded('particles', self.get_particle_readings, condensed),
+                'weather': self._guarded('weather', self.get_weather_readings),
+                'light': self._guarded('light', self.get_light_readings),
+                'noise': self._guarded('noise', self.get_noise_readings)
+            }
+        finally:
+            self._replay_frame = None
+        if as_reading:
+            return Reading.from_dict(result, self.replay.timepoint if self.replay else datetime.now())
+        return result
+
+    def _replayed(self, part: str) -> dict:
+        """
+        One part ('gas', 'weather', ...) of the recorded reading, outside of get_all() every call moves the replay on
+        """
+        frame = self._replay_frame if self._replay_frame is not None else self.replay.advance()
+        return copy.deepcopy(frame.get(part) or {})
 
+    @timed("warm_up")
     def warm_up_sensors(self):
         """
         apparently the various sensors are doing nothing if left unattended and need
@@ -92,18 +464,27 @@ class SensorBundle:
         :return:
         :rtype:
         """
-        if self.demo:
+        if self.demo or self.replay:
             return False
         for i in range(self.warmup_cycles):  # wind up
-            self.gas.read_all()
-            self.weather.update_sensor()
-            self.light.update_sensor()
-            try:
-                self.particle.read()
-            except ReadTimeoutError:
-                self.particle = PMS5003()  # re initialize
+            with self.latency.time("warm_up_i2c"):
+                # through the guards as well, a stuck bus must not hang the warm up either
+                self._guarded('gas', lambda: self.gas.read_all())
+                self._guarded('weather', lambda: self.weather.update_sensor())
+                self._guarded('light', lambda: self.light.update_sensor())
+            if self.particle_stream:
+                continue  # that one is always warm
+            with self.latency.time("warm_up_particles"):
+                if 'particles' in self.guards:
+                    self._guarded('particles', lambda: self.particle.read())  # the guard re initializes on errors
+                    continue
+                try:
+                    self.particle.read()
+                except ReadTimeoutError:
+                    self.particle = PMS5003()  # re initialize
         return True
 
+    @timed("gas")
     def get_gas_readings(self):
         """
         Returns the three available gas readings:
@@ -123,6 +504,8 @@ class SensorBundle:
                 "nh3": 381.21388936559697,
                 "analog": None
             }  # actually measured in my apartment in germany at the 06.05.2022 13:28
+        if self.replay:
+            return self._replayed('gas')
         raw = self.gas.read_all()
         return {
             'oxidising': raw.oxidising,
@@ -137,27 +520,18 @@ class SensorBundle:
         getting real ppm needs lab grade equipment which is rather expensive and needs finely calibrated equipment
 
         :param dict gas_readings: result of get_gas_readings()
-        :return:
+        :return: dictionary with the keys 'NO2', 'CO' and 'NH3', see gas_approx.approx_gas()
         """
 
         if not gas_readings:
             gas_readings = self.get_gas_readings()
-        # stolen here: https://forums.pimoroni.com/t/pms5003-gas-measurement-with-an-enviro-on-a-raspberry/15868/5
-        # oxidising, NO2: ppm = Rs / (6.5 * R0)
-        NO2 = gas_readings['oxidising'] / 6.5 / 20000
-        # R0 chosen to give value approx 0.01 in fresh air (detectable = 0.05 to 10)
-        # reducing,CO: ppm = 10^((log10(Rs / 3.5 / R0)) / -0.845 )
-        CO = 10 ** ((log10(gas_readings['reducing'] / 3.5 / 150000)) / -0.845)
-        # R0 chosen to give value approx 2 in fresh air (detectable = 1 to 1000)
-        # NH3: ppm = =10^((log10(Rs / 0.77 / R0)) / -0.5335 )
-        NH3 = 10 ** ((log10(gas_readings['nh3'] / 0.77 / 570000)) / -0.5335)
-        # R0 chosen to give value approx 2 in fresh air (detectable = 1 to 300)
-        return {
-            'NO2': NO2,
-            'CO': CO,
-            'NH3': NH3
-        }
+        if gas_readings.get('oxidising') is None:  # recordings can have gaps
+            return {}
+        return approx_gas(
+            gas_readings['oxidising'], gas_readings['reducing'], gas_readings['nh3'], calibration=self.gas_calibration
+        )
 
+    @timed("particles")
     def get_particle_readings(self, reduced=False):
         """
         Returns a rather complex dictionary as particle size is divided in 1l and m³ measurements
@@ -192,6 +566,17 @@ class SensorBundle:
                             },
                         "1l": {'0.3': 140, '0.5': 130, '1.0': 13, '2.5': 0, '5': 0, '10': 0}
                 }  # apartment measurement 06.05.2022 14:39
+        if self.replay:
+            particles = self._replayed('particles')
+            if reduced and 'atmo' in particles.get('m3', {}):
+                return {'m3': {'atmo': particles['m3']['atmo']}}
+            return particles
+        if self.particle_stream:
+            frame = self.particle_stream.latest(max_age=10)
+            if frame is None:
+                logger.warning("SensorBundle: no recent frame of the particle stream")
+                return {}
+            return _nest_particles(frame, reduced)
         raw = self.particle.read()
         if reduced:
             return {
@@ -227,6 +612,32 @@ class SensorBundle:
                 }
             }
 
+    def get_particle_statistics(self, interval=60.0, reduced=False):
+        """
+        Mean, median and max of the particle readings over the last interval seconds, only available with
+        stream_particles, demo and replay mode give the current values for all three
+
+        :param float interval: seconds to look back
+        :param bool reduced: see get_particle_readings()
+        :returns: dictionary {'count': n, 'mean': {...}, 'median': {...}, 'max': {...}} with the inner dictionaries in
+        the format of get_particle_readings(), None if there is no data
+        """
+        if self.demo or self.replay:
+            demo = self.get_particle_readings(reduced)
+            return {'count': 1, 'mean': demo, 'median': demo, 'max': demo}
+        if not self.particle_stream:
+            return None
+        stats = self.particle_stream.statistics(interval)
+        if not stats['count']:
+            return None
+        return {
+            'count': stats['count'],
+            'mean': _nest_particles(stats['mean'], reduced),
+            'median': _nest_particles(stats['median'], reduced),
+            'max': _nest_particles(stats['max'], reduced)
+        }
+
+    @timed("weather")
     def get_weather_readings(self):
         """
         Gives us temperature, relative humidity and pressure. Those are correlated to each other and getting absolute
@@ -243,6 +654,8 @@ class SensorBundle:
               "humidity": 33.79143792730413,
               "altitude": 19.67828936353579
             }  # my apartment 06.05.2022 14:56
+        if self.replay:
+            return self._replayed('weather')
         # qnh -> https://en.wikipedia.org/wiki/Pressure_altitude
         qnh = 1013.25
         self.weather.update_sensor()
@@ -255,6 +668,7 @@ class SensorBundle:
             "altitude": altitude  # no clue how reliable this is
         }
 
+    @timed("light")
     def get_light_readings(self):
         """
         Gives Light Readings
@@ -269,6 +683,8 @@ class SensorBundle:
                 "proximity": 0,
                 "ir": 373
            }
+        if self.replay:
+            return self._replayed('light')
         self.light.update_sensor()
         return {
             'lux': self.light.get_lux(True),
@@ -276,6 +692,7 @@ class SensorBundle:
             'ir': self.light.get_raw_als(True)[1]  # not entirely shore about this one
         }
 
+    @timed("noise")
     def get_noise_readings(self):
         """
         Gives some kind of noise reading?
@@ -286,6 +703,8 @@ class SensorBundle:
         """
         if self.demo:
             return {}
+        if self.replay:
+            return self._replayed('noise')
         return {
             '20-1K': self.noise.get_amplitude_at_frequency_range(20, 1000),
             '1K-3K': self.noise.get_amplitude_at_frequency_range(1000, 3000),
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2021 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of AirWatcher.
+#
+# AirWatcher is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# AirWatcher is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import math
+import struct
+
+from archive import _unzigzag, _zigzag
+
+"""
+Percentiles without keeping every value around, in the style of DDSketch (Datadog). Values are counted in buckets
+that grow logarithmically, bucket i holds everything between gamma^(i-1) and gamma^i. Any quantile read from that is
+within relative_accuracy of the true value, 1% by default, no matter how skewed the data is. Two sketches with the same
+accuracy merge by simply adding up their buckets, so an hourly sketch per column can be combined into days, months or
+anything in between and the result is exactly the sketch of all those values together.
+
+An hour of PM2.5 readings fits into a few dozen bytes, particle counts only ever hit a handful of buckets.
+"""
+
+_header = struct.Struct("<dIdd")  # relative accuracy, zero count, min, max
+_min_value = 1e-9  # anything closer to zero than this is counted as zero
+
+
+def _write_varint(buffer: bytearray, value: int):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(data: bytes, position: int) -> tuple:
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+class QuantileSketch:
+    __slots__ = ('relative_accuracy', 'gamma', '_log_gamma', 'positive', 'negative', 'zero', 'count', 'min', 'max')
+
+    def __init__(self, relative_accuracy=0.01):
+        """
+        :param float relative_accuracy: maximum relative error of a quantile, only sketches with the same accuracy can
+        be merged
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive = {}  # bucket index -> count
+        self.negative = {}  # same for the absolute value of negative numbers
+        self.zero = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, count=1):
+        if value is None or value != value:  # NaN
+            return
+        if value > _min_value:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.positive[index] = self.positive.get(index, 0) + count
+        elif value < -_min_value:
+            index = math.ceil(math.log(-value) / self._log_gamma)
+            self.negative[index] = self.negative.get(index, 0) + count
+        else:
+            self.zero += count
+        self.count += count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """
+        Adds all values of other to this sketch, in place
+
+        :raises ValueError: if the two do not have the same accuracy
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("QuantileSketch.merge: sketches with different accuracy cannot be merged")
+        for index, count in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + count
+        for index, count in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def _value(self, index: int) -> float:
+        # middle of bucket index, relative error to anything in it is at most relative_accuracy
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q: float):
+        """
+        :param float q: between 0 and 1, 0.5 is the median
+        :returns: the value at that quantile, None for an empty sketch
+        """
+        if not self.count:
+            return None
+        if not 0 <= q <= 1:
+            raise ValueError("QuantileSketch.quantile: q has to be between 0 and 1")
+        rank = q * (self.count - 1)
+        seen = 0
+        value = None
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                value = -self._value(index)
+                break
+        else:
+            seen += self.zero
+            if seen > rank:
+                value = 0.0
+            else:
+                for index in sorted(self.positive):
+                    seen += self.positive[index]
+                    if seen > rank:
+                        value = self._value(index)
+                        break
+        if value is None:
+            value = self.max
+        return max(self.min, min(self.max, value))
+
+    def to_bytes(self) -> bytes:
+        """
+        Header plus both stores as varints, bucket indices as difference to the one before
+        """
+        buffer = bytearray(_header.pack(self.relative_accuracy, self.zero, self.min, self.max))
+        for store in (self.positive, self.negative):
+            _write_varint(buffer, len(store))
+            previous = None
+            for index in sorted(store):
+                if previous is None:
+                    _write_varint(buffer, _zigzag(index))  # values below 1 have negative indices
+                else:
+                    _write_varint(buffer, index - previous)
+                _write_varint(buffer, store[index])
+                previous = index
+        return bytes(buffer)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """
+        :rtype: QuantileSketch
+        """
+        relative_accuracy, zero, minimum, maximum = _header.unpack_from(data)
+        sketch = cls(relative_accuracy)
+        sketch.zero, sketch.min, sketch.max = zero, minimum, maximum
+        position = _header.size
+        for store in (sketch.positive, sketch.negative):
+            length, position = _read_varint(data, position)
+            index = None
+            for _ in range(length):
+                step, position = _read_varint(data, position)
+                if index is None:
+                    index = _unzigzag(step)
+                else:
+                    index += step
+                store[index], position = _read_varint(data, position)
+        sketch.count = zero + sum(sketch.positive.values()) + sum(sketch.negative.values())
+        return sketch
+
+    def __len__(self):
+        return self.count
@@ -20,9 +20,17 @@ magnitude = numpy.abs(numpy.fft.rfft(recording[:, 0], n=sample_rate))
 print(numpy.mean(magnitude[20:2000]))
 """
 
+import hashlib
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
 import numpy
 import wave
 
+logger = logging.getLogger(__name__)
+
 
 def audio_sparklines(audio_mono_file: str, chars=32, skip=1, low_pass=None, high_pass=None) -> str:
     """
@@ -94,8 +102,175 @@ def audio_sparklines(audio_mono_file: str, chars=32, skip=1, low_pass=None, high
     return spark_line
 
 
+def file_digest(file_path: str) -> str:
+    """
+    sha256 of the content of a file, read in blocks so big recordings do not end up in memory twice
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file_in:
+        for block in iter(lambda: file_in.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SparklineCache:
+    """
+    Remembers sparklines in a small sqlite file, keyed by the content of the wave file and the parameters so renamed or
+    copied recordings are still found and a changed file is not. Holds at most max_entries lines, the ones that were
+    not asked for the longest get thrown out. Paths are remembered with size and modification time as well, an
+    unchanged file does not even get hashed again
+    """
+    def __init__(self, cache_path: str, max_entries=10000):
+        self.max_entries = max_entries
+        self.db = sqlite3.connect(cache_path)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS sparklines (
+            key TEXT PRIMARY KEY,
+            line TEXT NOT NULL,
+            used REAL NOT NULL
+        );""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS sparklines_used ON sparklines (used);")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL,
+            digest TEXT NOT NULL
+        );""")
+        self.db.commit()
+
+    @staticmethod
+    def key(digest: str, chars=32, skip=1, low_pass=None, high_pass=None) -> str:
+        return f"{digest}:{chars}:{skip}:{low_pass}:{high_pass}"
+
+    def digest(self, file_path: str) -> str:
+        """
+        Content hash of a file, from the remembered paths if size and modification time did not change
+        """
+        path = os.path.realpath(file_path)
+        stat = os.stat(path)
+        known = self.db.execute("SELECT size, mtime, digest FROM files WHERE path = ?", (path, )).fetchone()
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        digest = file_digest(path)
+        self.db.execute("INSERT OR REPLACE INTO files (path, size, mtime, digest) VALUES (?, ?, ?, ?)",
+                        (path, stat.st_size, stat.st_mtime_ns, digest))
+        return digest
+
+    def get(self, key: str):
+        """
+        :returns: the remembered line or None, a hit counts as use for the eviction
+        """
+        row = self.db.execute("SELECT line FROM sparklines WHERE key = ?", (key, )).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE sparklines SET used = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, line: str):
+        self.db.execute("INSERT OR REPLACE INTO sparklines (key, line, used) VALUES (?, ?, ?)", (key, line, time.time()))
+
+    def evict(self):
+        """
+        Throws out the least recently used lines beyond max_entries and commits
+        """
+        self.db.execute("""DELETE FROM sparklines WHERE key IN (
+                               SELECT key FROM sparklines ORDER BY used DESC LIMIT -1 OFFSET ?)""",
+                        (self.max_entries, ))
+        self.db.execute("DELETE FROM files WHERE digest NOT IN (SELECT substr(key, 1, 64) FROM sparklines)")
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def _sparkline_job(job: tuple) -> tuple:
+    # runs in a worker of directory_sparklines, an unreadable file gives an error message instead of killing the batch
+    file_path, key, params = job
+    try:
+        return file_path, key, audio_sparklines(file_path, **params), None
+    except (OSError, EOFError, wave.Error, ValueError) as err:
+        return file_path, key, None, f"{type(err).__name__}: {err}"
+
+
+def _collect(done, result: dict, cache):
+    for file_path, key, line, error in done:
+        result[os.path.basename(file_path)] = line
+        if error:
+            logger.warning(f"directory_sparklines: skipping {file_path}, {error}")
+        elif cache:
+            cache.put(key, line)
+
+
+def directory_sparklines(folder: str, chars=32, skip=1, low_pass=None, high_pass=None, cache_path=None,
+                         max_entries=10000, workers=None, extension=".wav") -> dict:
+    """
+    Sparklines of every recording in a folder (not recursive), the ones that are not in the cache yet are calculated in
+    a pool of worker processes, one file per worker at a time. With a cache a second overview of the same archive only
+    costs the directory listing and a few lookups
+
+    :param str folder: where the recordings of record_audio() are
+    :param int chars: see audio_sparklines()
+    :param int skip: see audio_sparklines()
+    :param int low_pass: see audio_sparklines()
+    :param int high_pass: see audio_sparklines()
+    :param str cache_path: sqlite file for SparklineCache, None calculates everything every time
+    :param int max_entries: size limit of the cache in lines
+    :param int workers: number of processes, defaults to the number of cores
+    :param str extension: only files ending in this
+    :returns: dictionary { file name: sparkline } sorted by name, None for files that could not be read
+    :rtype: dict
+    """
+    params = {'chars': chars, 'skip': skip, 'low_pass': low_pass, 'high_pass': high_pass}
+    names = sorted(x for x in os.listdir(folder) if x.lower().endswith(extension))
+    cache = SparklineCache(cache_path, max_entries) if cache_path else None
+    result = {}
+    jobs = []
+    for name in names:
+        file_path = os.path.join(folder, name)
+        key = None
+        if cache:
+            try:
+                key = cache.key(cache.digest(file_path), **params)
+            except OSError:
+                result[name] = None
+                continue
+            line = cache.get(key)
+            if line is not None:
+                result[name] = line
+                continue
+        jobs.append((file_path, key, params))
+    if jobs:
+        workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+        if workers == 1:  # no point in starting a process for a single file
+            _collect(map(_sparkline_job, jobs), result, cache)
+        else:
+            with multiprocessing.Pool(workers) as pool:
+                _collect(pool.imap_unordered(_sparkline_job, jobs), result, cache)
+    if cache:
+        cache.evict()
+        cache.close()
+    return {name: result[name] for name in names}
+
+
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="audio sparklines of a wave file or every wave file in a folder")
+    parser.add_argument("path", nargs="?", default="../rose_mono.wav", help="mono wave file or folder of them")
+    parser.add_argument("--chars", type=int, default=32)
+    parser.add_argument("--skip", type=int, default=1)
+    parser.add_argument("--low-pass", type=int)
+    parser.add_argument("--high-pass", type=int)
+    parser.add_argument("--cache", help="sqlite file that remembers the lines of a folder between runs")
+    parser.add_argument("--workers", type=int, help="processes for a folder, defaults to the number of cores")
+    args = parser.parse_args()
     epoch = time_ns()
-    print(audio_sparklines("../rose_mono.wav", skip=1))
+    if os.path.isdir(args.path):
+        lines = directory_sparklines(args.path, args.chars, args.skip, args.low_pass, args.high_pass,
+                                     cache_path=args.cache, workers=args.workers)
+        width = max((len(x) for x in lines), default=0)
+        for file_name, spark_line in lines.items():
+            print(f"{file_name:<{width}} {spark_line if spark_line is not None else '(unreadable)'}")
+    else:
+        print(audio_sparklines(args.path, args.chars, args.skip, args.low_pass, args.high_pass))
     print(f"Elapsed: {int((time_ns()-epoch)/1000000)}ms")
 
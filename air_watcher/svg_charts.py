@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2021 by BurnoutDV, <development@burnoutdv.com>
+#
+# This file is part of AirWatcher.
+#
+# AirWatcher is free software: you can redistribute
+# it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later version.
+#
+# AirWatcher is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
+
+import math
+from datetime import datetime
+from html import escape
+
+"""
+The same four charts as visualize.py, but written as plain SVG text instead of going through matplotlib. Importing
+matplotlib alone takes seconds on a Pi Zero and a 300 dpi png of three lines is a few hundred kilobytes, this only
+needs the standard library, renders in milliseconds and the result is a few dozen kilobytes that any browser scales
+without getting blurry. Deliberately simple: line charts with a time axis, one or two y-axes per panel and a legend.
+
+Takes the transfer format like the plot_* functions, hand it through downsample_to_width() first, there is no point
+in more points than pixels. render_view() writes .svg or, for anything ending in .html, a minimal html page, and
+render_dashboard() puts all four into one page.
+"""
+
+# one chart per view, every panel has lines on the left axis and optionally some on a right axis, the labels and
+# colours are the ones of the matplotlib version
+views = {
+    'weather': [{
+        'title': "Temperature over Time",
+        'y_label': "Temperature C /Humidity %",
+        'lines': [("Temperature", "weather|temperature", "#d62728"), ("Humidity", "weather|humidity", "#2ca02c")],
+        'y2_label': "Pressure hPa",
+        'lines2': [("Pressure", "weather|pressure", "#1f77b4")]
+    }],
+    'particles': [{
+        'title': "Particles per size overtime",
+        'y_label': "n Particles",
+        'lines': [
+            ("PM1.0 ug/m3 (ultrafine particles)", "particles|m3|atmo|1.0", "#1f77b4"),
+            ("PM2.5 ug/m3 (combustion particles, organic compounds, metals)", "particles|m3|atmo|2.5", "#ff7f0e"),
+            ("PM10 ug/m3 (dust, pollen, mould spores)", "particles|m3|atmo|10", "#2ca02c")
+        ]
+    }],
+    'gas': [{
+        'title': "Gas Sensor readings",
+        'y_label': "sensor output in kOhm",
+        'lines': [("oxidising gases", "gas|oxidising", "#008000"), ("reducing gases", "gas|reducing", "#ff0000"),
+                  ("ammonia", "gas|nh3", "#0000ff")]
+    }, {
+        'title': "Approximated Gas",
+        'y_label': "Approximated ppm",
+        'lines': [("NO2", "approx_gas|NO2", "#00bfbf"), ("CO", "approx_gas|CO", "#bf00bf")],
+        'y2_label': "NH3 ppm",
+        'lines2': [("NH3", "approx_gas|NH3", "#bfbf00")]
+    }],
+    'light': [{
+        'title': "Light over Time",
+        'y_label': "Lux",
+        'lines': [("Light (Visible+IR)", "light|lux", "#bfbf00"), ("Infrared", "light|ir", "#ff0000")]
+    }]
+}
+
+_style = ("text{font:11px sans-serif;fill:#333}.title{font-size:14px}.axis{stroke:#333;fill:none}"
+          ".grid{stroke:#ddd}path.line{fill:none;stroke-width:1.2;stroke-linejoin:round}")
+_margin = {'left': 64, 'right': 20, 'right2': 64, 'top': 28, 'bottom': 44}
+
+
+def columns(raw_values: dict, paths: list) -> tuple:
+    """
+    Turns the transfer format into columns, keys that are no iso strings are skipped, values that are not finite
+    (NaN, or inf from a gas approximation with a resistance of 0) become None and show up as gaps
+
+    :param dict raw_values: dictionary of the format { 'iso_string' : {'data_a': {}, ...}, ...}
+    :param list paths: series in deep_get format like "weather|temperature"
+    :returns: tuple (sorted list of datetime, {path: list of values or None})
+    :rtype: tuple
+    """
+    stamps = []
+    for key in raw_values:
+        try:
+            stamps.append((datetime.fromisoformat(key), key))
+        except ValueError:
+            continue
+    stamps.sort()
+    split = [(path, path.split("|")) for path in paths]
+    series = {path: [] for path in paths}
+    for _, key in stamps:
+        entry = raw_values[key]
+        for path, keys in split:
+            value = entry
+            for part in keys:
+                value = value.get(part) if isinstance(value, dict) else None
+            series[path].append(value if isinstance(value, (int, float)) and math.isfinite(value) else None)
+    return [stamp for stamp, _ in stamps], series
+
+
+def _ticks(low: float, high: float, count=5) -> tuple:
+    """
+    Rounds a value range outwards to 'nice' numbers (1, 2, 5 times a power of ten)
+
+    :returns: tuple (low, high, list of tick values)
+    """
+    if high <= low:
+        low, high = low - 1, high + 1
+    raw_step = (high - low) / count
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(x * magnitude for x in (1, 2, 5, 10) if x * magnitude >= raw_step)
+    low, high = math.floor(low / step) * step, math.ceil(high / step) * step
+    ticks = [low + i * step for i in range(int(round((high - low) / step)) + 1)]
+    return low, high, ticks
+
+
+def _number(value: float) -> str:
+    if value == int(value) and abs(value) < 1e6:
+        return str(int(value))
+    return f"{value:.4g}"
+
+
+def _path(times: list, values: list, x, y) -> str:
+    # one path per line, gaps (None) start a new sub path, pairs after an L are implicit line-tos which keeps it short
+    segments = [[]]
+    for stamp, value in zip(times, values):
+        if value is None or not math.isfinite(value):
+            if segments[-1]:
+                segments.append([])
+            continue
+        segments[-1].append(f"{x(stamp):.1f},{y(value):.1f}")
+    return "".join("M" + points[0] + ("L" + " ".join(points[1:]) if len(points) > 1 else "")
+                   for points in segments if points)
+
+
+def _panel(out: list, panel: dict, times: list, series: dict, top: float, width: int, height: int, day_only: bool):
+    """
+    Appends the svg elements of one panel (axes, grid, lines and legend) to out
+    """
+    has_right = bool(panel.get('lines2'))
+    left = _margin['left']
+    right = width - (_margin['right2'] if has_right else _margin['right'])
+    upper = top + _margin['top']
+    lower = top + height - _margin['bottom']
+    out.append(f'<text class="title" x="{(left + right) / 2:.0f}" y="{top + 18:.0f}" text-anchor="middle">'
+               f'{escape(panel["title"])}</text>')
+    if not times:
+        out.append(f'<text x="{(left + right) / 2:.0f}" y="{(upper + lower) / 2:.0f}" text-anchor="middle">no data</text>')
+        return
+    start, end = times[0].timestamp(), times[-1].timestamp()
+    span = (end - start) or 1.0
+
+    def x(stamp):
+        return left + (stamp.timestamp() - start) / span * (right - left)
+
+    axes = [('lines', left, -6, "end", panel.get('y_label'))]
+    if has_right:
+        axes.append(('lines2', right, 6, "start", panel.get('y2_label')))
+    scales = {}
+    for key, position, offset, anchor, label in axes:
+        values = [v for _, path, _ in panel[key] for v in series[path] if v is not None and math.isfinite(v)]
+        low, high, ticks = _ticks(min(values), max(values)) if values else _ticks(0, 1)
+
+        def y(value, low=low, high=high):
+            return lower - (value - low) / (high - low) * (lower - upper)
+        scales[key] = y
+        out.append(f'<path class="axis" d="M{position},{upper:.0f}V{lower:.0f}"/>')
+        for tick in ticks:
+            ty = y(tick)
+            if key == 'lines':
+                out.append(f'<path class="grid" d="M{left},{ty:.1f}H{right}"/>')
+            out.append(f'<text x="{position + offset}" y="{ty + 4:.1f}" text-anchor="{anchor}">{_number(tick)}</text>')
+        if label:
+            lx = position - 50 if key == 'lines' else position + 50
+            out.append(f'<text x="{lx}" y="{(upper + lower) / 2:.0f}" text-anchor="middle" '
+                       f'transform="rotate(-90 {lx} {(upper + lower) / 2:.0f})">{escape(label)}</text>')
+    out.append(f'<path class="axis" d="M{left},{lower:.0f}H{right}"/>')
+    time_format = "%H:%M" if day_only else "%m-%d %H:%M"
+    for i in range(6):
+        tx = left + i * (right - left) / 5
+        stamp = datetime.fromtimestamp(start + i * span / 5)
+        out.append(f'<path class="axis" d="M{tx:.1f},{lower:.0f}v4"/>')
+        out.append(f'<text x="{tx:.1f}" y="{lower + 16:.0f}" text-anchor="middle">{stamp.strftime(time_format)}</text>')
+    out.append(f'<text x="{(left + right) / 2:.0f}" y="{lower + 34:.0f}" text-anchor="middle">Time</text>')
+    legend_y = upper + 12
+    for key in ('lines', 'lines2'):
+        for label, path, color in panel.get(key, []):
+            d = _path(times, series[path], x, scales[key])
+            if d:
+                out.append(f'<path class="line" stroke="{color}" d="{d}"/>')
+            out.append(f'<path stroke="{color}" stroke-width="2" d="M{left + 8},{legend_y - 4:.0f}h16"/>'
+                       f'<text x="{left + 28}" y="{legend_y:.0f}">{escape(label)}</text>')
+            legend_y += 14
+
+
+def render_svg(name: str, raw_values: dict, day_only=True, width=800, height=400) -> str:
+    """
+    Draws one of the views as svg document
+
+    :param str name: key of views
+    :param dict raw_values: transfer format, see columns()
+    :param bool day_only: only hours and minutes on the time axis, otherwise the date as well
+    :param int width: size in pixels
+    :param int height: size of one panel in pixels, the gas view has two of them
+    :rtype: str
+    """
+    panels = views[name]
+    paths = [path for panel in panels for key in ('lines', 'lines2') for _, path, _ in panel.get(key, [])]
+    times, series = columns(raw_values, paths)
+    total = height * len(panels)
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{total}" viewBox="0 0 {width} {total}">'
+           f'<style>{_style}</style><rect width="100%" height="100%" fill="#fff"/>']
+    for index, panel in enumerate(panels):
+        _panel(out, panel, times, series, index * height, width, height, day_only)
+    out.append('</svg>')
+    return "\n".join(out)
+
+
+def _html(title: str, svgs: list) -> str:
+    return (f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{escape(title)}</title></head>\n<body>\n'
+            + "\n".join(svgs) + "\n</body></html>\n")
+
+
+def render_view(name: str, raw_values: dict, output=None, day_only=True, width=800, height=400) -> str:
+    """
+    Writes one view into a file, html if the name ends with .html, svg otherwise
+
+    :param str output: path of the file, defaults to name.svg
+    :returns: the path that was written
+    :rtype: str
+    """
+    output = output or f"{name}.svg"
+    document = render_svg(name, raw_values, day_only, width, height)
+    if output.endswith(".html"):
+        document = _html(name, [document])
+    with open(output, "w", encoding="utf-8") as file_out:
+        file_out.write(document)
+    return output
+
+
+def render_dashboard(raw_values: dict, output="dashboard.html", day_only=True, width=800, height=400) -> str:
+    """
+    All four views in one html page
+    """
+    document = _html("AirWatcher", [render_svg(name, raw_values, day_only, width, height) for name in views])
+    with open(output, "w", encoding="utf-8") as file_out:
+        file_out.write(document)
+    return output
+
+
+def svg_weather(raw_values: dict, output="weather.svg", day_only=True, width=800, height=400):
+    return render_view('weather', raw_values, output, day_only, width, height)
+
+
+def svg_particles(raw_values: dict, output="particles.svg", day_only=True, width=800, height=400):
+    return render_view('particles', raw_values, output, day_only, width, height)
+
+
+def svg_gas(raw_values: dict, output="gases.svg", day_only=True, width=800, height=400):
+    return render_view('gas', raw_values, output, day_only, width, height)
+
+
+def svg_light(raw_values: dict, output="light.svg", day_only=True, width=800, height=400):
+    return render_view('light', raw_values, output, day_only, width, height)
@@ -20,14 +20,15 @@
 #
 # @license GPL-3.0-only <https://www.gnu.org/licenses/gpl-3.0.en.html>
 
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 from datetime import date, datetime, time, timedelta
 import json
 import logging
 import os
 import sys
 
+from downsample import downsample_to_width, plot_series
+from gas_approx import approx_gas
+
 
 logger = logging.getLogger(__name__)
 
@@ -39,10 +40,23 @@ This is a rather useless piece of software, just see it as set of scripts to qui
 of it. This is actually the first time i ever touched matplot lib and its definetly not needed for this project but
 i wanted to see the values i got from my first set of scripts. For now this is hardcoded to only displays value of
 today
+
+matplotlib is only imported once the first plot_* function runs, importing it takes seconds on a Pi Zero. With svg or
+html as argument the charts are drawn by svg_charts.py instead and matplotlib is not needed at all:
+
+python3 visualize.py days 7 svg
 """
 
 
+def _pyplot():
+    # matplotlib.pyplot and matplotlib.dates, imported on first use
+    import matplotlib.pyplot
+    import matplotlib.dates
+    return matplotlib.pyplot, matplotlib.dates
+
+
 def plot_weather(raw_values: dict, output="weather.png", day_only=True, dpi=300):
+    plt, mdates = _pyplot()
     weather_over_time = {}
     for iso_data in raw_values:
         that_date = datetime.fromisoformat(iso_data)
@@ -72,6 +86,7 @@ def plot_weather(raw_values: dict, output="weather.png", day_only=True, dpi=300)
 
 
 def plot_particles(raw_values: dict, output="particles.png", day_only=True, dpi=300):
+    plt, mdates = _pyplot()
     particles_over_time = {}
     for iso_data in raw_values:
         that_date = datetime.fromisoformat(iso_data)
@@ -101,6 +116,7 @@ def plot_particles(raw_values: dict, output="particles.png", day_only=True, dpi=
 
 
 def plot_gas(raw_values, output="gases.png", day_only=True, dpi=300):
+    plt, mdates = _pyplot()
     gases_over_time = {}
     approx_over_time = {}
     for iso_data in raw_values:
@@ -148,6 +164,7 @@ def plot_gas(raw_values, output="gases.png", day_only=True, dpi=300):
 
 
 def plot_light(raw_values: dict, output="light.png", day_only=True, dpi=300):
+    plt, mdates = _pyplot()
     light_over_time = {}
     for iso_data in raw_values:
         that_date = datetime.fromisoformat(iso_data)
@@ -170,25 +187,6 @@ def plot_light(raw_values: dict, output="light.png", day_only=True, dpi=300):
     plt.savefig(output, dpi=dpi)
 
 
-def _calc_approx_gas(gas_readings: dict):
-    from math import log10
-    # stolen here: https://forums.pimoroni.com/t/pms5003-gas-measurement-with-an-enviro-on-a-raspberry/15868/5
-    # oxidising, NO2: ppm = Rs / (6.5 * R0)
-    NO2 = gas_readings['oxidising'] / 6.5 / 20000
-    # R0 chosen to give value approx 0.01 in fresh air (detectable = 0.05 to 10)
-    # reducing,CO: ppm = 10^((log10(Rs / 3.5 / R0)) / -0.845 )
-    CO = 10 ** ((log10(gas_readings['reducing'] / 3.5 / 150000)) / -0.845)
-    # R0 chosen to give value approx 2 in fresh air (detectable = 1 to 1000)
-    # NH3: ppm = =10^((log10(Rs / 0.77 / R0)) / -0.5335 )
-    NH3 = 10 ** ((log10(gas_readings['nh3'] / 0.77 / 570000)) / -0.5335)
-    # R0 chosen to give value approx 2 in fresh air (detectable = 1 to 300)
-    return {
-        'NO2': NO2,
-        'CO': CO,
-        'NH3': NH3
-    }
-
-
 if __name__ == "__main__":
     file = "local_cache.db"
     if os.path.isfile(f"./{file}"):
@@ -210,6 +208,7 @@ if __name__ == "__main__":
     limit_date_display = True
     days = 2
     args = sys.argv
+    renderer = next((x for x in args[1:] if x in ("svg", "html")), "png")
     if len(args) > 2 and args[1] == "days":  # argparse is a think
         try:
             days = int(args[2])
@@ -221,10 +220,32 @@ if __name__ == "__main__":
 
     print(f"Querying database for all data from {datetime.today().isoformat()[:16]} till {(datetime.today()-timedelta(seconds=3600*24*int(days/2))).isoformat()[:16]}")
     raw_data = local_db.fetch_by_aoe_date(datetime.today(), 3600*24*days)  # last 24 hours
-    # calculating the approximation of gas that is not written into the database
-    for key in raw_data:
-        raw_data[key]['approx_gas'] = _calc_approx_gas(raw_data[key]['gas'])
-    plot_weather(raw_data, day_only=limit_date_display)
-    plot_particles(raw_data, day_only=limit_date_display)
-    plot_gas(raw_data, day_only=limit_date_display)
-    plot_light(raw_data, day_only=limit_date_display)
\ No newline at end of file
+    # databases that could not be backfilled yet have no approximation of gas, calculating those in one go
+    missing = [key for key in raw_data if 'approx_gas' not in raw_data[key] and 'gas' in raw_data[key]]
+    if missing:
+        approx = approx_gas(
+            [raw_data[key]['gas'].get('oxidising') for key in missing],
+            [raw_data[key]['gas'].get('reducing') for key in missing],
+            [raw_data[key]['gas'].get('nh3') for key in missing],
+            calibration=local_db.gas_calibration
+        )
+        for i, key in enumerate(missing):
+            raw_data[key]['approx_gas'] = {gas: float(values[i]) for gas, values in approx.items()}
+    if renderer != "png":
+        import svg_charts
+        width = 800
+        for name in svg_charts.views:
+            output = svg_charts.render_view(
+                name, downsample_to_width(raw_data, plot_series[name], width), f"{name}.{renderer}",
+                day_only=limit_date_display, width=width)
+            print(f"wrote {output}")
+        exit(0)
+    # no need to hand more points to matplotlib than there are pixels
+    plt, _ = _pyplot()
+    dpi = 300
+    pixels = int(plt.rcParams['figure.figsize'][0] * dpi)
+    plot_weather(downsample_to_width(raw_data, plot_series['weather'], pixels), day_only=limit_date_display, dpi=dpi)
+    plot_particles(downsample_to_width(raw_data, plot_series['particles'], pixels), day_only=limit_date_display,
+                   dpi=dpi)
+    plot_gas(downsample_to_width(raw_data, plot_series['gas'], pixels), day_only=limit_date_display, dpi=dpi)
+    plot_light(downsample_to_width(raw_data, plot_series['light'], pixels), day_only=limit_date_display, dpi=dpi)
\ No newline at end of file